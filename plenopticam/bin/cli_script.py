@@ -22,6 +22,7 @@ __license__ = """
 
 import getopt
 import sys, os
+from multiprocessing import freeze_support
 
 # local imports
 from plenopticam import lfp_reader
@@ -32,7 +33,7 @@ from plenopticam import lfp_refocuser
 from plenopticam.lfp_reader.top_level import SUPP_FILE_EXT
 from plenopticam import misc
 from plenopticam.cfg import PlenopticamConfig
-from plenopticam.cfg.constants import CALI_METH, SMPL_METH, CLIF_OPTS, CLIF_SHRT
+from plenopticam.cfg.constants import CALI_METH, SMPL_METH, DMSC_METH, CLIF_OPTS, CLIF_SHRT
 from plenopticam import __version__
 from plenopticam.gui.top_level import PlenopticamApp
 
@@ -51,6 +52,8 @@ def usage():
     print("                                  "+', '.join(['"'+m+'"' for m in CALI_METH]))
     print("-s <str>,      --smpl='global'    Resampling method, e.g.:")
     print("                                  "+', '.join(['"'+m+'"' for m in SMPL_METH]))
+    print("--dmsc='menon'                    Demosaicing method, e.g.:")
+    print("                                  "+', '.join(['"'+m+'"' for m in DMSC_METH]))
     print("-h,            --help             Print this help message")
     print("")
     # boolean options
@@ -64,6 +67,9 @@ def usage():
     print("--lier                            Hot pixel treatment")
     print("--arti                            Artifact removal")
     print("--remo                            Override output folder")
+    print("--lens                            Lens-wise demosaicing")
+    print("--vfit                            De-vignetting by micro image fit (noisy white images)")
+    print("--lut                             Alignment look-up table reused per calibration (stored on disk)")
     print("")
 
 
@@ -94,6 +100,8 @@ def parse_options(argv, cfg):
                 cfg.params[cfg.cal_meth] = arg.strip(" \"\'") if arg.strip(" \"\'") in CALI_METH else CALI_METH[0]
             if opt in ("-s", "--smpl"):
                 cfg.params[cfg.smp_meth] = arg.strip(" \"\'") if arg.strip(" \"\'") in SMPL_METH else SMPL_METH[0]
+            if opt == "--dmsc":
+                cfg.params[cfg.dms_meth] = arg.strip(" \"\'") if arg.strip(" \"\'") in DMSC_METH else DMSC_METH[-1]
             if opt in ("-p", "--patch"):
                 cfg.params[cfg.ptc_leng] = misc.str2type(arg)
             if opt in ("-r", "--refo"):
@@ -129,12 +137,21 @@ def parse_options(argv, cfg):
                 cfg.params[cfg.opt_dpth] = True
             if opt == "--remo":
                 cfg.params[cfg.dir_remo] = True
+            if opt == "--lens":
+                cfg.params[cfg.opt_lens] = True
+            if opt == "--vfit":
+                cfg.params[cfg.opt_vfit] = True
+            if opt == "--lut":
+                cfg.params[cfg.opt_lut_] = True
 
     return cfg
 
 
 def main():
 
+    # enable process pools in frozen executables
+    freeze_support()
+
     # program info
     print("\nPlenoptiCam v%s \n" % __version__)
 
@@ -209,8 +226,9 @@ def main():
         # perform calibration if previously computed calibration data does not exist
         meta_cond = not (os.path.exists(cfg.params[cfg.cal_meta]) and cfg.params[cfg.cal_meta].lower().endswith('json'))
         if meta_cond or cfg.params[cfg.opt_cali]:
-            # perform centroid calibration
-            calibrator = lfp_calibrator.LfpCalibrator(wht_img, cfg, sta)
+            # perform centroid calibration (warm start from previous calibration data if re-calibration is forced)
+            calibs = cfg.load_json(cfg.params[cfg.cal_meta]) if not meta_cond else None
+            calibrator = lfp_calibrator.LfpCalibrator(wht_img, cfg, sta, calibs=calibs)
             calibrator.main()
             cfg = calibrator.cfg
 
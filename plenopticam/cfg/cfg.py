@@ -25,7 +25,7 @@ from plenopticam.misc.status import PlenopticamStatus
 from plenopticam.misc.errors import PlenopticamError
 from plenopticam.misc.os_ops import mkdir_p
 from plenopticam.misc.type_checks import *
-from plenopticam.cfg.constants import PARAMS_KEYS, PARAMS_VALS, CALIBS_KEYS
+from plenopticam.cfg.constants import PARAMS_KEYS, PARAMS_VALS, CALIBS_KEYS, ALGN_FILE, ALGN_META
 
 # external libs
 import json
@@ -37,11 +37,11 @@ import warnings
 class PlenopticamConfig(object):
 
     # static class variables for key parameters
-    lfp_path, cal_path, cal_meta, cal_meth, smp_meth, \
+    lfp_path, cal_path, cal_meta, cal_meth, smp_meth, dms_meth, \
     ptc_leng, \
     ran_refo, \
     opt_cali, opt_vign, opt_lier, opt_cont, opt_colo, opt_awb_, opt_sat_, opt_view, opt_refo, opt_refi, opt_pflu, \
-    opt_arti, opt_rota, opt_dbug, opt_prnt, opt_dpth, dir_remo \
+    opt_arti, opt_rota, opt_dbug, opt_prnt, opt_dpth, dir_remo, opt_lens, opt_vfit, opt_lut_ \
     = PARAMS_KEYS
 
     pat_type, ptc_mean, mic_list = CALIBS_KEYS
@@ -83,6 +83,9 @@ class PlenopticamConfig(object):
         # test if config parameters present
         if not self.params.keys():
             raise FileNotFoundError('Config file could not be loaded')
+        # complement parameters missing in config files of previous versions by their defaults
+        for key, val in zip(PARAMS_KEYS, PARAMS_VALS):
+            self.params.setdefault(key, val)
         # number of values in loaded config is supposed to equal config constants specified in the tool
         if not len(self.params.keys()) == len(PARAMS_KEYS):
             warnings.warn('Config file corrupted', UserWarning)
@@ -221,6 +224,11 @@ class PlenopticamConfig(object):
 
         return True
 
+    @property
+    def dft_path(self):
+        """ directory path of persistent sensor defect maps """
+        return join(self._dir_path, 'defects')
+
     @property
     def exp_path(self):
         """ export directory path """
@@ -241,7 +249,7 @@ class PlenopticamConfig(object):
                (not self.cond_meta_file() and self.cond_lfp_align())
 
     def cond_lfp_align(self):
-        return not exists(join(self.exp_path, 'lfp_img_align.pkl'))
+        return not (exists(join(self.exp_path, ALGN_FILE)) and exists(join(self.exp_path, ALGN_META)))
 
     def cond_meta_file(self):
 
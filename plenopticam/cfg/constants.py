@@ -6,6 +6,7 @@ PARAMS_KEYS = (
     'cal_meta',
     'cal_meth',
     'smp_meth',
+    'dms_meth',
     # integers
     'ptc_leng',
     # lists
@@ -27,7 +28,10 @@ PARAMS_KEYS = (
     'opt_dbug',
     'opt_prnt',
     'opt_dpth',
-    'dir_remo'
+    'dir_remo',
+    'opt_lens',
+    'opt_vfit',
+    'opt_lut_'
 )
 
 # dictionary values for configuration parameters in json file
@@ -38,6 +42,7 @@ PARAMS_VALS = (
     '',
     '',
     '',
+    'menon',
     # integers
     7,
     # lists
@@ -59,6 +64,9 @@ PARAMS_VALS = (
     False,
     True,
     True,
+    False,
+    False,
+    False,
     False
 )
 
@@ -69,6 +77,7 @@ PARAMS_TYPE = (
     'str',
     'sel',
     'sel',
+    'sel',
     # integers
     'sel',
     # lists
@@ -90,6 +99,9 @@ PARAMS_TYPE = (
     'bool',
     'bool',
     'bool',
+    'bool',
+    'bool',
+    'bool',
     'bool'
 )
 
@@ -100,6 +112,7 @@ PARAMS_NAME = (
     'Metadata file',
     'Calibration method',
     'Resampling method',
+    'Demosaicing method',
     # integers
     'Micro image patch size',
     # lists
@@ -121,7 +134,10 @@ PARAMS_NAME = (
     'Debug option',
     'Status print option',
     'Depth map',
-    'Remove output folder'
+    'Remove output folder',
+    'Lens-wise demosaicing',
+    'De-vignetting patch fit',
+    'Alignment look-up table'
 )
 
 # dictionary keys for calibration parameters names in json file
@@ -137,6 +153,9 @@ PFLU_VALS = ('vertical', 'horizontal', 'skew up', 'skew down')
 PTCH_SIZE = list(range(3, 99, 2))
 CALI_METH = ('area', 'peak', 'grid-fit', 'vign-fit', 'corn-fit')
 SMPL_METH = ('global', 'local')
+DMSC_METH = ('bilinear', 'malvar', 'menon')
+ALGN_FILE = 'lfp_img_align.npy'
+ALGN_META = 'lfp_img_align.json'
 
 # command line interface options
 CLIF_SHRT = "ghf:c:p:r:m:s:"
@@ -149,6 +168,7 @@ CLIF_OPTS = [
     "meta=",
     "meth=",
     "smpl=",
+    "dmsc=",
     # integers
     "patch=",
     # lists
@@ -170,5 +190,8 @@ CLIF_OPTS = [
     "dbug",
     "prnt",
     "dpth",
-    "remo"
+    "remo",
+    "lens",
+    "vfit",
+    "lut"
 ]
@@ -28,6 +28,7 @@ except ImportError:
 import os
 import sys
 from tempfile import mkstemp
+from multiprocessing import freeze_support
 
 # local python files
 from plenopticam import __version__
@@ -91,6 +92,9 @@ class PlenopticamApp(tk.Tk):
 
 def main_app():
 
+    # enable process pools in frozen executables
+    freeze_support()
+
     # instantiate object
     app_win = PlenopticamApp()
     # make not resizable
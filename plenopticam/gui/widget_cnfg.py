@@ -89,6 +89,9 @@ class CnfgWidget(tk.Toplevel):
                 if key == self.cfg.smp_meth:
                     value_ran, default = (c.SMPL_METH, c.SMPL_METH[0])
                     value_sel = self.cfg.params[self.cfg.smp_meth] if self.cfg.smp_meth in self.cfg.params else default
+                if key == self.cfg.dms_meth:
+                    value_ran, default = (c.DMSC_METH, c.DMSC_METH[-1])
+                    value_sel = self.cfg.params[self.cfg.dms_meth] if self.cfg.dms_meth in self.cfg.params else default
                 self.tk_vars[key] = tk.StringVar(value=value_sel)
                 obj_ent = tk.Spinbox(self, values=value_ran, textvariable=self.tk_vars[key], width=PX//2*scale_fld)
                 self.tk_vars[key].set(value=value_sel)   # set to default necessary for tkinter's spinbox
@@ -39,6 +39,7 @@ from plenopticam.gui.widget_cmnd import CmndWidget
 from plenopticam.gui.widget_cnfg import CnfgWidget
 from plenopticam.gui.widget_view import ViewWidget
 from plenopticam.cfg import PlenopticamConfig
+from plenopticam.cfg.constants import ALGN_FILE, ALGN_META
 from plenopticam import misc
 
 from plenopticam import lfp_calibrator
@@ -181,11 +182,11 @@ class CtrlWidget(tk.Frame):
         # remove output folder if option is set
         misc.rmdir_p(self.cfg.exp_path) if self.cfg.params[self.cfg.dir_remo] else None
 
-        # remove calibrated light-field if calibration or devignetting option is set
+        # remove calibrated light-field if calibration or devignetting option is set (calibration data is kept as
+        # warm start for re-calibration and overwritten afterwards)
         if self.cfg.params[self.cfg.opt_cali] or self.cfg.params[self.cfg.opt_vign]:
-            misc.rm_file(join(self.cfg.exp_path, 'lfp_img_align.pkl'))
-            if self.cfg.params[self.cfg.opt_cali]:
-                misc.rm_file(self.cfg.params[self.cfg.cal_meta])
+            misc.rm_file(join(self.cfg.exp_path, ALGN_FILE))
+            misc.rm_file(join(self.cfg.exp_path, ALGN_META))
 
         # create output data folder (prevent override)
         misc.mkdir_p(self.cfg.exp_path, self.cfg.params[self.cfg.opt_prnt])
@@ -247,8 +248,13 @@ class CtrlWidget(tk.Frame):
 
     def cal(self):
 
+        # previous calibration data as warm start if re-calibration is forced
+        calibs = None
+        if self.cfg.params[self.cfg.opt_cali] and self.cfg.cond_meta_file():
+            calibs = self.cfg.load_json(self.cfg.params[self.cfg.cal_meta])
+
         # perform centroid calibration
-        cal_obj = lfp_calibrator.LfpCalibrator(self.wht_img, self.cfg, self.sta)
+        cal_obj = lfp_calibrator.LfpCalibrator(self.wht_img, self.cfg, self.sta, calibs=calibs)
         cal_obj.main()
         self.cfg = cal_obj.cfg
         del cal_obj
@@ -1,7 +1,10 @@
 from .lfp_microlenses import LfpMicroLenses
 from .lfp_resampler import LfpResampler
+from .lfp_align_store import LfpAlignStore
+from .lfp_align_lut import LfpAlignLut
 from .lfp_rotator import LfpRotator
 from .lfp_devignetter import LfpDevignetter
 from .cfa_processor import CfaProcessor
 from .cfa_outliers import CfaOutliers
+from .raw_conditioner import RawConditioner
 from .top_level import LfpAligner
@@ -26,7 +26,11 @@ from plenopticam import misc
 
 import numpy as np
 import os
-from scipy.signal import medfilt
+from scipy.ndimage import median_filter, uniform_filter
+
+# number of detection runs before known defects are trusted and interval of subsequent detection runs
+DFT_MIN = 3
+DFT_RUN = 10
 
 
 class CfaOutliers(object):
@@ -37,6 +41,43 @@ class CfaOutliers(object):
         self.sta = kwargs['sta'] if 'sta' in kwargs else PlenopticamStatus()
 
         self._bay_img = kwargs['bay_img'] if 'bay_img' in kwargs else np.array([])
+        self._serial = kwargs['serial'] if 'serial' in kwargs else \
+            self.cfg.lfpimg['ser'] if 'ser' in self.cfg.lfpimg else None
+
+        # sensor offset of Bayer image cropped to a region of interest (None for full sensor)
+        self._offset = kwargs['offset'] if 'offset' in kwargs else None
+
+        # hot-pixel map of current capture and accumulated defect statistics of sensor
+        self._hot_map = np.zeros(self._bay_img.shape, dtype='bool')
+        self._dft_hits = None
+        self._dft_runs = 0
+        self._dft_caps = 0
+
+    def main(self, n=9, sig_lev=2.5, apply_map=True):
+        """ hot-pixel correction using the persistent defect map of the sensor (if available) """
+
+        # check interrupt status
+        if self.sta.interrupt:
+            return False
+
+        # load accumulated defect statistics
+        self.load_defect_map()
+
+        # run full detection only periodically once defects of the sensor are known
+        if self._dft_runs < DFT_MIN or self._dft_caps % DFT_RUN == 0:
+            self.rectify_candidates_bayer(n=n, sig_lev=sig_lev)
+            self._dft_hits += self._hot_map.astype(self._dft_hits.dtype)
+            self._dft_runs += 1
+
+        # replace known defects (unless deferred to raw conditioning)
+        if apply_map:
+            self._bay_img = self.correct_defects(self._bay_img, self.defect_map)
+        self._dft_caps += 1
+
+        # store accumulated defect statistics
+        self.save_defect_map()
+
+        return True
 
     def rectify_candidates_bayer(self, bay_img=None, n=2, sig_lev=4):
 
@@ -44,7 +85,7 @@ class CfaOutliers(object):
         self.sta.status_msg('Hot pixel detection', self.cfg.params[self.cfg.opt_prnt])
 
         bay_img = self._bay_img.copy() if bay_img is None else bay_img
-        cum_img = np.zeros(bay_img[0::2, 0::2].shape)
+        self._hot_map = np.zeros(bay_img.shape, dtype='bool')
 
         for c in range(4):
 
@@ -60,21 +101,23 @@ class CfaOutliers(object):
             i, j = c//2, c % 2
 
             # deduct median filtered image
-            med_img = medfilt(bay_img[i::2, j::2].copy(), kernel_size=(3, 3))
-            m_img = bay_img[i::2, j::2].copy()/bay_img[i::2, j::2].max() - med_img.copy()/np.max(med_img)
+            med_img = median_filter(bay_img[i::2, j::2], size=3)
+            m_img = bay_img[i::2, j::2]/bay_img[i::2, j::2].max() - med_img/np.max(med_img)
 
             new_img = self.rectify_candidates_channel(channel=bay_img[i::2, j::2].copy(),
                                                       ref_img=m_img, med_img=med_img, n=n, sig_lev=sig_lev+2)
 
-            diff_img = bay_img[i::2, j::2].copy() - new_img
-            cum_img[diff_img != 0] = 1
+            self._hot_map[i::2, j::2] = bay_img[i::2, j::2] != new_img
 
             bay_img[i::2, j::2] = new_img
 
         # export hot-pixel map
         if self.cfg.params[self.cfg.opt_dbug]:
-            hotp_num = len(cum_img[cum_img != 0])
-            misc.save_img_file(cum_img, file_path=os.path.join(self.cfg.exp_path, 'hot-pixel_map_'+str(hotp_num)+'.png'))
+            hotp_num = np.count_nonzero(self._hot_map)
+            cum_img = self._hot_map[0::2, 0::2] | self._hot_map[0::2, 1::2] | \
+                      self._hot_map[1::2, 0::2] | self._hot_map[1::2, 1::2]
+            misc.save_img_file(cum_img.astype('float'),
+                               file_path=os.path.join(self.cfg.exp_path, 'hot-pixel_map_'+str(hotp_num)+'.png'))
 
         # progress update
         self.sta.progress(100, self.cfg.params[self.cfg.opt_prnt])
@@ -88,50 +131,100 @@ class CfaOutliers(object):
         ref_img = channel if ref_img is None else ref_img
         med_img = channel if med_img is None else med_img
 
+        if n < 1 or not misc.isint(n):
+            self.sta.status_msg('Skip hot-pixel detection due to wrong settings', self.cfg.params[self.cfg.opt_prnt])
+            return channel
+
         # pre-select outlier candidates (narrow-down search area to speed-up the process)
         m_val = np.mean(ref_img)
         s_val = np.std(ref_img)
-        candidate_idxs = np.where(ref_img > m_val + s_val * sig_lev)
+        candidates = (ref_img > m_val + s_val * sig_lev) & (channel >= .3)
 
-        ref_img = np.zeros_like(channel)
-        ref_img[candidate_idxs[0], candidate_idxs[1]] = channel[candidate_idxs[0], candidate_idxs[1]]
-        ref_img[ref_img < .3] = 0
-        candidate_idxs = np.where(ref_img != 0)
-        candidates = list(zip(candidate_idxs[0], candidate_idxs[1]))
+        # count adjacent candidates by box convolution of candidate mask (clusters are no outliers)
+        k = 2 * n**2 - 1
+        adj_num = np.round(uniform_filter(candidates.astype('float64'), size=k, mode='constant') * k**2)
+        candidates &= adj_num < n
 
-        if n < 1 or not misc.isint(n):
-            self.sta.status_msg('Skip hot-pixel detection due to wrong settings', self.cfg.params[self.cfg.opt_prnt])
-            return channel
+        # local statistics from windows around each pixel
+        m_img = uniform_filter(channel.astype('float64'), size=2*n+1, mode='mirror')
+        s_img = uniform_filter(channel.astype('float64')**2, size=2*n+1, mode='mirror') - m_img**2
+        s_img = np.sqrt(np.maximum(s_img, 0))
 
-        for num, idx in enumerate(candidates):
+        # replace outliers
+        outliers = candidates & ((channel < m_img - s_img * sig_lev) | (channel > m_img + s_img * sig_lev))
+        channel[outliers] = med_img[outliers]
 
-            j, i = idx
+        return channel
 
-            adj_cands = (candidate_idxs[0] > j-n**2) & (candidate_idxs[0] < j+n**2) & \
-                        (candidate_idxs[1] > i-n**2) & (candidate_idxs[1] < i+n**2)
+    @staticmethod
+    def correct_defects(bay_img, defect_map):
+        """ replace known defects by median of adjacent pixels from the same Bayer channel """
 
-            if np.count_nonzero(adj_cands) < n:
+        ys, xs = np.nonzero(defect_map)
+        if ys.size == 0:
+            return bay_img
 
-                if n < j < ref_img.shape[0]-n and n < i < ref_img.shape[1]-n:
-                    win = channel[j-n:j+n+1, i-n:i+n+1]
-                else:
-                    # treat candidates being too close to image border
-                    alt_n = min(j, abs(ref_img.shape[0]-j), i, abs(ref_img.shape[1]-i))
-                    win = channel[j-alt_n:j+alt_n+1, i-alt_n:i+alt_n+1]
+        # gather same-channel neighbors (offsets beyond image borders are mirrored about the defect)
+        offsets = [(dy, dx) for dy in (-2, 0, 2) for dx in (-2, 0, 2) if dy != 0 or dx != 0]
+        adj_ys = np.array([np.where((ys+dy < 0) | (ys+dy > bay_img.shape[0]-1), ys-dy, ys+dy) for dy, _ in offsets])
+        adj_xs = np.array([np.where((xs+dx < 0) | (xs+dx > bay_img.shape[1]-1), xs-dx, xs+dx) for _, dx in offsets])
 
-                m_val = np.mean(win)
-                s_val = np.std(win)
+        bay_img[ys, xs] = np.median(bay_img[adj_ys, adj_xs], axis=0)
 
-                if channel[j, i] < m_val - s_val * sig_lev or channel[j, i] > m_val + s_val * sig_lev:
+        return bay_img
 
-                    # replace outlier
-                    channel[j, i] = med_img[j, i]
+    @property
+    def dft_fp(self):
+        return os.path.join(self.cfg.dft_path, 'defect_map_' + str(self._serial) + '.npz') if self._serial else None
+
+    def load_defect_map(self):
+        """ load accumulated defect statistics of camera sensor """
+
+        self._dft_hits = np.zeros(self._bay_img.shape, dtype='uint16')
+        self._dft_runs, self._dft_caps = 0, 0
+
+        if self.dft_fp is not None and os.path.exists(self.dft_fp):
+            try:
+                with np.load(self.dft_fp) as data:
+                    hits = data['hits']
+                    if self._offset is not None:
+                        # sensor region of cropped Bayer image
+                        y0, x0 = self._offset
+                        hits = hits[y0:y0+self._bay_img.shape[0], x0:x0+self._bay_img.shape[1]].copy()
+                    if hits.shape == self._bay_img.shape:
+                        self._dft_hits = hits
+                        self._dft_runs, self._dft_caps = int(data['runs']), int(data['caps'])
+            except (OSError, ValueError, KeyError):
+                self.sta.status_msg('Defect map may be corrupted %s' % self.dft_fp, self.cfg.params[self.cfg.opt_prnt])
 
-            # check interrupt status
-            if self.sta.interrupt:
-                return False
+        return True
 
-        return channel
+    def save_defect_map(self):
+        """ save accumulated defect statistics of camera sensor """
+
+        # statistics of a sensor region would overwrite the full-sensor map
+        if self.dft_fp is None or self._offset is not None:
+            return False
+
+        try:
+            misc.mkdir_p(self.cfg.dft_path, False)
+            np.savez_compressed(self.dft_fp, hits=self._dft_hits, runs=self._dft_runs, caps=self._dft_caps)
+        except PermissionError:
+            self.sta.status_msg('Could not save defect map', self.cfg.params[self.cfg.opt_prnt])
+            return False
+
+        return True
+
+    @property
+    def defect_map(self):
+        """ pixels detected as outliers in at least half of the detection runs """
+        if self._dft_hits is None or self._dft_runs == 0:
+            return self._hot_map
+        return self._dft_hits >= max(self._dft_runs / 2, 1)
+
+    @property
+    def hot_map(self):
+        return self._hot_map
 
     @property
     def bay_img(self):
@@ -23,9 +23,13 @@ __license__ = """
 
 from plenopticam import misc
 from plenopticam.cfg import PlenopticamConfig
+from plenopticam.cfg.constants import DMSC_METH
 
 # external libs
 import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 try:
     from scipy.signal import medfilt
@@ -38,10 +42,43 @@ try:
 except ImportError:
     raise ImportError('Please install colour_demosaicing package')
 
+# demosaicing functions with their kernel support (halo in pixels) ordered by quality tier
+DMSC_FUNS = dict(zip(DMSC_METH, (demosaicing_CFA_Bayer_bilinear,
+                                 demosaicing_CFA_Bayer_Malvar2004,
+                                 demosaicing_CFA_Bayer_Menon2007)))
+DMSC_HALO = dict(zip(DMSC_METH, (2, 2, 8)))
+
+# Bayer-aligned tile size used for parallel demosaicing
+TILE_SIZE = 1024
+
+# number of pixels color corrected in one (cache-sized) chunk
+CCM_CHUNK = 2**15
+
+# process pool shared by subsequent demosaicing calls (spawned on first use)
+_POOL = {}
+
+
+def demosaic_tile(tile, bay_pat, method):
+    """ demosaic single Bayer tile (module-level function to be picklable for process pools) """
+    return DMSC_FUNS[method](tile, bay_pat).astype('float32')
+
+
+def demosaic_pool(workers, reset=False):
+    """ process pool reused across captures to avoid spawning workers for each image """
+
+    if reset or _POOL.get('workers') != workers:
+        if 'pool' in _POOL:
+            _POOL.pop('pool').shutdown(wait=False, cancel_futures=True)
+        _POOL.clear()
+    if not reset and 'pool' not in _POOL:
+        _POOL.update(workers=workers, pool=ProcessPoolExecutor(max_workers=workers))
+
+    return _POOL.get('pool')
+
 
 class CfaProcessor(object):
 
-    def __init__(self, bay_img=None, wht_img=None, cfg=None, sta=None):
+    def __init__(self, bay_img=None, wht_img=None, cfg=None, sta=None, method=None, lens_opt=False, mic_list=None):
 
         # input variables
         self.cfg = cfg if cfg is not None else PlenopticamConfig()
@@ -52,22 +89,29 @@ class CfaProcessor(object):
         self._bit_pac = self.cfg.lfpimg['bit'] if 'bit' in self.cfg.lfpimg else 10
         self._gains = self.cfg.lfpimg['awb'] if 'awb' in self.cfg.lfpimg else [1, 1, 1, 1]
         self._bay_pat = self.cfg.lfpimg['bay'] if 'bay' in self.cfg.lfpimg else None
+        self._method = method if method in DMSC_METH else DMSC_METH[-1]
+
+        # restrict demosaicing to micro images read by the resampler (requires calibration data)
+        self._mic_list = self.cfg.calibs.get(self.cfg.mic_list) if mic_list is None else mic_list
+        self._lens_opt = lens_opt and self._mic_list is not None
+        self._lens_mask = None
 
         # output variables
         self._rgb_img = np.array([])
 
-    def main(self):
+    def main(self, awb_opt=True):
 
         # check interrupt status
         if self.sta.interrupt:
             return False
 
-        # apply auto white balance gains while considering image highlights
-        self.safe_bayer_awb()
+        # apply auto white balance gains while considering image highlights (unless done in raw conditioning)
+        if awb_opt:
+            self.safe_bayer_awb()
 
         # debayer to rgb image
         if 'bay' in self.cfg.lfpimg.keys() and len(self._bay_img.shape) == 2:
-            self.bay2rgb(2)
+            self.bay2rgb(self._method)
 
         # convert to uint16
         self._rgb_img = misc.Normalizer(self._rgb_img).uint16_norm()
@@ -80,16 +124,21 @@ class CfaProcessor(object):
         self.sta.status_msg('Debayering', self.cfg.params[self.cfg.opt_prnt])
         self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
 
-        # Bayer to RGB conversion
-        if method == 0:
-            self._rgb_img = demosaicing_CFA_Bayer_bilinear(self._bay_img, self.cfg.lfpimg['bay'])
-        elif method == 1:
-            self._rgb_img = demosaicing_CFA_Bayer_Malvar2004(self._bay_img, self.cfg.lfpimg['bay'])
+        # Bayer to RGB conversion (method given as quality tier index or name)
+        method = DMSC_METH[min(max(method, 0), len(DMSC_METH)-1)] if isinstance(method, int) else method
+        if self._lens_opt:
+            self._rgb_img = self.demosaic_lenses(self._bay_img, self.cfg.lfpimg['bay'], method,
+                                                 mic_list=self._mic_list,
+                                                 size=self.cfg.params[self.cfg.ptc_leng])
         else:
-            self._rgb_img = demosaicing_CFA_Bayer_Menon2007(self._bay_img, self.cfg.lfpimg['bay'])
+            self._rgb_img = self.demosaic_tiles(self._bay_img, self.cfg.lfpimg['bay'], method)
 
-        # normalize image
-        min = np.percentile(self._rgb_img, 0.05)
+        # check interrupt status
+        if self.sta.interrupt:
+            return False
+
+        # normalize image (considering interpolated pixels only)
+        min = misc.fast_percentile(self._rgb_img[self._lens_mask] if self._lens_mask is not None else self._rgb_img, 0.05)
         max = np.max(self.rgb_img)
         self._rgb_img = misc.Normalizer(self._rgb_img, min=min, max=max).type_norm()
 
@@ -98,42 +147,152 @@ class CfaProcessor(object):
 
         return True
 
-    def _reshape_bayer(self):
+    def demosaic_tiles(self, bay_img, bay_pat, method=None, tile_size=None, workers=None):
+        """ demosaic Bayer image in halo-padded tiles on multiple cores """
+
+        method = method if method in DMSC_METH else DMSC_METH[-1]
+        tile_size = TILE_SIZE if tile_size is None else tile_size + tile_size % 2
+        workers = os.cpu_count() if workers is None else workers
+        halo = DMSC_HALO[method]
+        h, w = bay_img.shape[:2]
+
+        # Bayer-aligned tile borders (even offsets preserve the Bayer pattern in each tile)
+        tiles = []
+        for y in range(0, h, tile_size):
+            for x in range(0, w, tile_size):
+                y0, x0 = max(y-halo, 0), max(x-halo, 0)
+                y1, x1 = min(y+tile_size+halo, h), min(x+tile_size+halo, w)
+                tiles.append(((y, x, min(y+tile_size, h), min(x+tile_size, w)), (y0, x0, y1, x1)))
+
+        # pre-allocate output
+        rgb_img = np.zeros((h, w, 3), dtype='float32')
+
+        def stitch(results):
+            for k, ((y, x, ye, xe), (y0, x0, _, _)), res in zip(range(len(tiles)), tiles, results):
+                rgb_img[y:ye, x:xe] = res[y-y0:ye-y0, x-x0:xe-x0]
+                self.sta.progress((k+1)/len(tiles)*100, self.cfg.params[self.cfg.opt_prnt])
+                if self.sta.interrupt:
+                    return False
+            return True
+
+        # crop tiles including halo
+        crops = (bay_img[y0:y1, x0:x1] for _, (y0, x0, y1, x1) in tiles)
+
+        if len(tiles) > 1 and workers > 1:
+            try:
+                executor = demosaic_pool(workers)
+                stitch(executor.map(demosaic_tile, crops, [bay_pat]*len(tiles), [method]*len(tiles)))
+                return rgb_img
+            except (BrokenProcessPool, OSError, RuntimeError):
+                # discard pool and fall back to serial processing (e.g. where process spawning is unsupported)
+                demosaic_pool(workers, reset=True)
+                crops = (bay_img[y0:y1, x0:x1] for _, (y0, x0, y1, x1) in tiles)
+
+        stitch(demosaic_tile(crop, bay_pat, method) for crop in crops)
+
+        return rgb_img
+
+    def demosaic_lenses(self, bay_img, bay_pat, method=None, mic_list=None, size=None, margin=2):
+        """ demosaic only micro image windows read by the resampler while skipping regions without micro images """
+
+        method = method if method in DMSC_METH else DMSC_METH[-1]
+        halo = DMSC_HALO[method] + DMSC_HALO[method] % 2
+        h, w = bay_img.shape[:2]
+        mics = np.asarray(mic_list)
+
+        # Bayer-aligned (even) window origins covering patch size, resampling border and interpolation margin
+        r = int(size) // 2 + 1 + margin
+        y0 = np.round(mics[:, 0]).astype('int') - r
+        x0 = np.round(mics[:, 1]).astype('int') - r
+        y0, x0 = y0 - y0 % 2, x0 - x0 % 2
+        win = 2 * r + 2
+
+        # group lenses into square index blocks of the size requiring the fewest pixels to be demosaiced
+        idx = mics[:, 2:4].astype('int') - mics[:, 2:4].min(axis=0).astype('int')
+        sizes = 2 ** np.arange(int(np.log2(max(idx.max(), 1))) + 2)
+        area, oy, ox, (cy, cx), boxes = min((self.lens_blocks(y0, x0, win, halo, idx // k, (h, w)) for k in sizes),
+                                            key=lambda plan: plan[0])
+
+        # fall back to full demosaicing if blocks including halo do not save any pixels
+        if area > .8 * h * w:
+            self._lens_mask = None
+            return self.demosaic_tiles(bay_img, bay_pat, method)
+
+        rgb_img = np.zeros((h, w, 3), dtype='float32')
+        self._lens_mask = np.zeros((h, w), dtype='bool')
+
+        if len(oy):
+            # stack equally sized crops inside the image as an atlas (even offsets preserve the Bayer pattern)
+            ay, ax = np.arange(cy), np.arange(cx)
+            crops = bay_img[(oy[:, None] + ay)[..., None], (ox[:, None] + ax)[:, None, :]]
+            cols = int(np.ceil(np.sqrt(len(crops))))
+            rows = -(-len(crops) // cols)
+            crops = np.concatenate([crops, np.zeros((rows*cols-len(crops), cy, cx), dtype=crops.dtype)])
+            atlas = crops.reshape(rows, cols, cy, cx).swapaxes(1, 2).reshape(rows*cy, cols*cx)
+            rgb_crops = self.demosaic_tiles(atlas, bay_pat, method).reshape(rows, cy, cols, cx, 3).swapaxes(1, 2)
+            rgb_crops = rgb_crops.reshape(-1, cy, cx, 3)[:len(oy)]
+
+            # write back crop interiors without halos
+            iy = (oy[:, None] + ay[halo:cy-halo])[..., None]
+            ix = (ox[:, None] + ax[halo:cx-halo])[:, None, :]
+            rgb_img[iy, ix] = rgb_crops[:, halo:cy-halo, halo:cx-halo]
+            self._lens_mask[iy, ix] = True
+
+        # demosaic blocks at image borders separately with halos clipped to the image
+        for by0, bx0, by1, bx1 in boxes:
+
+            # check interrupt status
+            if self.sta.interrupt:
+                return rgb_img
+
+            hy0, hx0 = max(by0-halo, 0), max(bx0-halo, 0)
+            rgb_box = self.demosaic_tiles(bay_img[hy0:min(by1+halo, h), hx0:min(bx1+halo, w)], bay_pat, method)
+            rgb_img[by0:by1, bx0:bx1] = rgb_box[by0-hy0:by1-hy0, bx0-hx0:bx1-hx0]
+            self._lens_mask[by0:by1, bx0:bx1] = True
+
+        return rgb_img
 
-        if len(self._bay_img.shape) == 2:
-            # reshape bayer image to 4 channels in third dimension (G, R, B, G)
-            self._bay_img = np.dstack((self._bay_img[0::2, 0::2], self._bay_img[0::2, 1::2],
-                                       self._bay_img[1::2, 0::2], self._bay_img[1::2, 1::2]))
+    @staticmethod
+    def lens_blocks(y0, x0, win, halo, idx, shape):
+        """ halo-padded crops of equal size enclosing lens windows with the same block index (y, x) and clipped
+        boxes of blocks at image borders along with the number of pixels to be demosaiced """
 
-        elif len(self._bay_img.shape) == 3:
-            if self._bay_img.shape[2] == 4:
-                # reshape 4 channel bayer image to 2D bayer image
-                arr, self._bay_img = self._bay_img, np.zeros(np.array(self._bay_img.shape[:2])*2)
-                self._bay_img[0::2, 0::2] = arr[..., 0]
-                self._bay_img[0::2, 1::2] = arr[..., 1]
-                self._bay_img[1::2, 0::2] = arr[..., 2]
-                self._bay_img[1::2, 1::2] = arr[..., 3]
+        h, w = shape
+        inv = np.unique(idx, axis=0, return_inverse=True)[1].ravel()
+        num = inv.max() + 1
 
-        return True
+        # bounding box of lens windows in each block
+        by0, bx0 = np.full(num, y0.max()), np.full(num, x0.max())
+        by1, bx1 = np.full(num, y0.min()+win), np.full(num, x0.min()+win)
+        np.minimum.at(by0, inv, y0)
+        np.minimum.at(bx0, inv, x0)
+        np.maximum.at(by1, inv, y0+win)
+        np.maximum.at(bx1, inv, x0+win)
 
-    def _reshape_white(self):
+        # uniform crop size and crops lying inside the image
+        cy, cx = (by1-by0).max() + 2*halo, (bx1-bx0).max() + 2*halo
+        oy, ox = by0-halo, bx0-halo
+        inner = (oy >= 0) & (ox >= 0) & (oy+cy <= h) & (ox+cx <= w)
 
-        if self._wht_img is not None:
-            if len(self._wht_img.shape) == 2:
-                # reshape bayer image to 4 channels in third dimension
-                self._wht_img = np.dstack((self._wht_img[0::2, 0::2], self._wht_img[0::2, 1::2],
-                                           self._wht_img[1::2, 0::2], self._wht_img[1::2, 1::2]))
-
-            elif len(self._wht_img.shape) == 3:
-                if self._wht_img.shape[2] == 4:
-                    # reshape 4 channel bayer image to 2D bayer image
-                    arr, self._wht_img = self._wht_img, np.zeros(np.array(self._wht_img.shape[:2])*2)
-                    self._wht_img[0::2, 0::2] = arr[..., 0]
-                    self._wht_img[0::2, 1::2] = arr[..., 1]
-                    self._wht_img[1::2, 0::2] = arr[..., 2]
-                    self._wht_img[1::2, 1::2] = arr[..., 3]
+        # border boxes clipped to the image
+        boxes = [(max(a, 0), max(b, 0), min(c, h), min(d, w)) for a, b, c, d in zip(by0[~inner], bx0[~inner],
+                                                                                    by1[~inner], bx1[~inner])]
+        boxes = [box for box in boxes if box[0] < box[2] and box[1] < box[3]]
 
-        return True
+        area = np.count_nonzero(inner) * cy * cx
+        area += sum((min(c+halo, h)-max(a-halo, 0)) * (min(d+halo, w)-max(b-halo, 0)) for a, b, c, d in boxes)
+
+        return area, oy[inner], ox[inner], (cy, cx), boxes
+
+    @property
+    def lens_mask(self):
+        return self._lens_mask
+
+    @staticmethod
+    def bayer_planes(img_arr):
+        """ four Bayer channels as strided views of the 2-D mosaic in memory order (top-left, top-right, ...) """
+
+        return [img_arr[0::2, 0::2], img_arr[0::2, 1::2], img_arr[1::2, 0::2], img_arr[1::2, 1::2]]
 
     @property
     def rgb_img(self):
@@ -152,19 +311,11 @@ class CfaProcessor(object):
             img_arr[..., 1] *= gains[1]             # green channel
             img_arr[..., 2] *= gains[2]             # blue channel
 
-        elif len(img_arr.shape) == 2 and bay_pat == "GRBG":
-
-            img_arr[0::2, 0::2] *= gains[0]         # green-red channel
-            img_arr[0::2, 1::2] *= gains[1]         # red channel
-            img_arr[1::2, 0::2] *= gains[2]         # blue channel
-            img_arr[1::2, 1::2] *= gains[3]         # green-blue channel
+        elif len(img_arr.shape) == 2 and bay_pat in ("GRBG", "BGGR"):
 
-        elif len(img_arr.shape) == 2 and bay_pat == "BGGR":
-
-            img_arr[0::2, 0::2] *= gains[0]         # blue channel
-            img_arr[0::2, 1::2] *= gains[1]         # green-blue channel
-            img_arr[1::2, 0::2] *= gains[2]         # green-red channel
-            img_arr[1::2, 1::2] *= gains[3]         # red channel
+            # GRBG: green-red, red, blue, green-blue; BGGR: blue, green-blue, green-red, red
+            for plane, gain in zip(self.bayer_planes(img_arr), gains):
+                plane *= gain
 
         return img_arr
 
@@ -173,31 +324,47 @@ class CfaProcessor(object):
 
         self._gains = self._gains if gains is None else gains
 
-        bay_img = self._bay_img.copy()
-        wht_img = np.ones(self._bay_img.shape) if self._wht_img is None else self._wht_img
+        if self._wht_img is not None:
+            # reciprocal white image and mean of white Bayer quads as highlight weights
+            rcp_img = np.divide(1, self._wht_img, out=np.zeros_like(self._wht_img), where=self._wht_img != 0)
+            wht_avg = sum(self.bayer_planes(self._wht_img)) / 4
+        else:
+            rcp_img, wht_avg = None, None
+
+        self.correct_highlights(self._bay_img, self._gains, rcp_img, wht_avg)
+
+        return True
+
+    @staticmethod
+    def correct_highlights(bay_img, gains, rcp_img=None, wht_avg=None, sat_val=.99):
+        """ in-place highlight correction of Bayer mosaic given reciprocal white image and its mean Bayer quads """
 
-        fact = self._gains.max()
-        ThSatCol = .99
+        gains = np.asarray(gains)
+        bay_planes = CfaProcessor.bayer_planes(bay_img)
+        rcp_planes = CfaProcessor.bayer_planes(rcp_img) if rcp_img is not None else [None] * 4
+        fact = gains.max()
 
         # Determine the component with lowest value (the last one to saturate).
-        min_sat, min_idx = bay_img.min(2), bay_img.argmin(2)
-        min_sat_bal = min_sat * self._gains[min_idx]
+        min_sat, min_idx = bay_planes[0].copy(), np.zeros(bay_planes[0].shape, dtype='uint8')
+        for i in range(1, 4):
+            mask = bay_planes[i] < min_sat
+            min_sat[mask] = bay_planes[i][mask]
+            min_idx[mask] = i
+        min_sat_bal = min_sat * gains[min_idx]
 
         # weights
-        min_sat = min_sat * wht_img.mean(2)
+        if wht_avg is not None:
+            min_sat *= wht_avg
         min_sat[min_sat > 1] = 1
         min_sat **= 2
 
         for i in range(4):
-            ref_img = np.divide(ThSatCol, wht_img[..., i], out=np.ones_like(wht_img[..., i])*float('Inf'), where=wht_img[..., i]!=0)
-            ref_img[~np.isfinite(ref_img)] = 0
-            ch_idxs = np.nonzero(bay_img[..., i] > ref_img)
-            inm_img = (min_sat_bal*(1-min_sat) + bay_img[..., i]*fact * min_sat) / self._gains[i]
-            bay_img[..., i][ch_idxs] = np.maximum.reduce([bay_img[..., i][ch_idxs], inm_img[ch_idxs]])
+            ref_img = sat_val * rcp_planes[i] if rcp_planes[i] is not None else sat_val
+            ch_idxs = np.nonzero(bay_planes[i] > ref_img)
+            inm_img = (min_sat_bal[ch_idxs]*(1-min_sat[ch_idxs]) + bay_planes[i][ch_idxs]*fact*min_sat[ch_idxs]) / gains[i]
+            bay_planes[i][ch_idxs] = np.maximum(bay_planes[i][ch_idxs], inm_img)
 
-        self._bay_img = bay_img
-
-        return True
+        return bay_img
 
     @staticmethod
     def desaturate_clipped(img_arr, gains=None):
@@ -230,40 +397,74 @@ class CfaProcessor(object):
 
         return img_ccm
 
-    def safe_bayer_awb(self):
+    @staticmethod
+    def correct_color_fused(img, ccm_mat=np.eye(3), sat_lev=1, chunk=CCM_CHUNK):
+        """ color correction of img normalized to saturation level, clamped to [0, sat_lev] and normalized to its
+        maximum in place using a reshaped view in chunks (maxima are gathered in a read-only pass beforehand) """
+
+        img = np.ascontiguousarray(img)
+        vec = img.reshape(-1, img.shape[-1])
+
+        # maxima of input and color corrected input
+        img_max, ccm_max = -np.inf, -np.inf
+        for k in range(0, len(vec), chunk):
+            img_max = max(img_max, vec[k:k+chunk].max())
+            ccm_max = max(ccm_max, np.matmul(vec[k:k+chunk], ccm_mat).max())
+
+        # exposure scale and maximum after clamping
+        scale = sat_lev / img_max if img_max > 0 else 0
+        norm = min(ccm_max * scale, sat_lev)
+        if norm <= 0:
+            img[...] = 0
+            return img
+
+        # scale, color correction, clamp and normalization in one pass
+        ccm_mat = np.asarray(ccm_mat, dtype=img.dtype) * scale
+        for k in range(0, len(vec), chunk):
+            blk = vec[k:k+chunk]
+            np.matmul(blk, ccm_mat, out=blk)
+            np.clip(blk, 0, sat_lev, out=blk)
+            blk /= norm
+
+        return img
 
-        self._reshape_bayer()
-        self._reshape_white()
+    def safe_bayer_awb(self):
 
         self.set_gains(self.cfg.lfpimg['awb'])
         self._correct_bayer_highlights()
 
-        self._reshape_bayer()
-        self._reshape_white()
-
         self.apply_awb()
-        self._bay_img[self._bay_img < 0] = 0
+        np.maximum(self._bay_img, 0, out=self._bay_img)
 
         if 'exp' in self.cfg.lfpimg:
             exp_bias = self.cfg.lfpimg['exp']
             max_lum = 2**(-exp_bias)
-            self._bay_img = self.soft_clipping(self._bay_img/max_lum, 7)*max_lum
+            self._bay_img /= max_lum
+            self.soft_clipping(self._bay_img, 7, out=self._bay_img)
+            self._bay_img *= max_lum
 
-    def soft_clipping(self, img, max):
+    @staticmethod
+    def soft_clipping(img, max, out=None):
 
         b = np.exp(max)
-        return np.log((1+b)/(1+b*np.exp(-max*img)))/np.log(1+b)
+        out = np.empty_like(img) if out is None else out
+        np.multiply(img, -max, out=out)
+        np.exp(out, out=out)
+        out *= b
+        out += 1
+        np.divide(1+b, out, out=out)
+        np.log(out, out=out)
+        out /= np.log(1+b)
+
+        return out
 
     def set_gains(self, gains=None):
 
         # skip process if gains not set
         if gains is not None:
             if len(self._bay_img.shape) == 2 or len(self._bay_img.shape) == 3 and self._bay_img.shape[-1] == 4:
-                if self._bay_pat == "GRBG":
-                    self._gains = np.array([gains[2], gains[1], gains[0], gains[3]])
-                elif self._bay_pat == "BGGR":
-                    self._gains = np.array([gains[0], gains[2], gains[3], gains[1]])
-                else:
+                self._gains = self.bayer_gains(gains, self._bay_pat)
+                if self._gains is None:
                     return None
             elif len(self._bay_img.shape) == 3 and self._bay_img.shape[-1] == 3:
                 self._gains = np.array([gains[1], (gains[2] + gains[3]) / 2, gains[0]])
@@ -273,3 +474,14 @@ class CfaProcessor(object):
             return None
 
         return self._gains
+
+    @staticmethod
+    def bayer_gains(gains, bay_pat):
+        """ white balance gains (R, G, B, G) in order of Bayer planes """
+
+        if bay_pat == "GRBG":
+            return np.array([gains[2], gains[1], gains[0], gains[3]])
+        elif bay_pat == "BGGR":
+            return np.array([gains[0], gains[2], gains[3], gains[1]])
+
+        return None
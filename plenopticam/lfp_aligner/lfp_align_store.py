@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+__author__ = "Christopher Hahne"
+__email__ = "info@christopherhahne.de"
+__license__ = """
+    Copyright (c) 2019 Christopher Hahne <info@christopherhahne.de>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from plenopticam.cfg import PlenopticamConfig
+from plenopticam.cfg.constants import ALGN_FILE, ALGN_META
+from plenopticam import misc
+
+import numpy as np
+import hashlib
+import json
+import os
+
+# number of aligned image rows written in one pass
+CHUNK_ROWS = 1024
+
+
+class LfpAlignStore(object):
+    """ memory-mappable store of the aligned light-field (npy file) with json sidecar holding its geometry """
+
+    def __init__(self, *args, **kwargs):
+
+        self.cfg = kwargs['cfg'] if 'cfg' in kwargs else PlenopticamConfig()
+        self.sta = kwargs['sta'] if 'sta' in kwargs else misc.PlenopticamStatus()
+
+        self._exp_path = kwargs['exp_path'] if 'exp_path' in kwargs else self.cfg.exp_path
+        self._chunk_rows = kwargs['chunk_rows'] if 'chunk_rows' in kwargs else CHUNK_ROWS
+
+    @property
+    def fp(self):
+        return os.path.join(self._exp_path, ALGN_FILE)
+
+    @property
+    def meta_fp(self):
+        return os.path.join(self._exp_path, ALGN_META)
+
+    def exists(self):
+        return os.path.exists(self.fp) and os.path.exists(self.meta_fp)
+
+    def remove(self):
+        for fp in (self.fp, self.meta_fp):
+            if os.path.exists(fp):
+                os.remove(fp)
+
+    def write(self, lfp_img_align, pitch, hex_odd=None, roi=None):
+        """ write aligned light-field in row chunks and its sidecar """
+
+        pitch = [int(p) for p in pitch]
+        meta = {'pitch': pitch,
+                'shape': list(lfp_img_align.shape),
+                'dtype': str(lfp_img_align.dtype),
+                'pat_type': self.cfg.calibs[self.cfg.pat_type] if self.cfg.pat_type in self.cfg.calibs else 'rec',
+                'hex_odd': int(hex_odd) if hex_odd is not None else None,
+                'lens_y_max': lfp_img_align.shape[0] // pitch[0],
+                'lens_x_max': lfp_img_align.shape[1] // pitch[1],
+                'cal_digest': self.cal_digest(self.cfg),
+                'roi': roi}
+
+        # remove previous store to avoid an outdated sidecar in case of failure
+        self.remove()
+        misc.mkdir_p(self._exp_path, False)
+
+        tmp_fp = self.fp + '.tmp'
+        arr = np.lib.format.open_memmap(tmp_fp, mode='w+', dtype=lfp_img_align.dtype, shape=lfp_img_align.shape)
+        for y in range(0, lfp_img_align.shape[0], self._chunk_rows):
+            arr[y:y+self._chunk_rows] = lfp_img_align[y:y+self._chunk_rows]
+        arr.flush()
+        del arr
+        os.replace(tmp_fp, self.fp)
+
+        with open(self.meta_fp, 'w') as f:
+            json.dump(meta, f, indent=4)
+
+        return True
+
+    def read_meta(self):
+        """ load sidecar and validate it against the current calibration """
+
+        try:
+            with open(self.meta_fp, 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if self.cfg.calibs and meta['cal_digest'] != self.cal_digest(self.cfg):
+            msg = 'Aligned light-field stems from a different calibration'
+            self.sta.status_msg(msg, self.cfg.params[self.cfg.opt_prnt])
+            return None
+
+        return meta
+
+    def read(self, mmap_mode='r'):
+        """ memory-map aligned light-field (no copy is made until data is sliced) """
+
+        meta = self.read_meta()
+        if meta is None:
+            return None, None
+
+        try:
+            lfp_img_align = np.load(self.fp, mmap_mode=mmap_mode)
+        except (FileNotFoundError, ValueError, OSError):
+            return None, None
+
+        if list(lfp_img_align.shape) != meta['shape']:
+            return None, None
+
+        return lfp_img_align, meta
+
+    @staticmethod
+    def micro_images(lfp_img_align, meta):
+        """ view of aligned light-field with axes (lens y, pixel y, lens x, pixel x, channel) """
+
+        (py, px), ly, lx = meta['pitch'], meta['lens_y_max'], meta['lens_x_max']
+        arr = lfp_img_align[:ly*py, :lx*px]
+        arr = arr if len(arr.shape) == 3 else arr[..., np.newaxis]
+
+        return arr.reshape(ly, py, lx, px, arr.shape[-1])
+
+    @staticmethod
+    def cal_digest(cfg):
+        """ digest of calibration file (or calibration data if not saved) the aligned light-field is based on """
+
+        cal_meta = cfg.params[cfg.cal_meta] if cfg.cal_meta in cfg.params else None
+        if cal_meta and os.path.isfile(cal_meta):
+            with open(cal_meta, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+
+        if not cfg.calibs or cfg.mic_list not in cfg.calibs:
+            return None
+
+        sha = hashlib.sha1(np.ascontiguousarray(cfg.calibs[cfg.mic_list], dtype='float64'))
+        sha.update(str(cfg.calibs[cfg.pat_type] if cfg.pat_type in cfg.calibs else 'rec').encode())
+
+        return sha.hexdigest()
+
+    @staticmethod
+    def wht_digest(cfg, wht_img, mic_list=None, offset=None):
+        """ digest of white image given by its files (path and modification time) and calibration (hashing the image
+        data only if it is not backed by a file) to be computed once per capture and shared by flat-field caches """
+
+        if wht_img is None:
+            return None
+
+        sha = hashlib.sha1(str((wht_img.shape, offset, LfpAlignStore.cal_digest(cfg))).encode())
+        if mic_list is not None:
+            sha.update(np.ascontiguousarray(mic_list, dtype='float64'))
+
+        fps = [cfg.params.get(key) for key in (cfg.cal_path, cfg.cal_meta)]
+        fps = [fp for fp in fps if fp and os.path.isfile(fp)]
+        for fp in fps:
+            sha.update(('%s:%s' % (os.path.abspath(fp), os.path.getmtime(fp))).encode())
+        if not fps:
+            sha.update(np.ascontiguousarray(wht_img))
+
+        return sha.hexdigest()
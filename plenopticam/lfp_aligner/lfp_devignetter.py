@@ -21,6 +21,7 @@ Copyright (c) 2019 Christopher Hahne <info@christopherhahne.de>
 """
 
 from plenopticam.lfp_aligner.lfp_microlenses import LfpMicroLenses
+from plenopticam.lfp_aligner.lfp_align_store import LfpAlignStore
 from plenopticam import misc
 from plenopticam.misc.type_checks import rint
 
@@ -28,18 +29,29 @@ import numpy as np
 from scipy.signal import convolve2d
 from color_space_converter import rgb2gry
 
+# number of micro images fitted in one chunk
+PATCH_CHUNK = 2**12
+
 
 class LfpDevignetter(LfpMicroLenses):
 
+    # reciprocal flat-field of the most recent white image and calibration (reused for subsequent captures)
+    _cache = {}
+
     def __init__(self, *args, **kwargs):
         super(LfpDevignetter, self).__init__(*args, **kwargs)
 
         self._wht_img = np.ones(self._lfp_img.shape) if self._wht_img is None else self._wht_img
+        self._rcp_img = None
+        self._wht_max = 1
 
         # config for decision making whether division by raw image or fit values
         self.noise_lev = kwargs['noise_lev'] if 'noise_lev' in kwargs else None
         self.noise_th = 0.05
-        self.patch_mode = False
+        self.patch_mode = kwargs['patch_mode'] if 'patch_mode' in kwargs else bool(self.cfg.params[self.cfg.opt_vfit])
+
+        # digest of white image and calibration (shared with raw conditioning)
+        self._wht_key = kwargs['wht_key'] if 'wht_key' in kwargs else None
 
         # add noise
         self.test = False
@@ -52,7 +64,8 @@ class LfpDevignetter(LfpMicroLenses):
             self._wht_img = rgb2gry(self._wht_img) if self._wht_img.shape[2] == 3 else self._wht_img
 
         # check for same dimensionality
-        self._wht_img = self._wht_img if len(self._wht_img.shape) == len(self._lfp_img.shape) else rgb2gry(self._wht_img)
+        if self._lfp_img is not None and len(self._wht_img.shape) != len(self._lfp_img.shape):
+            self._wht_img = rgb2gry(self._wht_img)
 
     def main(self):
 
@@ -60,58 +73,108 @@ class LfpDevignetter(LfpMicroLenses):
         if self.sta.interrupt:
             return False
 
-        # normalize white image to upper percentile
-        self._wht_img /= np.percentile(self._wht_img, q=99.9)
-
-        # analyse noise in white image
-        self.noise_lev = self._estimate_noise_level() if self.noise_lev is None else self.noise_lev
+        # obtain reciprocal flat-field and noise level of white image (computed once per white image and calibration)
+        self.flat_field()
 
         # print status
         self.sta.status_msg('De-vignetting', self.cfg.params[self.cfg.opt_prnt])
         self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
 
-        # de-vignetting based on mode and present noise level in white image
-        if self.patch_mode and self.noise_lev > self.noise_th:
-            # perform fitted white micro image division (to reduce noise propagation)
-            self.proc_lens_iter(self.patch_devignetting, prnt=False)
-        else:
-            # perform ordinary de-vignetting from raw white image (low noise)
-            self.wht_img_divide()
+        # de-vignetting by multiplication with reciprocal flat-field
+        self.wht_img_divide()
 
         return True
 
+    def flat_field(self):
+        """ reciprocal flat-field with zero and noise handling applied """
+
+        key = self.cache_key()
+        if key not in LfpDevignetter._cache:
+
+            # normalize copy of white image to upper percentile (leaving the caller's data untouched)
+            wht_max = misc.fast_percentile(self._wht_img, q=99.9)
+            wht_img = self._wht_img / wht_max
+
+            # analyse noise in white image
+            self.noise_lev = self._estimate_noise_level(wht_img) if self.noise_lev is None else self.noise_lev
+
+            # reciprocal of raw white image (low noise) where zeros are excluded
+            self._rcp_img = np.divide(1, wht_img, out=np.zeros(wht_img.shape), where=wht_img != 0)
+            self._rcp_img = self._rcp_img.astype('float32')
+
+            if self.patch_mode and self.noise_lev > self.noise_th:
+                # reciprocal of fitted white micro images (to reduce noise propagation)
+                self.patch_flat_field(wht_img=wht_img)
+            del wht_img
+
+            LfpDevignetter._cache.clear()
+            LfpDevignetter._cache[key] = self._rcp_img, self.noise_lev, wht_max
+
+        self._rcp_img, self.noise_lev, self._wht_max = LfpDevignetter._cache[key]
+
+        return self._rcp_img
+
+    def cache_key(self):
+        """ fingerprint of white image, calibration data and flat-field settings """
+
+        if self._wht_key is None:
+            mic_list = self._CENTROIDS if self.cfg.calibs else None
+            self._wht_key = LfpAlignStore.wht_digest(self.cfg, self._wht_img, mic_list)
+
+        return self._wht_img.shape, self._size_pitch, self.patch_mode, self.noise_lev, self._wht_key
+
     def wht_img_divide(self):
-        """ ordinary devignetting using raw white image division """
+        """ ordinary devignetting using reciprocal white image multiplication """
 
-        # divide light-field image
-        init_arr = np.zeros_like(self._lfp_img)
-        self._lfp_img = np.divide(self._lfp_img.copy(), self._wht_img, out=init_arr, where=self._wht_img != 0)
+        # multiply light-field image in place
+        self._lfp_img *= self._rcp_img if self._rcp_img is not None else self.flat_field()
 
         # status
         self.sta.progress(100, self.cfg.params[self.cfg.opt_prnt])
 
         return True
 
-    def patch_devignetting(self, ly, lx, margin=1):
-        """ patch-wise devignetting via white image patch from least-squares regression """
+    def patch_flat_field(self, margin=1, wht_img=None):
+        """ reciprocal flat-field via white image patches from least-squares regression solved for all lenses at once """
 
-        # find MIC by indices
-        mic = self.get_coords_by_idx(ly=ly, lx=lx)
+        # window size and origins of micro images (in lens index order to preserve overlap precedence)
+        olap = self._cent_pitch + margin
+        k = 2 * olap + 1
+        mics = self._mic_lut[~np.isnan(self._mic_lut[..., 0])]
+        y0, x0 = np.round(mics[:, 0]).astype('int') - olap, np.round(mics[:, 1]).astype('int') - olap
+        wht_img = self._wht_img if wht_img is None else wht_img
+        wht_img = rgb2gry(wht_img)[..., 0] if len(wht_img.shape) == 3 else wht_img
+        valid = (y0 >= 0) & (x0 >= 0) & (y0 + k <= wht_img.shape[0]) & (x0 + k <= wht_img.shape[1])
+        y0, x0 = y0[valid], x0[valid]
+
+        # projection onto polynomial basis fitting all micro images at once
+        proj = None
+        if self.noise_lev > self.noise_th:
+            grid = np.linspace(0, 1, k)
+            X, Y = np.meshgrid(grid, grid, copy=False)
+            A = self.compose_vandermonde_2d(X.flatten(), Y.flatten(), deg=3)
+            proj = np.dot(A, np.linalg.pinv(A)).T.astype('float32')
 
-        # slice images
-        wht_win = self._extract_win(self._wht_img, mic, margin)
-        lfp_win = self._extract_win(self._lfp_img, mic, margin)
+        # window offsets in row-major order
+        dy, dx = np.divmod(np.arange(k*k, dtype='int32'), np.int32(k))
+        y0, x0 = y0.astype('int32'), x0.astype('int32')
 
-        # fit micro image
-        if self.noise_lev > self.noise_th:
-            _, weight_win = self.fit_patch(wht_win)
-        else:
-            weight_win = wht_win/wht_win.max()
+        for i in range(0, len(y0), PATCH_CHUNK):
 
-        # apply vignetting correction
-        div_win = np.divide(lfp_win, weight_win, out=np.zeros_like(weight_win), where=weight_win != 0)
-        olap = self._cent_pitch + margin
-        self._lfp_img[rint(mic[0])-olap:rint(mic[0])+olap+1, rint(mic[1])-olap:rint(mic[1])+olap+1] = div_win
+            # gather white patches of lens chunk as (n, k*k) matrix
+            ys = y0[i:i+PATCH_CHUNK, None] + dy
+            xs = x0[i:i+PATCH_CHUNK, None] + dx
+            patches = wht_img[ys, xs].astype('float32')
+            patches = np.dot(patches, proj) if proj is not None else patches
+            patches /= patches.max(axis=1, keepdims=True)
+
+            # scatter reciprocal vignetting correction
+            rcp_wins = np.divide(1, patches, out=np.zeros_like(patches), where=patches != 0)
+            self._rcp_img[ys, xs] = rcp_wins[..., None] if len(self._rcp_img.shape) == 3 else rcp_wins
+
+            # check interrupt status
+            if self.sta.interrupt:
+                return False
 
         return True
 
@@ -155,7 +218,7 @@ class LfpDevignetter(LfpMicroLenses):
                              x ** 3, y ** 3, x ** 3 * y, x * y ** 3, x ** 3 * y ** 2, x ** 2 * y ** 3,
                              x ** 3 * y ** 3]).T
 
-    def _estimate_noise_level(self):
+    def _estimate_noise_level(self, wht_img=None):
         """ estimate white image noise level """
 
         # print status
@@ -164,10 +227,11 @@ class LfpDevignetter(LfpMicroLenses):
 
         user_pitch = np.mean(self.cfg.calibs[self.cfg.ptc_mean])
         lp_kernel = misc.create_gauss_kernel(length=int(user_pitch))
-        if len(self._wht_img.shape) == 3:
-            bw_img = rgb2gry(self._wht_img)[..., 0] if self._wht_img.shape[2] == 3 else self._wht_img[..., 0]
+        wht_img = self._wht_img if wht_img is None else wht_img
+        if len(wht_img.shape) == 3:
+            bw_img = rgb2gry(wht_img)[..., 0] if wht_img.shape[2] == 3 else wht_img[..., 0]
         else:
-            bw_img = self._wht_img
+            bw_img = wht_img
         flt_img = convolve2d(bw_img, lp_kernel, 'same')
 
         self.sta.progress(100, self.cfg.params[self.cfg.opt_prnt])
@@ -180,4 +244,8 @@ class LfpDevignetter(LfpMicroLenses):
 
     @property
     def wht_img(self):
-        return self._wht_img
+        return self._wht_img / self._wht_max
+
+    @property
+    def rcp_img(self):
+        return self._rcp_img
@@ -1,12 +1,13 @@
 # local imports
 from plenopticam.lfp_aligner.lfp_microlenses import LfpMicroLenses
 from plenopticam.lfp_calibrator.grid_fitter import GridFitter
-from plenopticam import misc
+from plenopticam.lfp_aligner.lfp_local_resampler import sample_taps, LENS_CHUNK
+from plenopticam.lfp_aligner.lfp_align_lut import LfpAlignLut
 
 # external libs
 import numpy as np
 from skimage import transform
-import copy
+from scipy.interpolate import make_interp_spline
 
 
 class LfpGlobalResampler(LfpMicroLenses):
@@ -31,6 +32,43 @@ class LfpGlobalResampler(LfpMicroLenses):
 
     def projective_alignment(self):
 
+        # transform light-field image
+        tra_mat, oshape = self.projective_matrix()
+        tform = transform.ProjectiveTransform(matrix=tra_mat)
+
+        rows, cols = [self.crop_indices(oshape[i], self._limg_pitch[i]) for i in range(2)]
+        if self.cfg.calibs[self.cfg.pat_type] == 'rec' and (rows is not None or cols is not None):
+            # warp only samples surviving the angular crop (grid of central micro image samples)
+            rows = np.arange(oshape[0]) if rows is None else rows
+            cols = np.arange(oshape[1]) if cols is None else cols
+
+            def inverse_map(xy):
+                return tform.inverse(np.column_stack([cols[xy[:, 0].astype('int')], rows[xy[:, 1].astype('int')]]))
+
+            self._lfp_prj = transform.warp(self._lfp_img, inverse_map, output_shape=(len(rows), len(cols)))
+            self._limg_pitch = self.crop_pitch(self._limg_pitch)
+        else:
+            self._lfp_prj = transform.warp(self._lfp_img, tform.inverse, output_shape=oshape)
+
+    def crop_indices(self, length, pitch):
+        """ indices of central micro image samples of target size along an axis (None if nothing is cropped) """
+
+        k = (pitch - self._size_pitch) // 2
+        if k <= 0 or self._size_pitch == 0:
+            return None
+
+        return (np.arange(length // pitch)[:, None] * pitch + np.arange(k, pitch-k)).ravel()
+
+    def crop_pitch(self, pitch):
+        """ micro image size after angular crop to target size """
+
+        pitch = np.asarray(pitch, dtype='int')
+
+        return pitch - 2*((pitch - self._size_pitch) // 2).clip(0) if self._size_pitch else pitch
+
+    def projective_matrix(self):
+        """ transfer matrix (in xy-coordinates) from raw image to regular grid and shape of rectified image """
+
         # get projective matrix from centroids
         gfxy = GridFitter(self._CENTROIDS.copy(), flip_xy=True)
         gfxy.main()
@@ -77,9 +115,33 @@ class LfpGlobalResampler(LfpMicroLenses):
         # compute transfer matrix
         tra_mat = np.dot(pmat_grid, np.linalg.inv(pmat_cent))
 
-        # transform light-field image
-        tform = transform.ProjectiveTransform(matrix=tra_mat)
-        self._lfp_prj = transform.warp(self._lfp_img, tform.inverse, output_shape=oshape)
+        # compose de-rotation (given in yx-coordinates) to map from raw image in a single interpolation
+        if self._rot_mat is not None:
+            flip = np.array([[0, 1, 0], [1, 0, 0], [0, 0, 1]])
+            tra_mat = np.dot(tra_mat, np.dot(flip, np.dot(self._rot_mat, flip)))
+
+        return tra_mat, oshape
+
+    def global_lut(self):
+        """ remap table of projective warp for rectangular arrangements (resizing as fractional sampling) """
+
+        tra_mat, oshape = self.projective_matrix()
+        inv_mat = np.linalg.inv(tra_mat)
+        shape = self._lfp_img.shape[:2]
+
+        # samples surviving the angular crop
+        rows, cols = [self.crop_indices(oshape[i], self._limg_pitch[i]) for i in range(2)]
+        rows = np.arange(oshape[0]) if rows is None else rows
+        cols = np.arange(oshape[1]) if cols is None else cols
+        r, c = np.meshgrid(rows, cols, indexing='ij')
+
+        # bilinear taps of rectified image at rows and columns
+        w = inv_mat[2, 0]*c + inv_mat[2, 1]*r + inv_mat[2, 2]
+        xs = (inv_mat[0, 0]*c + inv_mat[0, 1]*r + inv_mat[0, 2]) / w
+        ys = (inv_mat[1, 0]*c + inv_mat[1, 1]*r + inv_mat[1, 2]) / w
+        idx, wgt = sample_taps(ys, xs, shape, 'linear')
+
+        return LfpAlignLut(idx, wgt, idx.shape[:2], pitch=self.crop_pitch(self._limg_pitch))
 
     def hexagonal_alignment(self):
 
@@ -93,75 +155,90 @@ class LfpGlobalResampler(LfpMicroLenses):
             self._lfp_img_align = self._lfp_prj
             return True
 
-        dims = self._lfp_prj.shape
-        lens_new_x = int(round(self._LENS_X_MAX*2/np.sqrt(3)))
-        pad_zro = np.zeros([*self._limg_pitch, dims[2]])
-        pad_hlf = np.zeros([self._limg_pitch[0], self._limg_pitch[1]//2, dims[2]])
-        hex_switch = copy.copy(self._hex_odd)
+        py, px = self._limg_pitch
+        hlf = px // 2
         lnew_pitch = self._limg_pitch + np.mod(self._limg_pitch+1, 2)
-
-        # add one in micro image size for odd
-        self._lfp_img_align = np.zeros([int((self._LENS_Y_MAX-1)*(self._limg_pitch[0]+1)),
-                                        int(lens_new_x*(self._limg_pitch[1]+1)),
-                                        dims[2]])
-
-        for ly in range(self._LENS_Y_MAX-1):
-
-            # print progress status for on console
-            self.sta.progress((ly+1)/self._LENS_Y_MAX*100, self.cfg.params[self.cfg.opt_prnt])
-
-            if hex_switch == 1:
-                row_a = np.hstack(
-                    [pad_hlf,
-                     self._lfp_prj[ly*self._limg_pitch[0]:(ly+1)*self._limg_pitch[0], :-self._limg_pitch[1]//2, :]])
-                row_b = self._lfp_prj[(ly+1)*self._limg_pitch[0]:(ly+2)*self._limg_pitch[0], ...]
-                row_c = np.hstack([row_a[:, self._limg_pitch[1]:, :], pad_zro])
-            else:
-                row_a = self._lfp_prj[ly*self._limg_pitch[0]:(ly+1)*self._limg_pitch[0], ...]
-                row_b = np.hstack(
-                    [pad_hlf,
-                     self._lfp_prj[(ly+1)*self._limg_pitch[0]:(ly+2)*self._limg_pitch[0], :-self._limg_pitch[1]//2, :]])
-                row_c = np.hstack([row_b[:, self._limg_pitch[1]:, :], pad_zro])
-
-            row_tensor = np.concatenate([row_a[..., None], row_b[..., None], row_c[..., None]], axis=-1)
-            row_interp = np.mean(row_tensor, axis=-1)
+        lfp_prj = self._lfp_prj if len(self._lfp_prj.shape) == 3 else self._lfp_prj[..., None]
+
+        # columns of half micro images at first and last position are skipped
+        str_len = int(round(self._LENS_X_MAX * 2 / np.sqrt(3))) * px
+        new_lens = [lnew_pitch[0], int(round(str_len * lnew_pitch[1] / px))]
+        col_off = lnew_pitch[1]//2+1
+        col_num = new_lens[1] - col_off - (lnew_pitch[1]+1)//2
+
+        # samples surviving the angular crop within micro image rows and columns
+        sel = [self.crop_indices(lnew_pitch[0], lnew_pitch[0]), self.crop_indices(col_num, lnew_pitch[1])]
+        sel[0] = np.arange(lnew_pitch[0]) if sel[0] is None else sel[0]
+        sel[1] = col_off + (np.arange(col_num) if sel[1] is None else sel[1])
+        lfp_img_align = np.zeros(((self._LENS_Y_MAX-1)*len(sel[0]), len(sel[1]), lfp_prj.shape[2]))
+
+        # chunks of lens rows (each blended with its lower neighbor) written straight into the aligned image
+        rows_num = max(LENS_CHUNK // self._LENS_X_MAX, 1)
+        for ly in range(0, self._LENS_Y_MAX-1, rows_num):
+            ly_end = min(ly+rows_num, self._LENS_Y_MAX-1)
+
+            # micro image rows of chunk and next lens row as (lens row, pixel row, column, channel) tensor
+            rows = np.zeros(((ly_end-ly+1)*py,) + lfp_prj.shape[1:])
+            seg = lfp_prj[ly*py:(ly_end+1)*py]
+            rows[:len(seg)] = seg
+            rows = rows.reshape((ly_end-ly+1, py) + lfp_prj.shape[1:])
+
+            # hexagonal shift orientation flips every other micro lens row
+            hex_switch = ((np.arange(ly, ly_end) + int(self._hex_odd)) % 2 == 1)[:, None, None, None]
+            row_interp = np.where(hex_switch, rows[1:], rows[:-1])
+            adj_rows = np.where(hex_switch, rows[:-1], rows[1:])
+            del rows
+
+            # average of each row with its half-pitch shifted (left and right) neighbor row
+            row_interp[:, :, hlf:] += adj_rows[:, :, :-hlf]
+            row_interp[:, :, :-px] += adj_rows[:, :, hlf:-hlf]
+            row_interp /= 3
+            del adj_rows
 
             # elongation to compensate for hexagonal aspect ratio
             row_string = self.hex_stretch(row_interp)
+            del row_interp
 
-            # resize row for odd micro image pitch
-            row_string = misc.img_resize(row_string,
-                                         x_scale=lnew_pitch[1] / self._limg_pitch[1],
-                                         y_scale=lnew_pitch[0] / self._limg_pitch[0])
+            # resize rows for odd micro image pitch (separable spline interpolation evaluated at surviving samples)
+            for axis, old_len, new_len, idx in zip([1, 2], [py, row_string.shape[2]], new_lens, sel):
+                spline = make_interp_spline(np.arange(old_len), row_string, k=min(3, old_len-1), axis=axis)
+                row_string = spline(np.linspace(0, old_len-1, new_len)[idx])
 
-            # place micro image row into aligned image
-            self._lfp_img_align[ly*(self._limg_pitch[0]+1):(ly+1)*(self._limg_pitch[0]+1), ...] = row_string
+            # place micro image rows into aligned image
+            lfp_img_align[ly*len(sel[0]):ly_end*len(sel[0])] = row_string.reshape((-1,) + row_string.shape[2:])
 
-            # flip hexagonal shift orientation every other micro lens row
-            hex_switch = not hex_switch
+            # check interrupt status
+            if self.sta.interrupt:
+                return False
 
-        # re-evaluate new odd micro image size
-        self._limg_pitch = lnew_pitch
+            # print progress status
+            self.sta.progress(ly_end/(self._LENS_Y_MAX-1)*100, self.cfg.params[self.cfg.opt_prnt])
 
-        # skip first and last column of half micro images
-        self._lfp_img_align = self._lfp_img_align[:, self._limg_pitch[1]//2+1:-self._limg_pitch[1]//2, :]
+        self._lfp_img_align = lfp_img_align if len(self._lfp_prj.shape) == 3 else lfp_img_align[..., 0]
+
+        # re-evaluate new odd micro image size
+        self._limg_pitch = self.crop_pitch(lnew_pitch)
 
         return self._lfp_img_align
 
     def hex_stretch(self, lf_row):
+        """ image stretch interpolation in x-direction (second last axis) to compensate for hex-alignment """
 
-        dims = lf_row.shape
+        px = self._limg_pitch[1]
         lens_new_x = int(round(self._LENS_X_MAX * 2 / np.sqrt(3)))
-        interp_stack = np.zeros([dims[0], lens_new_x * self._limg_pitch[1], dims[2]])
-
-        # image stretch interpolation in x-direction to compensate for hex-alignment
-        for y in range(self._limg_pitch[0]):
-            for x in range(self._limg_pitch[1]):
-                lf_row_pos = lf_row[y, x::self._limg_pitch[1], :]
-                for p in range(dims[2]):
-                    # stack of micro images elongated in x-direction
-                    interp_coords = np.linspace(0, self._LENS_X_MAX, lens_new_x)
-                    interp_string = np.interp(interp_coords, range(self._LENS_X_MAX), lf_row_pos[:self._LENS_X_MAX, p])
-                    interp_stack[y, x::self._limg_pitch[1], p] = interp_string
-
-        return interp_stack
+
+        # group columns by lens index and position within micro image
+        cols = np.zeros(lf_row.shape[:-2] + (self._LENS_X_MAX*px, lf_row.shape[-1]))
+        cols[..., :min(lf_row.shape[-2], cols.shape[-2]), :] = lf_row[..., :cols.shape[-2], :]
+        cols = cols.reshape(lf_row.shape[:-2] + (self._LENS_X_MAX, px, lf_row.shape[-1]))
+
+        # precomputed linear interpolation weights along lens index (clamped at last lens)
+        interp_coords = np.linspace(0, self._LENS_X_MAX, lens_new_x)
+        idx_a = np.minimum(np.floor(interp_coords).astype('int'), self._LENS_X_MAX-1)
+        idx_b = np.minimum(idx_a+1, self._LENS_X_MAX-1)
+        weights = (interp_coords - idx_a)[:, None, None]
+
+        # stack of micro images elongated in x-direction
+        interp_stack = cols[..., idx_a, :, :] * (1-weights) + cols[..., idx_b, :, :] * weights
+
+        return interp_stack.reshape(lf_row.shape[:-2] + (lens_new_x*px, lf_row.shape[-1]))
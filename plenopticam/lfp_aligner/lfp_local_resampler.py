@@ -1,11 +1,60 @@
 # local imports
-from plenopticam.misc.type_checks import rint
 from plenopticam.lfp_aligner.lfp_microlenses import LfpMicroLenses
+from plenopticam.lfp_aligner.lfp_align_lut import LfpAlignLut
 
 # external libs
 import numpy as np
-import functools
-from scipy.interpolate import interp2d, RectBivariateSpline
+from scipy.ndimage import map_coordinates, spline_filter
+
+# maximum number of micro images interpolated in one batch
+LENS_CHUNK = 2**14
+
+
+def shift_kernel(x, method='linear'):
+    """ 1-D interpolation kernel evaluated at distances x """
+
+    if method == 'nearest':
+        # half-open interval assigns samples exactly between two taps to one of them
+        return ((x > -.5) & (x <= .5)).astype('float')
+
+    x = np.abs(x)
+    if method == 'cubic':
+        # cubic convolution kernel (Keys, a=-0.5)
+        return np.where(x <= 1, 1.5*x**3 - 2.5*x**2 + 1, np.where(x < 2, -.5*x**3 + 2.5*x**2 - 4*x + 2, 0))
+
+    return np.maximum(1-x, 0)
+
+
+def shift_weights(frac, k, method='linear'):
+    """ (N, k, k) matrices resampling k samples at positions shifted by fractional offsets (edges replicated) """
+
+    taps = np.arange(-2, k+2)
+    pos = np.arange(k)[None, :] + np.asarray(frac)[:, None]
+    weights = shift_kernel(pos[..., None] - taps, method)
+
+    # fold weights of taps beyond the window onto its edges
+    mat = weights[..., 2:-2].copy()
+    mat[..., 0] += weights[..., :2].sum(-1)
+    mat[..., -1] += weights[..., -2:].sum(-1)
+
+    return mat
+
+
+def sample_taps(ys, xs, shape, method='linear'):
+    """ flat pixel indices and weights interpolating an image of given shape at coordinates (zero outside) """
+
+    n = 4 if method == 'cubic' else 2
+    ys, xs = np.broadcast_arrays(np.asarray(ys, dtype='float64'), np.asarray(xs, dtype='float64'))
+    offsets = np.arange(n) - (n//2 - 1)
+
+    # separable taps of kernel support around each coordinate (taps outside the image are weighted by zero)
+    ty, tx = np.floor(ys)[..., None] + offsets, np.floor(xs)[..., None] + offsets
+    wy = shift_kernel(ys[..., None] - ty, method) * ((ty >= 0) & (ty < shape[0]))
+    wx = shift_kernel(xs[..., None] - tx, method) * ((tx >= 0) & (tx < shape[1]))
+    idx = np.clip(ty, 0, shape[0]-1)[..., :, None] * shape[1] + np.clip(tx, 0, shape[1]-1)[..., None, :]
+    wgt = wy[..., :, None] * wx[..., None, :]
+
+    return idx.reshape(ys.shape + (n*n,)).astype('int32'), wgt.reshape(ys.shape + (n*n,)).astype('float32')
 
 
 class LfpLocalResampler(LfpMicroLenses):
@@ -15,16 +64,8 @@ class LfpLocalResampler(LfpMicroLenses):
 
         # interpolation method initialization
         method = kwargs['method'] if 'method' in kwargs else 'linear'
-        method = method if method in ['nearest', 'linear', 'cubic', 'quintic'] else 'linear'
-        method = 'cubic' if method == 'quintic' and self._size_pitch < 5 else method
-        interp2d_method = functools.partial(interp2d, kind=method) if method is not None else interp2d
-
-        if method is None:
-            self._interpol_method = RectBivariateSpline
-        elif method == 'nearest':
-            self._interpol_method = self._nearest
-        else:
-            self._interpol_method = interp2d_method
+        method = method if method in ['nearest', 'linear', 'cubic', 'quintic', None] else 'linear'
+        self._interpol_method = 'cubic' if method in ['quintic', None] else method
 
     def local_resampling(self):
         """ cropping micro images to square shape while interpolating around their detected center (MIC) """
@@ -33,116 +74,193 @@ class LfpLocalResampler(LfpMicroLenses):
         if self.sta.interrupt:
             return False
 
-        # start resampling process (taking micro lens arrangement into account)
-        if self.cfg.calibs[self.cfg.pat_type] == 'rec':
-            self.resample_rec()
-        elif self.cfg.calibs[self.cfg.pat_type] == 'hex':
-            self.resample_hex()
+        # aligned light-field with micro images in lens order (stretched in x-direction for hexagonal arrangement)
+        n = self._size_pitch
+        hex_opt = self.cfg.calibs[self.cfg.pat_type] == 'hex'
+        lens_x = int(np.round(2 * self._LENS_X_MAX / np.sqrt(3))) if hex_opt else self._LENS_X_MAX
+        self._lfp_img_align = np.zeros([self._LENS_Y_MAX * n, lens_x * n, self._DIMS[2]], dtype='float32')
 
-        return True
+        # check if lower neighbor of upper left MIC is shifted to left or right
+        hex_odd = self.get_hex_direction(self._CENTROIDS) if hex_opt else 0
 
-    def _patch_align(self, window, mic):
+        # cubic spline coefficients of raw image channels (prefiltered once for all chunks of fused de-rotation)
+        coeffs = None
+        if self._rot_mat is not None:
+            lfp_img = self._lfp_img if len(self._lfp_img.shape) == 3 else self._lfp_img[..., None]
+            coeffs = [spline_filter(lfp_img[..., p], order=3, output='float32', mode='constant')
+                      for p in range(self._DIMS[2])]
 
-        # initialize patch
-        patch = np.zeros(window.shape)
+        # interpolate micro images around their MICs in chunks of lens rows (from raw image for fused de-rotation)
+        rows_num = max(LENS_CHUNK // self._LENS_X_MAX, 1)
+        for ly in range(0, self._LENS_Y_MAX, rows_num):
+            mics = self._mic_lut[ly:ly+rows_num]
+            patches = self._rotated_patches(mics, coeffs) if coeffs is not None else self._shifted_patches(mics)
 
-        # verify patch shapes as wrong shapes cause crashes
-        if window.shape[0] == self._size_pitch+2 and window.shape[1] == self._size_pitch+2:
-            # iterate through color channels
-            for p in range(self._DIMS[2]):
+            # write chunk into aligned light-field (taking micro lens arrangement into account)
+            self.resample_hex(patches, ly, hex_odd) if hex_opt else self.resample_rec(patches, ly)
+            del patches
 
-                fun = self._interpol_method(range(window.shape[1]), range(window.shape[0]), window[:, :, p])
+            # check interrupt status
+            if self.sta.interrupt:
+                return False
 
-                patch[:, :, p] = fun(np.arange(window.shape[1])+mic[1]-rint(mic[1]),
-                                     np.arange(window.shape[0])+mic[0]-rint(mic[0]))
-        else:
-            self.sta.status_msg('Warning: chosen micro image size exceeds light-field borders')
-            return np.zeros((self._size_pitch+2,)*2+(window.shape[2],))
+            # print progress status
+            self.sta.progress(min(ly+rows_num, self._LENS_Y_MAX)/self._LENS_Y_MAX*100, self.cfg.params[self.cfg.opt_prnt])
+        del coeffs
 
-        # flip patch to compensate for micro lens rotation
-        patch = np.flip(patch, axis=(0, 1)) if self._flip else patch
+        # micro image size in aligned light field
+        self._limg_pitch = np.array([self._size_pitch, self._size_pitch])
 
-        return patch
+        return True
 
-    def _nearest(self, range0, range1, window):
+    def _shifted_patches(self, mics):
+        """ batched sub-pixel translation of micro image windows by fractional part of their MICs """
 
-        def shift_win(shifted_range0, shifted_range1):
-            range0 = np.round(shifted_range0).astype('int')
-            range1 = np.round(shifted_range1).astype('int')
-            return window[range0[0]:range0[-1]+1, range1[0]:range0[-1]+1]
+        k, n = self._size_pitch + 2, self._size_pitch
+        lfp_img = self._lfp_img if len(self._lfp_img.shape) == 3 else self._lfp_img[..., None]
+        rows_shape = mics.shape[:2]
+        mics = mics.reshape(-1, 2)
+        found = ~np.isnan(mics[:, 0])
+        mics = np.nan_to_num(mics)
 
-        return shift_win
+        # window origins and fractional offsets of MICs
+        org = np.round(mics).astype('int') - self._cent_pitch - 1
+        frac = mics - np.round(mics)
 
-    def resample_rec(self):
+        # windows exceeding light-field borders (or of missing lenses) remain empty
+        valid = np.all((org >= 0) & (org + k <= np.array(lfp_img.shape[:2])), axis=1)
+        if not np.all(valid[found]):
+            self.sta.status_msg('Warning: chosen micro image size exceeds light-field borders')
+        valid &= found
+
+        # gather windows as (N, k, k, channels) tensor
+        ys = np.clip(org[:, 0][:, None] + np.arange(k), 0, lfp_img.shape[0]-1)
+        xs = np.clip(org[:, 1][:, None] + np.arange(k), 0, lfp_img.shape[1]-1)
+        windows = lfp_img[ys[:, :, None], xs[:, None, :]] * valid[:, None, None, None]
+
+        # separable shift by per-lens weight matrices along vertical and horizontal axis (window border skipped)
+        wy = shift_weights(frac[:, 0], k, self._interpol_method)[:, 1:-1]
+        wx = shift_weights(frac[:, 1], k, self._interpol_method)[:, 1:-1]
+        windows = np.matmul(wy, windows.reshape(len(mics), k, -1)).reshape((len(mics), n) + windows.shape[2:])
+        windows = np.matmul(wx[:, None], windows)
+
+        # flip patches to compensate for micro lens rotation
+        windows = np.flip(windows, axis=(1, 2)) if self._flip else windows
+
+        return windows.reshape(rows_shape + windows.shape[1:])
+
+    def _rotated_patches(self, mics, coeffs):
+        """ interpolate micro images of lenses at de-rotated sample positions from spline coefficients of raw image """
+
+        # sample offsets around each (rotated) MIC
+        offsets = np.arange(self._size_pitch) - self._cent_pitch
+        patches = np.zeros(mics.shape[:2] + (self._size_pitch, self._size_pitch, self._DIMS[2]), dtype='float32')
+        found = ~np.isnan(mics[..., 0])
+
+        # map rotated sample positions back to raw image coordinates
+        ys = mics[found][:, 0][:, None, None] + offsets[None, :, None]
+        xs = mics[found][:, 1][:, None, None] + offsets[None, None, :]
+        inv_mat = np.linalg.inv(self._rot_mat)
+        coords = np.array([inv_mat[0, 0]*ys + inv_mat[0, 1]*xs + inv_mat[0, 2],
+                           inv_mat[1, 0]*ys + inv_mat[1, 1]*xs + inv_mat[1, 2]])
+
+        # cubic interpolation (as for image rotation) of each channel
+        for p, coeff in enumerate(coeffs):
+            patches[found, ..., p] = map_coordinates(coeff, coords, order=3, mode='constant', prefilter=False)
+
+        # flip patches to compensate for micro lens rotation
+        patches = np.flip(patches, axis=(2, 3)) if self._flip else patches
+
+        return patches
+
+    def local_lut(self):
+        """ remap table of local resampling (with fused de-rotation and hexagonal stretch) """
+
+        shape = self._lfp_img.shape[:2]
+        k = self._size_pitch + 2
+        offsets = np.arange(self._size_pitch) - self._cent_pitch
+        offsets = offsets[::-1] if self._flip else offsets
+        inv_mat = np.linalg.inv(self._rot_mat) if self._rot_mat is not None else None
+
+        # taps of each micro image pixel as (lens y, lens x, pixel y, pixel x, taps) arrays
+        idx, wgt = [], []
+        rows_num = max(LENS_CHUNK // self._LENS_X_MAX, 1)
+        for ly in range(0, self._LENS_Y_MAX, rows_num):
+            mics = self._mic_lut[ly:ly+rows_num]
+            found = ~np.isnan(mics[..., 0])
+            mics = np.nan_to_num(mics)
+            ys = mics[..., 0][..., None, None] + offsets[:, None]
+            xs = mics[..., 1][..., None, None] + offsets[None, :]
+
+            if inv_mat is not None:
+                # sample positions in raw image (de-rotation)
+                ys, xs = (inv_mat[0, 0]*ys + inv_mat[0, 1]*xs + inv_mat[0, 2],
+                          inv_mat[1, 0]*ys + inv_mat[1, 1]*xs + inv_mat[1, 2])
+                valid = found
+            else:
+                # windows exceeding light-field borders (or of missing lenses) remain empty
+                org = np.round(mics).astype('int') - self._cent_pitch - 1
+                valid = np.all((org >= 0) & (org + k <= np.array(shape)), axis=-1) & found
+
+            idx_rows, wgt_rows = sample_taps(ys, xs, shape, self._interpol_method)
+            idx.append(idx_rows)
+            wgt.append(wgt_rows * valid[..., None, None, None])
 
-        # initialize variables required for micro image resampling process
-        self._lfp_img_align = np.zeros([self._LENS_Y_MAX * self._size_pitch,
-                                        self._LENS_X_MAX * self._size_pitch,
-                                        self._DIMS[2]])
+            # print progress status
+            self.sta.progress(min(ly+rows_num, self._LENS_Y_MAX)/self._LENS_Y_MAX*100, self.cfg.params[self.cfg.opt_prnt])
 
-        # iterate over each MIC
-        for ly in range(self._LENS_Y_MAX):
-            for lx in range(self._LENS_X_MAX):
+        idx, wgt = np.concatenate(idx), np.concatenate(wgt)
 
-                # find MIC by indices
-                mic = self.get_coords_by_idx(ly=ly, lx=lx)
+        if self.cfg.calibs[self.cfg.pat_type] == 'hex':
+            # image stretch in x-direction as blend of taps from neighboring lenses
+            hex_stretch = int(np.round(2 * self._LENS_X_MAX / np.sqrt(3)))
+            idx_hex = np.zeros((self._LENS_Y_MAX, hex_stretch) + idx.shape[2:-1] + (2*idx.shape[-1],), idx.dtype)
+            wgt_hex = np.zeros(idx_hex.shape, dtype=wgt.dtype)
+            for parity in range(2):
+                rows = np.mod(np.arange(self._LENS_Y_MAX)+self._hex_odd, 2) == parity
+                interp_coords = np.linspace(0, self._LENS_X_MAX, hex_stretch) + .5*parity
+                idx_a = np.minimum(np.floor(interp_coords).astype('int'), self._LENS_X_MAX-1)
+                idx_b = np.minimum(idx_a+1, self._LENS_X_MAX-1)
+                weights = (interp_coords - idx_a)[:, None, None, None].astype(wgt.dtype)
+                idx_hex[rows] = np.concatenate([idx[rows][:, idx_a], idx[rows][:, idx_b]], axis=-1)
+                wgt_hex[rows] = np.concatenate([wgt[rows][:, idx_a] * (1-weights), wgt[rows][:, idx_b] * weights], -1)
+            idx, wgt = idx_hex, wgt_hex
 
-                # interpolate each micro image with its MIC as the center with consistent micro image size
-                window = self._lfp_img[rint(mic[0]) - self._cent_pitch - 1:rint(mic[0]) + self._cent_pitch + 2,
-                                       rint(mic[1]) - self._cent_pitch - 1:rint(mic[1]) + self._cent_pitch + 2]
-                self._lfp_img_align[ly*self._size_pitch:(ly+1)*self._size_pitch,
-                                    lx*self._size_pitch:(lx+1)*self._size_pitch] = \
-                    self._patch_align(window, mic)[1:-1, 1:-1]
+        # arrange micro images in lens order
+        shape = (idx.shape[0] * self._size_pitch, idx.shape[1] * self._size_pitch)
+        idx = idx.transpose(0, 2, 1, 3, 4).reshape(shape + idx.shape[-1:])
+        wgt = wgt.transpose(0, 2, 1, 3, 4).reshape(shape + wgt.shape[-1:])
 
-            # check interrupt status
-            if self.sta.interrupt:
-                return False
+        return LfpAlignLut(idx, wgt, shape, pitch=[self._size_pitch, self._size_pitch])
 
-            # print progress status for on console
-            self.sta.progress((ly + 1) / self._LENS_Y_MAX * 100, self.cfg.params[self.cfg.opt_prnt])
+    def _align_rows(self, ly, num):
+        """ aligned light-field rows of lens rows as (lens row, pixel row, lens column, pixel column, channel) view """
 
-        return True
+        n = self._size_pitch
+        lfp_rows = self._lfp_img_align[ly*n:(ly+num)*n]
 
-    def resample_hex(self):
+        return lfp_rows.reshape(num, n, lfp_rows.shape[1] // n, n, lfp_rows.shape[2])
 
-        # initialize variables required for micro image resampling process
-        patch_stack = np.zeros([self._LENS_X_MAX, self._size_pitch, self._size_pitch, self._DIMS[2]])
-        hex_stretch = int(np.round(2 * self._LENS_X_MAX / np.sqrt(3)))
-        interp_stack = np.zeros([hex_stretch, self._size_pitch, self._size_pitch, self._DIMS[2]])
-        self._lfp_img_align = np.zeros([self._LENS_Y_MAX*self._size_pitch, hex_stretch*self._size_pitch, self._DIMS[2]])
+    def resample_rec(self, patches, ly=0):
 
-        # check if lower neighbor of upper left MIC is shifted to left or right
-        hex_odd = self.get_hex_direction(self._CENTROIDS)
-
-        # iterate over each MIC
-        for ly in range(self._LENS_Y_MAX):
-            for lx in range(self._LENS_X_MAX):
-
-                # find MIC by indices
-                mic = self.get_coords_by_idx(ly=ly, lx=lx)
-
-                # interpolate each micro image with its MIC as the center and consistent micro image size
-                window = self._lfp_img[rint(mic[0]) - self._cent_pitch - 1:rint(mic[0]) + self._cent_pitch + 2,
-                         rint(mic[1]) - self._cent_pitch - 1:rint(mic[1]) + self._cent_pitch + 2]
-                patch_stack[lx, :, :] = self._patch_align(window, mic)[1:-1, 1:-1]
-
-            # image stretch interpolation in x-direction to compensate for hex-alignment
-            for y in range(self._size_pitch):
-                for x in range(self._size_pitch):
-                    for p in range(self._DIMS[2]):
-                        # stack of micro images elongated in x-direction
-                        interp_coords = np.linspace(0, self._LENS_X_MAX, int(np.round(self._LENS_X_MAX*2/np.sqrt(3))))+\
-                                        .5*np.mod(ly+hex_odd, 2)
-                        interp_stack[:, y, x, p] = np.interp(interp_coords, range(self._LENS_X_MAX), patch_stack[:, y, x, p])
-
-            self._lfp_img_align[ly*self._size_pitch:(ly+1)*self._size_pitch, :] = \
-                np.concatenate(interp_stack, axis=1).reshape((self._size_pitch,
-                                                              hex_stretch*self._size_pitch,
-                                                              self._DIMS[2]))
+        # arrange micro images of lens rows in lens order
+        self._align_rows(ly, len(patches))[...] = patches.transpose(0, 2, 1, 3, 4)
 
-            # check interrupt status
-            if self.sta.interrupt:
-                return False
+        return True
 
-            # print progress status
-            self.sta.progress((ly+1) / self._LENS_Y_MAX * 100, self.cfg.params[self.cfg.opt_prnt])
+    def resample_hex(self, patches, ly=0, hex_odd=0):
+
+        align_rows = self._align_rows(ly, len(patches))
+        hex_stretch = align_rows.shape[2]
+
+        # image stretch interpolation in x-direction to compensate for hex-alignment (shifted every other row)
+        for parity in range(2):
+            rows = np.mod(np.arange(ly, ly+len(patches))+hex_odd, 2) == parity
+            interp_coords = np.linspace(0, self._LENS_X_MAX, hex_stretch) + .5*parity
+            idx_a = np.minimum(np.floor(interp_coords).astype('int'), self._LENS_X_MAX-1)
+            idx_b = np.minimum(idx_a+1, self._LENS_X_MAX-1)
+            weights = (interp_coords - idx_a)[:, None, None, None]
+            interp_stack = patches[rows][:, idx_a] * (1-weights) + patches[rows][:, idx_b] * weights
+            align_rows[rows] = interp_stack.transpose(0, 2, 1, 3, 4)
+
+        return True
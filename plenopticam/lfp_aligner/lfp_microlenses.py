@@ -22,9 +22,13 @@ Copyright (c) 2019 Christopher Hahne <info@christopherhahne.de>
 
 from plenopticam.cfg import PlenopticamConfig
 from plenopticam import misc
+from plenopticam.lfp_aligner.lfp_align_store import LfpAlignStore
 
 import numpy as np
-import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# number of lens row chunks per worker
+LENS_CHUNKS = 4
 
 
 class LfpMicroLenses(object):
@@ -39,19 +43,29 @@ class LfpMicroLenses(object):
         self._wht_img = kwargs['wht_img'] if 'wht_img' in kwargs else None
         self._lfp_img_align = kwargs['lfp_img_align'] if 'lfp_img_align' in kwargs else None
         self._flip = kwargs['flip'] if 'flip' in kwargs else False
+        self._rot_mat = kwargs['rot_mat'] if 'rot_mat' in kwargs else None
+        self._align_meta = kwargs['align_meta'] if 'align_meta' in kwargs else None
+        self._workers = kwargs['workers'] if 'workers' in kwargs else 1
 
         # convert to float
         self._lfp_img = self._lfp_img.astype('float64') if self._lfp_img is not None else None
         self._wht_img = self._wht_img.astype('float64') if self._wht_img is not None else None
 
-        if self.cfg.calibs:
+        # MICs given explicitly (e.g. of a region of interest) or from calibration
+        mic_list = kwargs['mic_list'] if 'mic_list' in kwargs else None
+        mic_list = self.cfg.calibs[self.cfg.mic_list] if mic_list is None and self.cfg.calibs else mic_list
+
+        if mic_list is not None:
             # micro lens array variables
-            self._CENTROIDS = np.asarray(self.cfg.calibs[self.cfg.mic_list])
+            self._CENTROIDS = np.asarray(mic_list)
             self._LENS_Y_MAX = int(max(self._CENTROIDS[:, 2])+1)    # +1 to account for index 0
             self._LENS_X_MAX = int(max(self._CENTROIDS[:, 3])+1)    # +1 to account for index 0
             self._PAT_TYPE = self.cfg.calibs[self.cfg.pat_type] if self.cfg.pat_type in self.cfg.calibs else 'rec'
             self._hex_odd = self.get_hex_direction(self._CENTROIDS)
 
+            # dense look-up table of MICs by lens indices
+            self._mic_lut = self.build_mic_lut(self._CENTROIDS, self._LENS_Y_MAX, self._LENS_X_MAX)
+
         # initialize micro image size and respective centers
         self._size_pitch = 0
         self._cent_pitch = 0
@@ -80,7 +94,8 @@ class LfpMicroLenses(object):
             self.sta.error = True
 
     def proc_lens_iter(self, fun, **kwargs):
-        """ process light-field based on provided function handle and argument data """
+        """ process light-field based on provided function handle and argument data (in chunks of lens rows on
+        several threads if more than one worker is given) """
 
         # status message handling
         msg = kwargs['msg'] if 'msg' in kwargs else 'Light-field alignment process'
@@ -88,7 +103,11 @@ class LfpMicroLenses(object):
         if usr_prnt:
             self.sta.status_msg(msg, self.cfg.params[self.cfg.opt_prnt])
 
-        args = [kwargs[key] for key in kwargs.keys() if key not in ('cfg', 'sta', 'msg', 'prnt')]
+        workers = kwargs['workers'] if 'workers' in kwargs else self._workers
+        args = [kwargs[key] for key in kwargs.keys() if key not in ('cfg', 'sta', 'msg', 'prnt', 'workers')]
+
+        if workers > 1 and self._LENS_Y_MAX > 1:
+            return self._proc_lens_threads(fun, args, workers)
 
         try:
             # iterate through each micro lens centroid
@@ -110,13 +129,60 @@ class LfpMicroLenses(object):
 
         return True
 
+    def _proc_lens_threads(self, fun, args, workers):
+        """ process chunks of lens rows on a thread pool writing into the arrays of this instance """
+
+        rows = range(self._LENS_Y_MAX)
+        step = max(1, -(-len(rows) // (workers * LENS_CHUNKS)))
+
+        def proc_rows(chunk):
+            for ly in chunk:
+                # check interrupt status
+                if self.sta.interrupt:
+                    break
+                for lx in range(self._LENS_X_MAX):
+                    fun(ly, lx, *args)
+            return len(chunk)
+
+        # aggregate progress of completed chunks and cancel pending ones on interrupt
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(proc_rows, rows[i:i+step]) for i in range(0, len(rows), step)]
+            for future in as_completed(futures):
+                done += future.result()
+                self.sta.progress(done / self._LENS_Y_MAX * 100, self.cfg.params[self.cfg.opt_prnt])
+                if self.sta.interrupt:
+                    for f in futures:
+                        f.cancel()
+                    return False
+
+        return True
+
+    @staticmethod
+    def build_mic_lut(centroids: np.ndarray, lens_y_max: int, lens_x_max: int) -> np.ndarray:
+        """ dense (LENS_Y_MAX, LENS_X_MAX, 2) array of micro image centers with NaN for missing lenses """
+
+        mic_lut = np.full((lens_y_max, lens_x_max, 2), np.nan)
+        mic_lut[centroids[:, 2].astype('int'), centroids[:, 3].astype('int')] = centroids[:, :2]
+
+        return mic_lut
+
     def get_coords_by_idx(self, ly: int, lx: int) -> (float, float):
-        """ yields micro image center in 2-D image coordinates """
+        """ yields micro image center in 2-D image coordinates (also accepts index arrays) """
+
+        # look-up MIC by indices
+        return self._mic_lut[ly, lx, 0], self._mic_lut[ly, lx, 1]
 
-        # filter mic by provided indices
-        mic = self._CENTROIDS[(self._CENTROIDS[:, 2] == ly) & (self._CENTROIDS[:, 3] == lx), [0, 1]]
+    def get_coords_by_row(self, ly: int) -> np.ndarray:
+        """ yields (LENS_X_MAX, 2) micro image centers of a lens row """
 
-        return mic[0], mic[1]
+        return self._mic_lut[ly]
+
+    @property
+    def mic_lut(self) -> np.ndarray:
+        """ micro image centers of all lenses as (LENS_Y_MAX, LENS_X_MAX, 2) array """
+
+        return self._mic_lut
 
     def safe_pitch_eval(self, cavg_pitch: float, limg_pitch: float, user_pitch: int) -> int:
         """ evaluate pitch size that is safe to use """
@@ -140,9 +206,8 @@ class LfpMicroLenses(object):
 
         # if chosen safe micro image size is larger than in the aligned image
         if 0 < limg_pitch < safe_pitch:
-            # remove existing pickle file
-            fp = os.path.join(self.cfg.exp_path, 'lfp_img_align.pkl')
-            os.remove(fp)
+            # remove existing aligned light-field store
+            LfpAlignStore(cfg=self.cfg, sta=self.sta).remove()
             # status update
             self.sta.status_msg('Angular resolution mismatch in previous alignment. Redo process')
             self.sta.interrupt = True
@@ -190,34 +255,23 @@ class LfpMicroLenses(object):
         return int(pitch_estimate_y)
 
     def lfp_align_pitch(self) -> np.ndarray:
-        """ estimate pitch size from aligned light-field """
+        """ pitch size of aligned light-field from its store sidecar """
 
         # initialize output variable (return zero if aligned light field not present)
         self._limg_pitch = np.zeros(2, dtype='int')
         if self._lfp_img_align is None:
             return self._limg_pitch
 
-        # obtain micro image size from both dimensions (horizontal accounts for hexagonal stretching)
-        if hasattr(self, '_LENS_Y_MAX') and hasattr(self, '_LENS_X_MAX'):
+        if self._align_meta is not None:
+            self._limg_pitch[:] = self._align_meta['pitch']
+        elif hasattr(self, '_LENS_Y_MAX') and hasattr(self, '_LENS_X_MAX'):
+            # aligned light field without sidecar (horizontal accounts for hexagonal stretching)
             h = np.sqrt(3)/2 if self._PAT_TYPE == 'hex' else 1
             self._limg_pitch[0] = int(round(self._lfp_img_align.shape[0] / self._LENS_Y_MAX))
             self._limg_pitch[1] = int(round(self._lfp_img_align.shape[1] / self._LENS_X_MAX * h))
-        else:
-            for axis in [0, 1]:
-                # take pitch where remainder of ratio between aligned image dimensions and candidate size is zero
-                self._limg_pitch[axis] = self.remainder_ratio(num=self._lfp_img_align.shape[axis])
 
         return self._limg_pitch.astype('int')
 
-    @staticmethod
-    def remainder_ratio(num: int) -> int:
-        # iterate through potential (odd or even) micro image size candidates
-        for d in np.arange(3, 151, 1):
-            if (num / d) % 1 == 0:
-                return int(d)
-
-        return 0
-
     @staticmethod
     def get_hex_direction(centroids: np.ndarray) -> bool:
         """ check if lower neighbor of upper left micro image center is shifted to left or right in hex grid
@@ -3,10 +3,11 @@ from plenopticam import misc
 from plenopticam.cfg import constants as c
 from plenopticam.lfp_aligner.lfp_global_resampler import LfpGlobalResampler
 from plenopticam.lfp_aligner.lfp_local_resampler import LfpLocalResampler
+from plenopticam.lfp_aligner.lfp_align_store import LfpAlignStore
+from plenopticam.lfp_aligner.lfp_align_lut import LfpAlignLut
 
 # external libs
 import os
-import pickle
 
 
 class LfpResampler(LfpLocalResampler, LfpGlobalResampler):
@@ -14,6 +15,12 @@ class LfpResampler(LfpLocalResampler, LfpGlobalResampler):
     def __init__(self, *args, **kwargs):
         super(LfpResampler, self).__init__(*args, **kwargs)
 
+        # remap by look-up table cached per calibration
+        self._lut_opt = kwargs['lut_opt'] if 'lut_opt' in kwargs else False
+
+        # offsets of region of interest (recorded in metadata of aligned light-field)
+        self._roi = kwargs['roi'] if 'roi' in kwargs else None
+
     def main(self):
 
         # check interrupt status
@@ -23,8 +30,12 @@ class LfpResampler(LfpLocalResampler, LfpGlobalResampler):
         # print status
         self.sta.status_msg('Light-field alignment', self.cfg.params[self.cfg.opt_prnt])
 
+        # remap by look-up table of calibration
+        if self._lut_opt and self.cfg.params[self.cfg.smp_meth] in c.SMPL_METH:
+            self.lut_resampling()
+
         # global resampling
-        if self.cfg.params[self.cfg.smp_meth] == 'global' or not self.cfg.params[self.cfg.smp_meth]:
+        elif self.cfg.params[self.cfg.smp_meth] == 'global' or not self.cfg.params[self.cfg.smp_meth]:
             try:
                 self.global_resampling()
             except ImportError:
@@ -32,7 +43,7 @@ class LfpResampler(LfpLocalResampler, LfpGlobalResampler):
                 self.sta.status_msg('Use local resampling due to ImportError', self.cfg.params[self.cfg.opt_prnt])
 
         # local resampling
-        if self.cfg.params[self.cfg.smp_meth] == 'local':
+        if self.cfg.params[self.cfg.smp_meth] == 'local' and not self._lut_opt:
             self.local_resampling()
 
         # unrecognized resampling method
@@ -46,6 +57,43 @@ class LfpResampler(LfpLocalResampler, LfpGlobalResampler):
 
         return True
 
+    def lut_resampling(self):
+        """ alignment as single gather of weighted raw pixels by remap table reused for captures of a calibration """
+
+        # check interrupt status
+        if self.sta.interrupt:
+            return False
+
+        meth = self.cfg.params[self.cfg.smp_meth]
+        if meth == 'global' and self._PAT_TYPE == 'hex':
+            # hexagonal global alignment blends warped neighbor rows by splines which are not tabulated
+            return self.global_resampling()
+
+        key = LfpAlignLut.lut_key(meth, self._CENTROIDS, self._PAT_TYPE, self._hex_odd, self._size_pitch,
+                                  self._interpol_method, self._flip, self._rot_mat, self._lfp_img.shape[:2])
+
+        # table is kept next to calibration file to be found by subsequent captures
+        cal_meta = self.cfg.params[self.cfg.cal_meta]
+        lut_path = os.path.dirname(cal_meta) if cal_meta and os.path.isfile(cal_meta) else self.cfg.exp_path
+        fp = os.path.join(lut_path, 'lfp_align_lut_%s.npz' % key[:16])
+
+        lut = LfpAlignLut.load(fp, key)
+        if lut is None:
+            self.sta.status_msg('Compute alignment look-up table', self.cfg.params[self.cfg.opt_prnt])
+            lut = self.global_lut() if meth == 'global' else self.local_lut()
+            lut.key = key
+            LfpAlignLut.remember(lut)
+            try:
+                misc.mkdir_p(lut_path, False)
+                lut.save(fp)
+            except OSError:
+                self.sta.status_msg('Alignment look-up table could not be saved', self.cfg.params[self.cfg.opt_prnt])
+
+        self._lfp_img_align = lut.apply(self._lfp_img)
+        self._limg_pitch = lut.pitch.copy()
+
+        return True
+
     def _write_lfp_align(self):
 
         # check interrupt status
@@ -59,17 +107,14 @@ class LfpResampler(LfpLocalResampler, LfpGlobalResampler):
         # convert to 16bit unsigned integer
         self._lfp_img_align = misc.Normalizer(self._lfp_img_align).uint16_norm()
 
-        # create output data folder
-        misc.mkdir_p(self.cfg.exp_path, self.cfg.params[self.cfg.opt_prnt])
-
         try:
-            # write aligned light field as pickle file to avoid re-calculation
-            with open(os.path.join(self.cfg.exp_path, 'lfp_img_align.pkl'), 'wb') as f:
-                pickle.dump(self._lfp_img_align, f)
-        except pickle.UnpicklingError:
+            # write aligned light field as memory-mappable store to avoid re-calculation
+            LfpAlignStore(cfg=self.cfg, sta=self.sta).write(self._lfp_img_align, self._limg_pitch, self._hex_odd,
+                                                           roi=self._roi)
+        except OSError:
             # print status and interrupt process
-            fname = os.path.join(self.cfg.exp_path, 'lfp_img_align.pkl')
-            self.sta.status_msg('Pickle file may be corrupted %s' % fname, self.cfg.params[self.cfg.opt_prnt])
+            self.sta.status_msg('Aligned light-field could not be saved in %s' % self.cfg.exp_path,
+                                self.cfg.params[self.cfg.opt_prnt])
             self.sta.error = True
 
         if self.cfg.params[self.cfg.opt_dbug]:
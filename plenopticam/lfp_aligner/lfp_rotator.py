@@ -30,7 +30,7 @@ from plenopticam.cfg import PlenopticamConfig
 
 class LfpRotator(object):
 
-    def __init__(self, lfp_img, mic_list, rad=None, cfg=None, sta=None):
+    def __init__(self, lfp_img, mic_list, rad=None, cfg=None, sta=None, rot_img=True):
 
         # input and output variable
         self._lfp_img = lfp_img
@@ -40,6 +40,7 @@ class LfpRotator(object):
         # internal variables
         self._centroids = np.asarray(mic_list)
         self._rad = rad
+        self._rot_img = rot_img
 
     def main(self):
 
@@ -50,14 +51,15 @@ class LfpRotator(object):
         # determine rotation angle (radians) of micro image centers (skip if angle already set)
         self._estimate_rad() if self._rad is None else None
 
-        # rotate image
-        self._rotate_img()
+        # rotate image (skipped if de-rotation is fused into resampling via rotation matrix)
+        if self._rot_img:
+            self._rotate_img()
 
         # rotate centroids
         self._rotate_centroids()
 
         # write plot img to hard drive (debug only)
-        if self.cfg.params[self.cfg.opt_dbug] and not self.sta.interrupt:
+        if self.cfg.params[self.cfg.opt_dbug] and self._rot_img and not self.sta.interrupt:
             self.sta.status_msg('Save rotated image (debug mode)')
             self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
             CentroidDrawer(self._lfp_img, self._centroids, self.cfg).write_centroids_img(fn='lfp_rotated.png')
@@ -179,6 +181,19 @@ class LfpRotator(object):
     def centroids(self):
         return self._centroids.tolist()
 
+    @property
+    def rot_mat(self):
+        """ homogeneous matrix mapping (y, x) coordinates of the raw image to those of the rotated image """
+
+        img_center = (np.asarray(self._lfp_img.shape[:2])-1)/2.
+        Rz = np.array([[np.cos(self._rad), -np.sin(self._rad)], [np.sin(self._rad), np.cos(self._rad)]])
+
+        rot_mat = np.eye(3)
+        rot_mat[:2, :2] = Rz
+        rot_mat[:2, 2] = img_center - np.dot(Rz, img_center)
+
+        return rot_mat
+
     def _rota_plot(self, slope):
         """ plots for debug purposes only """
 
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+__author__ = "Christopher Hahne"
+__email__ = "info@christopherhahne.de"
+__license__ = """
+    Copyright (c) 2019 Christopher Hahne <info@christopherhahne.de>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+from plenopticam.cfg import PlenopticamConfig
+from plenopticam.misc import PlenopticamStatus, fast_percentile
+from plenopticam.lfp_aligner.cfa_outliers import CfaOutliers
+from plenopticam.lfp_aligner.cfa_processor import CfaProcessor
+
+import numpy as np
+import hashlib
+
+# number of (even) sensor rows conditioned in one pass
+BAND_ROWS = 256
+
+
+class RawConditioner(object):
+    """ fused raw conditioning (defect correction, de-vignetting, highlight correction, white balance and soft
+    clipping) streaming the Bayer mosaic in row bands """
+
+    # constants of the most recent white image (reused for subsequent captures)
+    _cache = {}
+
+    def __init__(self, *args, **kwargs):
+
+        self.cfg = kwargs['cfg'] if 'cfg' in kwargs else PlenopticamConfig()
+        self.sta = kwargs['sta'] if 'sta' in kwargs else PlenopticamStatus()
+
+        self._bay_img = kwargs['bay_img'].astype('float32', copy=False) if 'bay_img' in kwargs else np.array([])
+        self._wht_img = kwargs['wht_img'] if 'wht_img' in kwargs else None
+        self._dft_map = kwargs['defect_map'] if 'defect_map' in kwargs else None
+        self._vign_opt = kwargs['vign_opt'] if 'vign_opt' in kwargs else self.cfg.params[self.cfg.opt_vign]
+        self._rcp_img = kwargs['rcp_img'] if 'rcp_img' in kwargs else None
+        self._wht_key = kwargs['wht_key'] if 'wht_key' in kwargs else None
+        self._band_rows = kwargs['band_rows'] + kwargs['band_rows'] % 2 if 'band_rows' in kwargs else BAND_ROWS
+
+        gains = self.cfg.lfpimg['awb'] if 'awb' in self.cfg.lfpimg else [1, 1, 1, 1]
+        self._gains = CfaProcessor.bayer_gains(gains, self.cfg.lfpimg['bay'] if 'bay' in self.cfg.lfpimg else None)
+        self._exp = self.cfg.lfpimg['exp'] if 'exp' in self.cfg.lfpimg else None
+
+    def main(self):
+
+        # check interrupt status
+        if self.sta.interrupt:
+            return False
+
+        # print status
+        self.sta.status_msg('Raw image conditioning', self.cfg.params[self.cfg.opt_prnt])
+        self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
+
+        rcp_img, wht_avg = self.precompute(self._wht_img, self._vign_opt, self._rcp_img, self._wht_key)
+        max_lum = 2**(-self._exp) if self._exp is not None else None
+
+        # defect coordinates sorted by rows (to be sliced per band)
+        dft_ys, dft_xs = np.nonzero(self._dft_map) if self._dft_map is not None else (np.array([], 'int'),)*2
+
+        h = self._bay_img.shape[0]
+        tail = self._bay_img[:0].copy()
+        for y0 in range(0, h, self._band_rows):
+            y1 = min(y0 + self._band_rows, h)
+            band = self._bay_img[y0:y1]
+
+            # defect correction from raw neighbors (2 raw rows above are kept from the previous band)
+            k0, k1 = np.searchsorted(dft_ys, [y0, y1])
+            next_tail = self._bay_img[max(y1-2, 0):y1].copy()
+            if k1 > k0:
+                raw_img = np.concatenate([tail, self._bay_img[y0:min(y1+2, h)]])
+                off = y0 - len(tail)
+                ys, xs = dft_ys[k0:k1] - off, dft_xs[k0:k1]
+                raw_map = np.zeros(raw_img.shape, dtype='bool')
+                raw_map[ys, xs] = True
+                band[ys - len(tail), xs] = CfaOutliers.correct_defects(raw_img, raw_map)[ys, xs]
+            tail = next_tail
+
+            # de-vignetting by reciprocal white image
+            if rcp_img is not None and self._vign_opt:
+                band *= rcp_img[y0:y1]
+
+            # highlight correction and white balance
+            if self._gains is not None:
+                CfaProcessor.correct_highlights(band, self._gains,
+                                                rcp_img[y0:y1] if rcp_img is not None else None,
+                                                wht_avg[y0//2:(y1+1)//2] if wht_avg is not None else None)
+                for plane, gain in zip(CfaProcessor.bayer_planes(band), self._gains):
+                    plane *= gain
+            np.maximum(band, 0, out=band)
+
+            # soft clipping with respect to exposure bias
+            if max_lum is not None:
+                band /= max_lum
+                CfaProcessor.soft_clipping(band, 7, out=band)
+                band *= max_lum
+
+            # check interrupt status
+            if self.sta.interrupt:
+                return False
+
+            # progress update
+            self.sta.progress(y1/h*100, self.cfg.params[self.cfg.opt_prnt])
+
+        return True
+
+    @classmethod
+    def precompute(cls, wht_img, vign_opt=True, rcp_img=None, wht_key=None):
+        """ reciprocal of (normalized) white image and mean of its Bayer quads as constants for a white image given
+        its digest (which has to cover the flat-field if provided) or otherwise fingerprinted from its data """
+
+        if wht_img is None:
+            return None, None
+
+        if wht_key is None:
+            sha = hashlib.sha1(np.ascontiguousarray(wht_img))
+            if rcp_img is not None:
+                sha.update(np.ascontiguousarray(rcp_img))
+            wht_key = sha.hexdigest()
+        key = (wht_img.shape, bool(vign_opt), rcp_img is not None, wht_key)
+
+        if key not in cls._cache:
+            if rcp_img is None:
+                wht_img = wht_img / fast_percentile(wht_img, q=99.9) if vign_opt else wht_img
+                rcp_img = np.divide(1, wht_img, out=np.zeros(wht_img.shape), where=wht_img != 0).astype('float32')
+            else:
+                # white image as seen by the given (de-vignetting) flat-field
+                wht_img = np.divide(1, rcp_img, out=np.zeros_like(rcp_img), where=rcp_img != 0)
+            wht_avg = (sum(CfaProcessor.bayer_planes(wht_img)) / 4).astype('float32')
+            cls._cache.clear()
+            cls._cache[key] = rcp_img, wht_avg
+
+        return cls._cache[key]
+
+    @property
+    def bay_img(self):
+        return self._bay_img
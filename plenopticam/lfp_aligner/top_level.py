@@ -26,58 +26,188 @@ from plenopticam.lfp_aligner.lfp_resampler import LfpResampler
 from plenopticam.lfp_aligner.lfp_rotator import LfpRotator
 from plenopticam.lfp_aligner.cfa_outliers import CfaOutliers
 from plenopticam.lfp_aligner.cfa_processor import CfaProcessor
+from plenopticam.lfp_aligner.raw_conditioner import RawConditioner
 from plenopticam.lfp_aligner.lfp_devignetter import LfpDevignetter
+from plenopticam.lfp_aligner.lfp_align_store import LfpAlignStore
+
+import numpy as np
 
 
 class LfpAligner(object):
 
-    def __init__(self, lfp_img, cfg=None, sta=None, wht_img=None):
+    def __init__(self, lfp_img, cfg=None, sta=None, wht_img=None, lens_opt=False, lut_opt=False, roi=None,
+                 lens_roi=None):
 
         # input variables
         self.cfg = cfg
         self.sta = sta if sta is not None else misc.PlenopticamStatus()
-        self._lfp_img = lfp_img.astype('float') if lfp_img is not None else None
+        self._lfp_img = lfp_img.astype('float32') if lfp_img is not None else None
         self._wht_img = wht_img.astype('float') if wht_img is not None else None
+        self._lens_opt = lens_opt or bool(self.cfg.params[self.cfg.opt_lens])
+        self._lut_opt = lut_opt or bool(self.cfg.params[self.cfg.opt_lut_])
+
+        # region of interest as sensor rectangle or lens index range (y0, x0, y1, x1 with exclusive end)
+        self._roi = roi
+        self._lens_roi = lens_roi
+        self._roi_offset = None
+        self._awb_opt = True
+
+        # MICs used for alignment (re-indexed within region of interest without altering the calibration)
+        self._mic_list = self.cfg.calibs.get(self.cfg.mic_list) if self.cfg.calibs else None
 
     def main(self):
 
-        if self.cfg.lfpimg:
-            # hot pixel correction
-            obj = CfaOutliers(bay_img=self._lfp_img, cfg=self.cfg, sta=self.sta)
-            obj.rectify_candidates_bayer(n=9, sig_lev=2.5)
-            self._lfp_img = obj.bay_img
-            del obj
+        # restrict all processing to lenses of region of interest
+        if (self._roi is not None or self._lens_roi is not None) and not self.crop_roi():
+            return False
 
-        if self.cfg.params[self.cfg.opt_vign] and self._wht_img is not None:
-            # apply de-vignetting
-            obj = LfpDevignetter(lfp_img=self._lfp_img, wht_img=self._wht_img, cfg=self.cfg, sta=self.sta)
-            obj.main()
-            self._lfp_img = obj.lfp_img
-            self._wht_img = obj.wht_img
-            del obj
+        if self.cfg.lfpimg and 'bay' in self.cfg.lfpimg and len(self._lfp_img.shape) == 2 and \
+                (self._wht_img is None or self._wht_img.shape == self._lfp_img.shape):
+            # fused raw conditioning of Bayer image in a single pass
+            self.raw_conditioning()
+        else:
+            self.raw_sequential()
 
         if self.cfg.lfpimg and len(self._lfp_img.shape) == 2:
             # perform color filter array management and obtain rgb image
-            cfa_obj = CfaProcessor(bay_img=self._lfp_img, wht_img=self._wht_img, cfg=self.cfg, sta=self.sta)
-            cfa_obj.main()
+            cfa_obj = CfaProcessor(bay_img=self._lfp_img, wht_img=self._wht_img, cfg=self.cfg, sta=self.sta,
+                                   method=self.cfg.params[self.cfg.dms_meth], lens_opt=self._lens_opt,
+                                   mic_list=self._mic_list)
+            cfa_obj.main(awb_opt=self._awb_opt)
             self._lfp_img = cfa_obj.rgb_img
             del cfa_obj
 
+        rot_mat = None
         if self.cfg.params[self.cfg.opt_rota] and self._lfp_img is not None:
-            # de-rotate centroids
-            obj = LfpRotator(self._lfp_img, self.cfg.calibs[self.cfg.mic_list], rad=None, cfg=self.cfg, sta=self.sta)
+            # de-rotate centroids (image de-rotation is fused into resampling)
+            obj = LfpRotator(self._lfp_img, self._mic_list, rad=None, cfg=self.cfg, sta=self.sta, rot_img=False)
             obj.main()
-            self._lfp_img, self.cfg.calibs[self.cfg.mic_list] = obj.lfp_img, obj.centroids
+            self._mic_list, rot_mat = obj.centroids, obj.rot_mat
             del obj
 
+            # de-rotated centroids of full sensor replace calibration
+            if self._roi_offset is None:
+                self.cfg.calibs[self.cfg.mic_list] = self._mic_list
+
         # interpolate each micro image with its MIC as the center with consistent micro image size
-        obj = LfpResampler(lfp_img=self._lfp_img, cfg=self.cfg, sta=self.sta)
+        obj = LfpResampler(lfp_img=self._lfp_img, cfg=self.cfg, sta=self.sta, rot_mat=rot_mat, lut_opt=self._lut_opt,
+                           roi=self._roi_offset, mic_list=self._mic_list)
         obj.main()
         self._lfp_img = obj.lfp_img_align
         del obj
 
         return True
 
+    def crop_roi(self):
+        """ crop sensor to lenses intersecting the region of interest (and their support) with re-indexed MICs """
+
+        mics = np.asarray(self._mic_list)
+        if self.cfg.calibs.get(self.cfg.ptc_mean):
+            pitch = max(self.cfg.calibs[self.cfg.ptc_mean])
+        else:
+            # horizontal distance of neighboring MICs within lens rows
+            srt = mics[np.lexsort((mics[:, 3], mics[:, 2]))]
+            pitch = np.median(np.diff(srt[:, 1])[np.diff(srt[:, 2]) == 0])
+
+        if self._lens_roi is not None:
+            ly0, lx0, ly1, lx1 = self._lens_roi
+        else:
+            # lens index range of micro images intersecting the sensor rectangle
+            y0, x0, y1, x1 = self._roi
+            hits = (mics[:, 0] > y0-pitch/2) & (mics[:, 0] < y1+pitch/2) & \
+                   (mics[:, 1] > x0-pitch/2) & (mics[:, 1] < x1+pitch/2)
+            if not np.any(hits):
+                self.sta.status_msg('Region of interest does not contain any micro image', True)
+                self.sta.error = True
+                return False
+            ly0, lx0 = mics[hits, 2:].min(0).astype('int')
+            ly1, lx1 = mics[hits, 2:].max(0).astype('int') + 1
+
+        sel = (mics[:, 2] >= ly0) & (mics[:, 2] < ly1) & (mics[:, 3] >= lx0) & (mics[:, 3] < lx1)
+        if not np.any(sel):
+            self.sta.status_msg('Region of interest does not contain any micro image', True)
+            self.sta.error = True
+            return False
+        mics = mics[sel]
+
+        # sensor window with a margin of one pitch for micro image support (even offsets preserve Bayer pattern)
+        y0, x0 = (np.maximum(np.floor(mics[:, :2].min(0) - pitch), 0).astype('int') // 2) * 2
+        y1, x1 = np.minimum(np.ceil(mics[:, :2].max(0) + pitch).astype('int') + 1, self._lfp_img.shape[:2])
+        y1, x1 = y0 + (y1 - y0) // 2 * 2, x0 + (x1 - x0) // 2 * 2
+        if self._wht_img is not None and self._wht_img.shape == self._lfp_img.shape:
+            self._wht_img = np.ascontiguousarray(self._wht_img[y0:y1, x0:x1])
+        self._lfp_img = np.ascontiguousarray(self._lfp_img[y0:y1, x0:x1])
+
+        # MICs relative to window and lens indices relative to range
+        mics[:, :2] -= [y0, x0]
+        mics[:, 2:] -= [ly0, lx0]
+        self._mic_list = mics.tolist()
+        self._roi_offset = {'offset': [int(y0), int(x0)], 'lens_offset': [int(ly0), int(lx0)]}
+
+        return True
+
+    def raw_conditioning(self):
+        """ hot-pixel correction, de-vignetting, white balance and soft clipping in one pass over row bands """
+
+        # hot pixel detection (replacement of known defects is deferred to the conditioning pass)
+        obj = CfaOutliers(bay_img=self._lfp_img, cfg=self.cfg, sta=self.sta, offset=self.sensor_offset)
+        obj.main(n=9, sig_lev=2.5, apply_map=False)
+        self._lfp_img, dft_map = obj.bay_img, obj.defect_map
+        del obj
+
+        # white image digest computed once and shared by the flat-field and raw conditioning caches
+        wht_key = LfpAlignStore.wht_digest(self.cfg, self._wht_img, self._mic_list, self.sensor_offset)
+
+        # reciprocal flat-field (cached per white image and calibration)
+        vign_opt = self.cfg.params[self.cfg.opt_vign] and self._wht_img is not None
+        rcp_img = None
+        if vign_opt:
+            obj = LfpDevignetter(wht_img=self._wht_img, cfg=self.cfg, sta=self.sta, mic_list=self._mic_list,
+                                 wht_key=wht_key)
+            rcp_img, wht_key = obj.flat_field(), obj.cache_key()
+            del obj
+
+        obj = RawConditioner(bay_img=self._lfp_img, wht_img=self._wht_img, defect_map=dft_map, vign_opt=vign_opt,
+                             rcp_img=rcp_img, wht_key=wht_key, cfg=self.cfg, sta=self.sta)
+        obj.main()
+        self._lfp_img = obj.bay_img
+        del obj
+
+        # white balance has been applied
+        self._awb_opt = False
+
+        return True
+
+    def raw_sequential(self):
+        """ hot-pixel correction and de-vignetting in separate passes """
+
+        if self.cfg.lfpimg:
+            # hot pixel correction
+            obj = CfaOutliers(bay_img=self._lfp_img, cfg=self.cfg, sta=self.sta, offset=self.sensor_offset)
+            obj.main(n=9, sig_lev=2.5)
+            self._lfp_img = obj.bay_img
+            del obj
+
+        if self.cfg.params[self.cfg.opt_vign] and self._wht_img is not None:
+            # apply de-vignetting
+            wht_key = LfpAlignStore.wht_digest(self.cfg, self._wht_img, self._mic_list, self.sensor_offset)
+            obj = LfpDevignetter(lfp_img=self._lfp_img, wht_img=self._wht_img, cfg=self.cfg, sta=self.sta,
+                                 mic_list=self._mic_list, wht_key=wht_key)
+            obj.main()
+            self._lfp_img = obj.lfp_img
+            self._wht_img = obj.wht_img
+            del obj
+
+        return True
+
     @property
     def lfp_img(self):
         return self._lfp_img.copy()
+
+    @property
+    def roi_offset(self):
+        return self._roi_offset
+
+    @property
+    def sensor_offset(self):
+        return self._roi_offset['offset'] if self._roi_offset is not None else None
@@ -61,6 +61,7 @@ class CentroidRefiner(object):
 
         # output variables
         self._centroids_refined = []
+        self._valid_idx = np.ones(len(self._centroids), dtype='bool')
 
     def main(self):
 
@@ -90,8 +91,14 @@ class CentroidRefiner(object):
             if self.sta.interrupt:
                 return False
 
+            # skip refinement of centroids whose window exceeds the image (removed as marginal centroids below)
+            y, x = int(m[0]), int(m[1])
+            if y-self._r < 0 or x-self._r < 0 or y+self._r+1 > img_scale.shape[0] or x+self._r+1 > img_scale.shape[1]:
+                self._centroids_refined.append((m[0], m[1]))
+                continue
+
             # compute refined coordinates based on given method
-            fun(img_scale[int(m[0])-self._r:int(m[0])+self._r+1, int(m[1])-self._r:int(m[1])+self._r+1], m)
+            fun(img_scale[y-self._r:y+self._r+1, x-self._r:x+self._r+1], m)
             self._centroids_refined.append(self._get_coords())
 
             # print status
@@ -161,16 +168,12 @@ class CentroidRefiner(object):
 
         h, w = self._img.shape[:2]
 
-        if isinstance(np.version.version, str):
-            # use numpy vectorization
-            self._centroids_refined = np.array(self._centroids_refined)
-            valid_idx = (self._r < self._centroids_refined[:, 0]) & (self._centroids_refined[:, 0] < h - self._r) & \
-                        (self._r < self._centroids_refined[:, 1]) & (self._centroids_refined[:, 1] < w - self._r)
-            self._centroids_refined = list(self._centroids_refined[valid_idx])
-        else:
-            # inline for loop
-            self._centroids_refined = [c for c in self._centroids_refined
-                                       if self._r < c[0] < h-self._r and self._r < c[1] < w-self._r]
+        # keep track of retained centroids to allow for index correspondence with the input list
+        refined = np.array(self._centroids_refined).reshape(-1, 2)
+        self._valid_idx = (self._r < refined[:, 0]) & (refined[:, 0] < h - self._r) & \
+                          (self._r < refined[:, 1]) & (refined[:, 1] < w - self._r)
+
+        self._centroids_refined = list(refined[self._valid_idx])
 
         return True
 
@@ -180,3 +183,8 @@ class CentroidRefiner(object):
     @property
     def centroids_refined(self):
         return np.asarray(self._centroids_refined)
+
+    @property
+    def valid_idx(self):
+        """ boolean mask telling which of the provided centroids are part of the refined output """
+        return self._valid_idx
@@ -29,6 +29,7 @@ class GridFitter(object):
         self._flip_yx = kwargs['flip_xy'] if 'flip_xy' in kwargs else False
         self._normalize = kwargs['normalize'] if 'normalize' in kwargs else False
         self.z_dist = kwargs['z_dist'] if 'z_dist' in kwargs else 1.0
+        self._p_init = np.asarray(kwargs['p_init']).flatten()[:8] if 'p_init' in kwargs else None
 
         # regression settings
         self.penalty_enable = kwargs['penalty_enable'] if 'penalty_enable' in kwargs else False
@@ -79,7 +80,7 @@ class GridFitter(object):
         sy_s, sx_s = self._ptc_mean if hasattr(self, '_ptc_mean') else [1, 1]
         p_init = np.diag([sy_s, sx_s, 1])
         p_init[:2, -1] = np.array([cy_s, cx_s])
-        p_init = p_init.flatten()[:8]
+        p_init = p_init.flatten()[:8] if self._p_init is None else self._p_init.copy()
         beta = 1 if self.penalty_enable else 0
 
         # LMA fit: executes least-squares regression for optimization of initial parameters
@@ -188,6 +189,23 @@ class GridFitter(object):
 
         return grid
 
+    @staticmethod
+    def estimate_pmat(grid: np.ndarray, coords: np.ndarray):
+        """ direct linear estimate of the projective matrix mapping grid points onto (ordered) coordinates """
+
+        y, x = grid[:, 0], grid[:, 1]
+        v, u = coords[:, 0], coords[:, 1]
+        zero, ones = np.zeros(len(grid)), np.ones(len(grid))
+
+        # compose linear equation system with last matrix element fixed to one
+        A = np.vstack([np.array([y, x, ones, zero, zero, zero, -y*v, -x*v]).T,
+                       np.array([zero, zero, zero, y, x, ones, -y*u, -x*u]).T])
+        b = np.concatenate([v, u])
+
+        p = np.linalg.lstsq(A, b, rcond=None)[0]
+
+        return np.array([*p, 1]).reshape(3, 3)
+
     @staticmethod
     def _regularizer(c_meas, c_grid, div=22):
 
@@ -36,16 +36,21 @@ from plenopticam.misc.status import PlenopticamStatus
 from plenopticam.lfp_aligner.cfa_processor import CfaProcessor
 from plenopticam.cfg import constants as c
 
+import numpy as np
+
 
 class LfpCalibrator(object):
 
-    def __init__(self, wht_img, cfg=None, sta=None):
+    def __init__(self, wht_img, cfg=None, sta=None, calibs=None):
 
         # input variables
         self._wht_img = wht_img
         self.cfg = cfg if cfg is not None else PlenopticamConfig()
         self.sta = sta if sta is not None else PlenopticamStatus()
 
+        # previous calibration data (enables warm-start re-calibration)
+        self._calibs = calibs if calibs and self.cfg.mic_list in calibs else None
+
         # private
         self._M = None
 
@@ -54,18 +59,14 @@ class LfpCalibrator(object):
         if self._wht_img is None:
             self.sta.status_msg(msg='White image file not present', opt=self.cfg.params[self.cfg.opt_prnt])
             self.sta.error = True
+            return False
 
-        # convert Bayer to RGB representation
-        if len(self._wht_img.shape) == 2 and 'bay' in self.cfg.lfpimg:
-            # perform color filter array management and obtain rgb image
-            cfa_obj = CfaProcessor(bay_img=self._wht_img, cfg=self.cfg, sta=self.sta)
-            cfa_obj.bay2rgb()
-            self._wht_img = cfa_obj.rgb_img
-            del cfa_obj
+        # convert white image to monochromatic representation
+        self._prepare_wht_img()
 
-        # ensure white image is monochromatic
-        if len(self._wht_img.shape) == 3:
-            self._wht_img = rgb2gry(self._wht_img)[..., 0] if self._wht_img.shape[-1] == 3 else self._wht_img
+        # refine previous calibration instead of global micro image detection
+        if self._calibs is not None:
+            return self.warm_start()
 
         # estimate micro image diameter
         obj = PitchEstimator(self._wht_img, self.cfg, self.sta)
@@ -108,6 +109,76 @@ class LfpCalibrator(object):
             mic_list = obj.grid_fit
             del obj
 
+        # attach and save calibration results
+        self._save_cali_data(mic_list, pattern, pitch)
+
+        return True
+
+    def _prepare_wht_img(self):
+
+        # convert Bayer to RGB representation
+        if len(self._wht_img.shape) == 2 and 'bay' in self.cfg.lfpimg:
+            # perform color filter array management and obtain rgb image
+            cfa_obj = CfaProcessor(bay_img=self._wht_img, cfg=self.cfg, sta=self.sta)
+            cfa_obj.bay2rgb()
+            self._wht_img = cfa_obj.rgb_img
+            del cfa_obj
+
+        # ensure white image is monochromatic
+        if len(self._wht_img.shape) == 3:
+            self._wht_img = rgb2gry(self._wht_img)[..., 0] if self._wht_img.shape[-1] == 3 else self._wht_img
+
+        return True
+
+    def warm_start(self):
+        """ incremental re-calibration refining the micro image centers of a previous calibration """
+
+        # previous calibration data (sorted by lens indices to match grid order)
+        prev_mics = np.asarray(self._calibs[self.cfg.mic_list], dtype='float64')
+        prev_mics = prev_mics[np.lexsort((prev_mics[:, 3], prev_mics[:, 2]))]
+        pattern = self._calibs[self.cfg.pat_type] if self.cfg.pat_type in self._calibs else 'rec'
+        pitch = self._calibs[self.cfg.ptc_mean] if self.cfg.ptc_mean in self._calibs else None
+        pitch = pitch if pitch is not None else [np.mean(np.diff(prev_mics[prev_mics[:, 2] == 0][:, 1]))]*2
+        self._M = int(np.ceil(np.max(pitch))) if self._M is None else self._M
+
+        # attach previous calibration to config object as it serves as reference for subsequent stages
+        for kw, data in zip([self.cfg.mic_list, self.cfg.pat_type, self.cfg.ptc_mean], [prev_mics, pattern, pitch]):
+            self.cfg.calibs[kw] = data
+
+        # refine centroids locally around their previous (predicted) positions
+        obj = CentroidRefiner(self._wht_img, np.round(prev_mics[:, :2]), self.cfg, self.sta, self._M)
+        obj.main()
+        refined, valid_idx = obj.centroids_refined, obj.valid_idx
+        del obj
+
+        # check interrupt status
+        if self.sta.interrupt:
+            return False
+
+        # keep predicted positions of marginal micro images to preserve index assignment
+        mic_list = prev_mics.copy()
+        mic_list[valid_idx, :2] = refined.reshape(-1, 2)
+
+        # re-fit grid of MICs using previous projective parameters as the initial guess
+        if self.cfg.params[self.cfg.cal_meth] in c.CALI_METH[2:4]:
+            hex_odd = GridFitter.estimate_hex_odd(prev_mics) if pattern == 'hex' else 0
+            grid = GridFitter.grid_gen(dims=[int(max(prev_mics[:, 2])+1), int(max(prev_mics[:, 3])+1)],
+                                       pat_type=pattern, hex_odd=hex_odd)
+            p_init = GridFitter.estimate_pmat(grid, prev_mics)
+            obj = GridFitter(coords_list=mic_list, cfg=self.cfg, sta=self.sta, arr_shape=self._wht_img.shape,
+                             pat_type=pattern, p_init=p_init,
+                             penalty_enable=self.cfg.params[self.cfg.cal_meth] == c.CALI_METH[3])
+            obj.main()
+            mic_list = obj.grid_fit
+            del obj
+
+        # attach and save calibration results
+        self._save_cali_data(np.asarray(mic_list).tolist(), pattern, pitch)
+
+        return True
+
+    def _save_cali_data(self, mic_list, pattern, pitch):
+
         # attach calibration results to config object
         for kw, data in zip([self.cfg.mic_list, self.cfg.pat_type, self.cfg.ptc_mean], [mic_list, pattern, pitch]):
             self.cfg.calibs[kw] = data
@@ -128,3 +199,7 @@ class LfpCalibrator(object):
             del draw_obj
 
         return True
+
+    @property
+    def calibs(self):
+        return self.cfg.calibs
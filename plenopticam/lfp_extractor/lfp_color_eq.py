@@ -22,6 +22,11 @@ __license__ = """
 
 # external libs
 import numpy as np
+import os
+import pickle
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from plenopticam.lfp_extractor import LfpViewpoints
 from plenopticam.lfp_aligner.cfa_processor import CfaProcessor
@@ -34,6 +39,30 @@ except ImportError:
 
 from color_matcher import ColorMatcher
 
+# number of viewpoint chunks per worker
+VIEW_CHUNKS = 4
+
+# shared viewpoint array and reference view of an equalization worker process
+_WORKER = {}
+
+
+def _init_eq_worker(shm_name, shape, dtype, ref, method):
+    """ attach viewpoint array in shared memory and keep reference view in worker process """
+
+    _WORKER['shm'] = shared_memory.SharedMemory(name=shm_name)
+    _WORKER['arr'] = np.ndarray(shape, dtype=dtype, buffer=_WORKER['shm'].buf)
+    _WORKER['ref'], _WORKER['method'] = ref, method
+
+
+def _color_eq_views(idxs):
+    """ equalize viewpoints of given indices in place """
+
+    arr = _WORKER['arr']
+    for j, i in idxs:
+        arr[j, i] = LfpColorEqualizer.color_eq_img(arr[j, i], _WORKER['ref'], method=_WORKER['method'])
+
+    return len(idxs)
+
 
 class LfpColorEqualizer(LfpViewpoints):
 
@@ -43,6 +72,8 @@ class LfpColorEqualizer(LfpViewpoints):
         self._ref_img = kwargs['ref_img'] if 'ref_img' in kwargs else self.central_view
         self.prop_type = kwargs['prop_type'] if 'prop_type' in kwargs else 'central'
         self._method = 'hm-mkl-hm'
+        self._executor = kwargs['executor'] if 'executor' in kwargs else 'thread'
+        self._workers = kwargs['workers'] if 'workers' in kwargs else None
 
         # skip color propagation if option not set
         self.prop_type = self.prop_type if hasattr(self, 'cfg') and self.cfg.params[self.cfg.opt_colo] else None
@@ -60,7 +91,7 @@ class LfpColorEqualizer(LfpViewpoints):
 
         # equalize light field colors
         if self.prop_type == 'central':
-            self.proc_vp_arr(fun=self.color_eq_img, ref=self._ref_img, method=self._method, msg='Color equalization')
+            self.proc_central()
         elif self.prop_type == 'axial':
             self.proc_ax_propagate_2d(fun=self.color_eq_img, method=self._method, msg='Color equalization')
 
@@ -75,6 +106,85 @@ class LfpColorEqualizer(LfpViewpoints):
 
         return match
 
+    def proc_central(self):
+        """ equalize all viewpoints towards the central view in chunks on threads (or processes if opted in) """
+
+        self.sta.status_msg('Color equalization', self.cfg.params[self.cfg.opt_prnt])
+        self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
+
+        # viewpoint indices split into chunks (several per worker for progress granularity)
+        workers = os.cpu_count() if self._workers is None else self._workers
+        idxs = [(j, i) for j in range(self._vp_img_arr.shape[0]) for i in range(self._vp_img_arr.shape[1])]
+        step = max(1, -(-len(idxs) // (workers * VIEW_CHUNKS)))
+        chunks = [idxs[k:k+step] for k in range(0, len(idxs), step)]
+
+        executor = self._executor
+        if executor == 'process' and workers > 1 and len(chunks) > 1:
+            try:
+                return self._proc_central_process(chunks, workers)
+            except (BrokenProcessPool, OSError, RuntimeError, pickle.PicklingError):
+                # fall back to threads (e.g. in frozen applications without process spawning)
+                executor = 'thread'
+
+        def proc_views(views):
+            for j, i in views:
+                if self.sta.interrupt:
+                    break
+                self._vp_img_arr[j, i] = self.color_eq_img(self._vp_img_arr[j, i], self._ref_img, method=self._method)
+            return len(views)
+
+        if executor == 'thread' and workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return self._proc_central_futures([pool.submit(proc_views, views) for views in chunks], len(idxs))
+
+        done = 0
+        for views in chunks:
+            done += proc_views(views)
+            self.sta.progress(done / len(idxs) * 100, self.cfg.params[self.cfg.opt_prnt])
+
+            # check interrupt status
+            if self.sta.interrupt:
+                return False
+
+        return True
+
+    def _proc_central_process(self, chunks, workers):
+        """ equalize chunks of viewpoints on a process pool writing in place to a shared memory copy """
+
+        arr = self._vp_img_arr
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        try:
+            shr = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+            shr[...] = arr
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_eq_worker,
+                                     initargs=(shm.name, arr.shape, arr.dtype, self._ref_img, self._method)) as pool:
+                ret = self._proc_central_futures([pool.submit(_color_eq_views, views) for views in chunks],
+                                                 sum(len(views) for views in chunks))
+
+            # results are written to their viewpoint indices which preserves the order
+            np.copyto(arr, shr)
+            del shr
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return ret
+
+    def _proc_central_futures(self, futures, total):
+        """ aggregate progress of viewpoint chunks and cancel pending ones on interrupt """
+
+        done = 0
+        for future in as_completed(futures):
+            done += future.result()
+            self.sta.progress(done / total * 100, self.cfg.params[self.cfg.opt_prnt])
+            if self.sta.interrupt:
+                for f in futures:
+                    f.cancel()
+                return False
+
+        return True
+
     def apply_ccm(self):
 
         # color matrix correction
@@ -92,23 +202,16 @@ class LfpColorEqualizer(LfpViewpoints):
             else:
                 ccm_arr = np.diag(np.ones(3))
 
-            # normalize
-            self.vp_img_arr /= self.vp_img_arr.max()
-
             if 'exp' in self.cfg.lfpimg:
                 sat_lev = 2 ** (-self.cfg.lfpimg['exp'])
             else:
                 sat_lev = 1
-            self.vp_img_arr *= sat_lev
 
             # transpose and flip ccm_mat for RGB order
             ccm_mat = np.array(ccm_arr).reshape(3, 3).T
-            self._vp_img_arr = CfaProcessor().correct_color(self._vp_img_arr.copy(), ccm_mat=ccm_mat)
 
-            # remove potential NaNs
-            self._vp_img_arr[self._vp_img_arr < 0] = 0
-            self._vp_img_arr[self._vp_img_arr > sat_lev] = sat_lev
-            self._vp_img_arr /= self._vp_img_arr.max()
+            # normalization, exposure scale, color correction and clamping in place
+            self._vp_img_arr = CfaProcessor.correct_color_fused(self._vp_img_arr, ccm_mat=ccm_mat, sat_lev=sat_lev)
 
         return True
 
@@ -21,15 +21,32 @@ __license__ = """
 """
 
 import numpy as np
+import hashlib
 
 from plenopticam import misc
 from plenopticam.lfp_extractor import LfpViewpoints
 from color_space_converter import hsv_conv, yuv_conv, rgb2gry
+from color_space_converter.yuv_converter import YUV_MAT_BT709, YUV_MAT_BT709_INV
+
+# number of pixels converted in one (cache-sized) chunk
+CONV_CHUNK = 2**16
+
+# indices of (v, p, q, t) composing RGB for each hue sector
+HSV_SECTORS = np.array([[0, 3, 1], [2, 0, 1], [1, 0, 3], [1, 2, 0], [3, 1, 0], [0, 1, 2]])
+
+# number of reference images whose stretch parameters are kept
+STRETCH_CACHE = 8
 
 
 class LfpContrast(LfpViewpoints):
 
+    # contrast and brightness of recent reference channels (reused instead of rebuilding their histograms)
+    _cache = {}
+
     def __init__(self, p_lo=None, p_hi=None, *args, **kwargs):
+
+        # single precision for whole-array color space conversions
+        kwargs['dtype'] = kwargs['dtype'] if 'dtype' in kwargs else 'float32'
         super(LfpContrast, self).__init__(*args, **kwargs)
 
         self.p_lo = p_lo if p_lo is not None else 0.0
@@ -74,34 +91,100 @@ class LfpContrast(LfpViewpoints):
         max = self.ref_img.max()
         min = self.ref_img.min()
 
-        # convert to yuv space
-        self.proc_vp_arr(yuv_conv, msg='Convert to YUV')
+        # zero limits are replaced by luminance extrema of the light-field (as by the normalizer)
+        if not min or not max:
+            lum = np.dot(self._vp_img_arr.reshape(-1, self._vp_img_arr.shape[-1]), YUV_MAT_BT709[0])
+            min, max = min if min else lum.min(), max if max else lum.max()
+            del lum
 
-        # boost luminance channel
-        self.sta.status_msg(msg='Contrast balance', opt=self.cfg.params[self.cfg.opt_prnt])
-        self._vp_img_arr[..., 0] = misc.Normalizer(self._vp_img_arr[..., 0]).type_norm(max=max, min=min)
-        self.sta.progress(100, opt=self.cfg.params[self.cfg.opt_prnt])
+        yuv_mat = YUV_MAT_BT709.T.astype(self._vp_img_arr.dtype)
+        rgb_mat = YUV_MAT_BT709_INV.T.astype(self._vp_img_arr.dtype)
 
-        # convert to rgb space
-        self.proc_vp_arr(yuv_conv, inverse=True, msg='Convert to RGB')
+        def lum_boost(vec):
+            np.matmul(vec, yuv_mat, out=vec)
+            if max != min and max != 0:
+                vec[:, 0] -= min
+                vec[:, 0] /= max - min
+            np.clip(vec[:, 0], 0, 1, out=vec[:, 0])
+            np.matmul(vec, rgb_mat, out=vec)
+
+        # boost luminance channel between conversion to yuv and back to rgb space
+        self.proc_vec_chunks(lum_boost, msg='Contrast balance')
 
         return True
 
     def sat_bal(self):
 
-        # convert to hsv space
-        self.proc_vp_arr(hsv_conv, msg='Convert to HSV')
+        def sat_boost(vec):
+            self.rgb2hsv(vec)
+            vec[:, 1] *= 1.1
+            self.hsv2rgb(vec)
 
-        # boost saturation channel
-        self.sta.status_msg(msg='Saturation balance', opt=self.cfg.params[self.cfg.opt_prnt])
-        self.vp_img_arr[..., 1] *= 1.1
-        self.sta.progress(100, opt=self.cfg.params[self.cfg.opt_prnt])
+        # boost saturation channel between conversion to hsv and back to rgb space
+        self.proc_vec_chunks(sat_boost, msg='Saturation balance')
+
+        return True
+
+    def proc_vec_chunks(self, fun, msg=None):
+        """ apply function in place to (cache-sized) chunks of pixel vectors from a reshaped viewpoint array """
+
+        self.sta.status_msg(msg=msg if msg else 'Viewpoint process', opt=self.cfg.params[self.cfg.opt_prnt])
+        self.sta.progress(None, opt=self.cfg.params[self.cfg.opt_prnt])
 
-        # convert to rgb space
-        self.proc_vp_arr(hsv_conv, inverse=True, msg='Convert to RGB')
+        self._vp_img_arr = np.ascontiguousarray(self._vp_img_arr)
+        vec = self._vp_img_arr.reshape(-1, self._vp_img_arr.shape[-1])
+
+        percent = 0
+        for k in range(0, len(vec), CONV_CHUNK):
+            fun(vec[k:k+CONV_CHUNK])
+
+            # check interrupt status
+            if self.sta.interrupt:
+                return False
+
+            # progress update (in percent steps)
+            if int(min(k+CONV_CHUNK, len(vec)) / len(vec) * 100) > percent:
+                percent = int(min(k+CONV_CHUNK, len(vec)) / len(vec) * 100)
+                self.sta.progress(percent, opt=self.cfg.params[self.cfg.opt_prnt])
 
         return True
 
+    @staticmethod
+    def rgb2hsv(vec):
+        """ in-place conversion of (N, 3) RGB vectors to HSV as by color_space_converter """
+
+        maxc, minc = np.argmax(vec, axis=1), np.argmin(vec, axis=1)
+        maxv, minv = np.amax(vec, axis=1), np.amin(vec, axis=1)
+        dif = maxv - minv + np.spacing(1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            hue = np.where(maxc == 0, (vec[:, 1] - vec[:, 2]) * 60.0 / dif % 360.0,
+                           np.where(maxc == 1, (vec[:, 2] - vec[:, 0]) * 60.0 / dif + 120.0,
+                                    (vec[:, 0] - vec[:, 1]) * 60.0 / dif + 240.0))
+            sat = np.where(maxv != 0, 1 - minv / (maxv + np.spacing(1)), 0)
+        hue[maxc == minc] = 0
+
+        vec[:, 0], vec[:, 1], vec[:, 2] = hue, sat, maxv
+
+        return vec
+
+    @staticmethod
+    def hsv2rgb(vec):
+        """ in-place conversion of (N, 3) HSV vectors to RGB as by color_space_converter """
+
+        sec = np.floor(vec[:, 0] / 60.0)
+        f = vec[:, 0] / 60.0 - sec
+        v = vec[:, 2].copy()
+        p = v * (1.0 - vec[:, 1])
+        q = v * (1.0 - f * vec[:, 1])
+        t = v * (1.0 - (1.0 - f) * vec[:, 1])
+
+        # pick (v, p, q, t) components per hue sector
+        cmp = np.stack((v, p, q, t), axis=1)
+        vec[...] = np.take_along_axis(cmp, HSV_SECTORS[(sec % 6).astype('uint8')], axis=1)
+
+        return vec
+
     def wht_bal(self, method=None, msg_opt=True):
 
         # status update
@@ -119,8 +202,7 @@ class LfpContrast(LfpViewpoints):
                 img_ch = self.vp_img_arr[..., i]
 
                 # define level limits
-                min = np.percentile(ref_ch, self.p_lo*100)
-                max = np.percentile(ref_ch, self.p_hi*100)
+                min, max = misc.fast_percentile(ref_ch, [self.p_lo*100, self.p_hi*100])
 
                 # normalization of color channel
                 self.vp_img_arr[..., i] = misc.Normalizer(img_ch, min=min, max=max).uint16_norm()
@@ -147,8 +229,9 @@ class LfpContrast(LfpViewpoints):
         min = float('Inf')
         max = 0.
         for i in range(ch_num):
-            min = np.min([min, np.percentile(self.ref_img[..., i], self.p_lo * 100)])
-            max = np.max([max, np.percentile(self.ref_img[..., i], self.p_hi * 100)])
+            p_lo, p_hi = misc.fast_percentile(self.ref_img[..., i], [self.p_lo * 100, self.p_hi * 100])
+            min = np.min([min, p_lo])
+            max = np.max([max, p_hi])
 
         # normalization of color channel
         self.vp_img_arr = misc.Normalizer(self.vp_img_arr, min=min, max=max).uint16_norm()
@@ -177,34 +260,35 @@ class LfpContrast(LfpViewpoints):
 
         # estimate contrast und brightness parameters (by default: first channel only)
         val_lim = 2**16-1 if not val_lim else val_lim
-        h = np.histogram(ref_ch, bins=val_lim)[0]
-        H = np.cumsum(h)/float(np.sum(h))
-        try:
-            px_lo = self.find_x_given_y(self.p_lo, np.arange(val_lim), H)
-            px_hi = self.find_x_given_y(self.p_hi, np.arange(val_lim), H)
-        except:
-            px_lo = 0
-            px_hi = val_lim
-        A = np.array([[px_lo, 1], [px_hi, 1]])
-        b = np.array([0, val_lim])
-        self._contrast, self._brightness = np.dot(np.linalg.inv(A), b)
+        ref_ch = np.ascontiguousarray(ref_ch)
+        key = (ref_ch.shape, str(ref_ch.dtype), val_lim, self.p_lo, self.p_hi, hashlib.sha1(ref_ch).hexdigest())
+
+        if key not in LfpContrast._cache:
+            h = np.histogram(ref_ch, bins=val_lim)[0]
+            H = np.cumsum(h)/float(np.sum(h))
+            px_lo, px_hi = self.find_cut_points(H, [self.p_lo, self.p_hi])
+            if not px_hi > px_lo:
+                px_lo, px_hi = 0, val_lim
+            A = np.array([[px_lo, 1], [px_hi, 1]])
+            b = np.array([0, val_lim])
+            if len(LfpContrast._cache) >= STRETCH_CACHE:
+                LfpContrast._cache.pop(next(iter(LfpContrast._cache)))
+            LfpContrast._cache[key] = tuple(np.dot(np.linalg.inv(A), b))
+
+        self._contrast, self._brightness = LfpContrast._cache[key]
 
         return self._contrast, self._brightness
 
     @staticmethod
-    def find_x_given_y(value, x, y, tolerance=1e-4):
-
-        i = 0
-        iter_max = 10
-        arr = np.array([])
-        while arr.size == 0 and i != iter_max:
-            arr = np.array([(xi, yi) for (xi, yi) in zip(x, y) if abs(yi - value) <= tolerance])
-            i += 1
-            tolerance = 10**(-4+i)
+    def find_cut_points(cdf, values):
+        """ bin positions where cumulative histogram (given at right bin edges) reaches values interpolated linearly """
 
-        found_y = np.mean(arr.T[0]) if i != iter_max else round(value)
+        values = np.asarray(values, dtype='float64')
+        idx = np.minimum(np.searchsorted(cdf, values, side='left'), len(cdf)-1)
+        cdf_lo = np.where(idx > 0, cdf[idx-1], 0)
+        step = cdf[idx] - cdf_lo
 
-        return found_y
+        return idx + np.clip(np.divide(values - cdf_lo, step, out=np.zeros_like(step), where=step > 0), 0, 1)
 
     def apply_stretch(self, img=None, ch=None):
         """ contrast and brightness rectification for provided RGB image """
@@ -251,12 +335,11 @@ class LfpContrast(LfpViewpoints):
 
         if opt:
             p_lo, p_hi = (0.005, 99.9)
-            min_perc = np.percentile(rgb2gry(ref_img), p_lo)
-            max_perc = np.percentile(ref_img, p_hi)
+            min_perc = misc.fast_percentile(rgb2gry(ref_img), p_lo)
+            max_perc = misc.fast_percentile(ref_img, p_hi)
         else:
             p_lo, p_hi = (0.5, 99.9)
-            min_perc = np.percentile(ref_img, p_lo)
-            max_perc = np.percentile(ref_img, p_hi)
+            min_perc, max_perc = misc.fast_percentile(ref_img, [p_lo, p_hi])
 
         img = misc.Normalizer(img, min=min_perc, max=max_perc).type_norm()
 
@@ -285,8 +368,7 @@ class LfpContrast(LfpViewpoints):
         ref_ch = yuv_conv(self.central_view)[..., ch]
 
         # define level limits
-        self._min = np.percentile(ref_ch, self.p_lo*100)
-        self._max = np.percentile(ref_ch, self.p_hi*100)
+        self._min, self._max = misc.fast_percentile(ref_ch, [self.p_lo*100, self.p_hi*100])
 
         self.proc_vp_arr(self.lum_norm, msg='Luminance normalization')
 
@@ -32,16 +32,12 @@ class LfpCropper(LfpMicroLenses):
 
         # use _k as crop margin
         self._k = (self._limg_pitch - self._size_pitch).astype('int') // 2
+        self.new_lfp_img = None
 
         if self._lfp_img_align is not None:
 
             self._LENS_Y_MAX = int(self._lfp_img_align.shape[0]/self._limg_pitch[0])
             self._LENS_X_MAX = int(self._lfp_img_align.shape[1]/self._limg_pitch[1])
-            p = self._lfp_img_align.shape[-1] if len(self._lfp_img_align.shape) == 3 else 1
-            self.new_lfp_img = np.zeros([int(self._size_pitch*self._LENS_Y_MAX),
-                                         int(self._size_pitch*self._LENS_X_MAX),
-                                         p],
-                                        dtype=self._lfp_img_align.dtype)
 
     def main(self):
 
@@ -51,16 +47,32 @@ class LfpCropper(LfpMicroLenses):
 
         # reduce light field in angular domain (depending on settings)
         if self._size_pitch < self._limg_pitch[0] or self._size_pitch < self._limg_pitch[1]:
-            self.proc_lens_iter(self.crop_micro_image, msg='Render angular domain')
+            self.sta.status_msg('Render angular domain', self.cfg.params[self.cfg.opt_prnt])
+            self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
+            self.new_lfp_img = self.crop_micro_images()
+            self.sta.progress(100, self.cfg.params[self.cfg.opt_prnt])
         elif self._size_pitch == min(self._limg_pitch):
             self.new_lfp_img = self._lfp_img_align
+        else:
+            p = self._lfp_img_align.shape[-1] if len(self._lfp_img_align.shape) == 3 else 1
+            self.new_lfp_img = np.zeros([int(self._size_pitch*self._LENS_Y_MAX),
+                                         int(self._size_pitch*self._LENS_X_MAX),
+                                         p],
+                                        dtype=self._lfp_img_align.dtype)
+
+        return True
+
+    def crop_micro_images(self):
+        """ central window of all micro images sliced from (lens y, pixel y, lens x, pixel x, channel) view """
 
-    def crop_micro_image(self, ly, lx):
+        (py, px), ly, lx, s = self._limg_pitch, self._LENS_Y_MAX, self._LENS_X_MAX, self._size_pitch
+        arr = self._lfp_img_align[:ly*py, :lx*px]
+        arr = arr if len(arr.shape) == 3 else arr[..., np.newaxis]
+        arr = arr.reshape(ly, py, lx, px, arr.shape[-1])[:, self._k[0]:self._k[0]+s, :, self._k[1]:self._k[1]+s]
 
-        self.new_lfp_img[ly*self._size_pitch:(ly+1)*self._size_pitch, lx*self._size_pitch:(lx+1)*self._size_pitch] = \
-            self._lfp_img_align[self._k[0]+ly*self._limg_pitch[0]:(ly+1)*self._limg_pitch[0]-self._k[0],
-                                self._k[1]+lx*self._limg_pitch[1]:(lx+1)*self._limg_pitch[1]-self._k[1]]
+        # merging axes of the strided window requires a (single) contiguous copy
+        return arr.reshape(ly*s, lx*s, arr.shape[-1])
 
     @property
     def lfp_img_align(self):
-        return self.new_lfp_img.copy() if self.new_lfp_img is not None else None
+        return self.new_lfp_img
@@ -113,8 +113,7 @@ class LfpExporter(LfpViewpoints):
             if downscale else self.views_stacked_img.copy()
 
         # normalization
-        p_lo = np.percentile(rgb2gry(self.central_view), 0.05)
-        p_hi = np.percentile(rgb2gry(self.central_view), 99.995)
+        p_lo, p_hi = misc.fast_percentile(rgb2gry(self.central_view), [0.05, 99.995])
         views_stacked_img = misc.Normalizer(views_stacked_img, min=p_lo, max=p_hi).uint8_norm()
 
         # export all viewpoints in single image
@@ -38,54 +38,80 @@ class LfpOutliers(LfpViewpoints):
         if self.sta.interrupt:
             return False
 
-        # remove outliers
-        self.proc_vp_arr(self.correct_outliers, msg='Pixel outlier removal')
+        # print status
+        self.sta.status_msg('Pixel outlier removal', self.cfg.params[self.cfg.opt_prnt])
+        self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
 
-    def correct_outliers(self, img, n=2, perc=.2):
+        # remove outliers from all viewpoints of a row at once
+        for j in range(self._vp_img_arr.shape[0]):
 
-        for j in range(n, img.shape[0]-n):
-            for i in range(n, img.shape[1]-n):
+            self.correct_outliers(self._vp_img_arr[j])
 
-                win = img[j-n:j+n+1, i-n:i+n+1]
+            # check interrupt status
+            if self.sta.interrupt:
+                return False
 
-                # hot pixel detection
-                num_hi = len(win[win > img[j, i]*(1-perc)])
+            # progress update
+            self.sta.progress((j+1)/self._vp_img_arr.shape[0]*100, self.cfg.params[self.cfg.opt_prnt])
 
-                # dead pixel detection
-                num_lo = len(win[win < img[j, i]*perc])
+        return True
 
-                if num_hi < win.size/(2*n+1) or num_lo > win.size/(2*n+1):
-                    # replace outlier by average of all directly adjacent pixels
-                    img[j, i] = (sum(sum(img[j-1:j+2, i-1:i+2]))-img[j, i])/8.
+    @staticmethod
+    def outlier_mask(ref, n=2, perc=.2, dead_cmp=np.greater):
+        """ count window values above hot and below dead pixel thresholds of each (inner) pixel in shifted slices """
 
-                # check interrupt status
-                if self.sta.interrupt:
-                    return False
+        h, w, c = ref.shape[-3:]
+        size = 2*n+1
+        cen = ref[..., n:h-n, n:w-n, :]
+        hi_thr, lo_thr = cen*(1-perc), cen*perc
 
-        return img
+        # counts over window and channel axes (in place of a window view that is size**2 times the data)
+        num_hi = np.zeros(cen.shape[:-1], dtype='int16')
+        num_lo = np.zeros(cen.shape[:-1], dtype='int16')
+        for dy in range(size):
+            for dx in range(size):
+                win = ref[..., dy:h-2*n+dy, dx:w-2*n+dx, :]
+                num_hi += np.count_nonzero(win > hi_thr, axis=-1).astype('int16', copy=False)
+                num_lo += np.count_nonzero(win < lo_thr, axis=-1).astype('int16', copy=False)
 
-    def correct_luma_outliers(self, img, n=2, perc=.2):
+        lim = size**2*c/size
 
-        # luma channel conversion
-        luma = yuv_conv(img.copy())[..., 0]
+        return (num_hi < lim) | dead_cmp(num_lo, lim)
+
+    @staticmethod
+    def replace_outliers(img, mask, n=2):
+        """ replace masked (inner) pixels by average of their 8 directly adjacent pixels """
+
+        h, w = img.shape[-3:-1]
+        cen = img[..., n:h-n, n:w-n, :]
+        avg = -cen.copy()
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                avg += img[..., n+dy:h-n+dy, n+dx:w-n+dx, :]
+        avg /= 8.
 
-        for j in range(n, luma.shape[0]-n):
-            for i in range(n, luma.shape[1]-n):
-                win = luma[j-n:j+n+1, i-n:i+n+1]
+        cen[mask] = avg[mask]
 
-                # hot pixel detection
-                num_hi = len(win[win > luma[j, i]*(1-perc)])
+        return img
+
+    def correct_outliers(self, img, n=2, perc=.2):
+        """ hot and dead pixel correction of images with spatial axes in front of the channel axis (e.g. viewpoint
+        stack) where all pixels are classified and replaced based on the unmodified input """
+
+        arr = img[..., np.newaxis] if len(img.shape) == 2 else img
+        mask = self.outlier_mask(arr, n=n, perc=perc)
+        self.replace_outliers(arr, mask, n=n)
 
-                # dead pixel detection
-                num_lo = len(win[win < luma[j, i]*perc])
+        return img
+
+    def correct_luma_outliers(self, img, n=2, perc=.2):
+        """ outlier correction as in correct_outliers with pixels classified by their luma """
 
-                if num_hi < win.size/(2*n+1) or num_lo < win.size/(2*n+1):
-                    # replace outlier by average of all directly adjacent pixels
-                    img[j, i, :] = (sum(sum(img[j-1:j+2, i-1:i+2, :]))-img[j, i, :])/8.
+        # luma channel conversion
+        luma = yuv_conv(img)[..., 0:1]
 
-                # check interrupt status
-                if self.sta.interrupt:
-                    return False
+        mask = self.outlier_mask(luma, n=n, perc=perc, dead_cmp=np.less)
+        self.replace_outliers(img, mask, n=n)
 
         return img
 
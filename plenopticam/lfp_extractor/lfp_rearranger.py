@@ -32,40 +32,33 @@ class LfpRearranger(LfpViewpoints):
         super(LfpRearranger, self).__init__(*args, **kwargs)
 
         self._lfp_img_align = lfp_img_align if lfp_img_align is not None else None
-        self._dtype = self._lfp_img_align.dtype if self._lfp_img_align is not None else self._vp_img_arr.dtype
 
-    def _init_vp_img_arr(self):
-        """ initialize viewpoint output image array """
+    def viewpoint_view(self, lfp_img_align=None):
+        """ viewpoint array as transposed (non-copying) view of aligned micro image array """
 
-        if len(self._lfp_img_align.shape) == 3:
-            m, n, p = self._lfp_img_align.shape
-        elif len(self._lfp_img_align.shape) == 2:
-            m, n, p = self._lfp_img_align.shape[:2] + (1,)
-        else:
-            raise PlenopticamError('Dimensions %s of provided light-field not supported', self._lfp_img_align.shape,
+        lfp_img_align = self._lfp_img_align if lfp_img_align is None else lfp_img_align
+        if len(lfp_img_align.shape) == 2:
+            lfp_img_align = lfp_img_align[..., np.newaxis]
+        elif len(lfp_img_align.shape) != 3:
+            raise PlenopticamError('Dimensions %s of provided light-field not supported', lfp_img_align.shape,
                                    cfg=self.cfg, sta=self.sta)
 
-        self._vp_img_arr = np.zeros([int(self._size_pitch), int(self._size_pitch),
-                                     int(m/self._size_pitch), int(n/self._size_pitch), p], dtype=self._dtype)
+        # micro image axes split from spatial axes as (H, M, W, M, P) and moved to the front as (M, M, H, W, P)
+        m, n, p = lfp_img_align.shape
+        h, w = m // self._size_pitch, n // self._size_pitch
+        lfp_img_align = lfp_img_align[:h*self._size_pitch, :w*self._size_pitch]
 
-    def _init_lfp_img_align(self):
-        """ initialize micro image output image array """
+        return lfp_img_align.reshape(h, self._size_pitch, w, self._size_pitch, p).transpose(1, 3, 0, 2, 4)
 
-        if len(self._vp_img_arr.shape) == 5:
-            m, n, p = self._vp_img_arr.shape[2:]
-        elif len(self._vp_img_arr.shape) == 4:
-            m, n, p = self._vp_img_arr.shape[2:] + (1,)
-        else:
-            raise PlenopticamError('Dimensions %s of provided light-field not supported', self._vp_img_arr.shape,
-                                   cfg=self.cfg, sta=self.sta)
+    def materialize(self, out=None):
+        """ contiguous copy of viewpoint array (written to preallocated buffer if provided) """
 
-        # create empty array
-        m *= self._vp_img_arr.shape[0]
-        n *= self._vp_img_arr.shape[1]
-        self._lfp_img_align = np.zeros([m, n, p], dtype=self._dtype)
+        if out is None:
+            return np.ascontiguousarray(self._vp_img_arr)
 
-        # update angular resolution parameter
-        self._size_pitch = self._vp_img_arr.shape[0] if self._vp_img_arr.shape[0] == self._vp_img_arr.shape[1] else float('inf')
+        np.copyto(out, self._vp_img_arr)
+
+        return out
 
     def main(self):
 
@@ -80,29 +73,17 @@ class LfpRearranger(LfpViewpoints):
         """
         Conversion from aligned micro image array to viewpoint array representation. The fundamentals behind the
         4-D light-field transfer were derived by Levoy and Hanrahans in their paper 'Light Field Rendering' in Fig. 6.
+        The viewpoint array is a view sharing memory with the aligned image (see materialize() for a copy).
         """
 
         # print status
         self.sta.status_msg('Viewpoint composition', self.cfg.params[self.cfg.opt_prnt])
         self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
 
-        # initialize basic light-field parameters
-        self._init_vp_img_arr()
-
         # rearrange light field to multi-view image representation
-        for j in range(self._size_pitch):
-            for i in range(self._size_pitch):
-
-                # check interrupt status
-                if self.sta.interrupt:
-                    return False
+        self._vp_img_arr = self.viewpoint_view()
 
-                # extract viewpoint by pixel rearrangement
-                self._vp_img_arr[j, i, ...] = self._lfp_img_align[j::self._size_pitch, i::self._size_pitch, :]
-
-                # print status
-                percentage = (j * self._size_pitch + i + 1) / self._size_pitch ** 2
-                self.sta.progress(percentage*100, self.cfg.params[self.cfg.opt_prnt])
+        self.sta.progress(100, self.cfg.params[self.cfg.opt_prnt])
 
         return True
 
@@ -116,22 +97,18 @@ class LfpRearranger(LfpViewpoints):
         self.sta.status_msg('Viewpoint decomposition', self.cfg.params[self.cfg.opt_prnt])
         self.sta.progress(None, self.cfg.params[self.cfg.opt_prnt])
 
-        # initialize basic light-field parameters
-        self._init_lfp_img_align()
-
-        # rearrange light field to multi-view image representation
-        for j in range(self._size_pitch):
-            for i in range(self._size_pitch):
+        vp_img_arr = self._vp_img_arr if len(self._vp_img_arr.shape) == 5 else self._vp_img_arr[..., np.newaxis]
+        if len(vp_img_arr.shape) != 5:
+            raise PlenopticamError('Dimensions %s of provided light-field not supported', self._vp_img_arr.shape,
+                                   cfg=self.cfg, sta=self.sta)
 
-                # check interrupt status
-                if self.sta.interrupt:
-                    return False
+        # update angular resolution parameter
+        self._size_pitch = vp_img_arr.shape[0] if vp_img_arr.shape[0] == vp_img_arr.shape[1] else float('inf')
 
-                # extract viewpoint by pixel rearrangement
-                self._lfp_img_align[j::self._size_pitch, i::self._size_pitch, :] = self._vp_img_arr[j, i, :, :, :]
+        # inverse axis order (no copy if viewpoints are a view of an aligned image)
+        m, n, h, w, p = vp_img_arr.shape
+        self._lfp_img_align = vp_img_arr.transpose(2, 0, 3, 1, 4).reshape(h*m, w*n, p)
 
-                # print status
-                percentage = (j * self._size_pitch + i + 1) / self._size_pitch ** 2
-                self.sta.progress(percentage*100, self.cfg.params[self.cfg.opt_prnt])
+        self.sta.progress(100, self.cfg.params[self.cfg.opt_prnt])
 
         return True
@@ -32,7 +32,8 @@ class LfpViewpoints(object):
     def __init__(self, *args, **kwargs):
 
         self._vp_img_arr = kwargs['vp_img_arr'] if 'vp_img_arr' in kwargs else None
-        self._vp_img_arr = self.vp_img_arr.astype('float64') if self.vp_img_arr is not None else None
+        dtype = kwargs['dtype'] if 'dtype' in kwargs else 'float64'
+        self._vp_img_arr = self.vp_img_arr.astype(dtype) if self.vp_img_arr is not None else None
         self.cfg = kwargs['cfg'] if 'cfg' in kwargs else PlenopticamConfig()
         self.sta = kwargs['sta'] if 'sta' in kwargs else PlenopticamStatus()
         self._size_pitch = self.cfg.params[self.cfg.ptc_leng]
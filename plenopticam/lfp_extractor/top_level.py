@@ -23,6 +23,7 @@ __license__ = """
 # local imports
 from plenopticam.cfg import PlenopticamConfig
 from plenopticam import misc
+from plenopticam.lfp_aligner.lfp_align_store import LfpAlignStore
 from plenopticam.lfp_extractor.lfp_cropper import LfpCropper
 from plenopticam.lfp_extractor.lfp_rearranger import LfpRearranger
 from plenopticam.lfp_extractor.lfp_exporter import LfpExporter
@@ -32,7 +33,6 @@ from plenopticam.lfp_extractor.lfp_color_eq import LfpColorEqualizer
 from plenopticam.lfp_extractor.hex_corrector import HexCorrector
 from plenopticam.lfp_extractor.lfp_depth import LfpDepth
 
-import pickle
 import os
 
 
@@ -42,6 +42,7 @@ class LfpExtractor(object):
 
         # input variables
         self._lfp_img_align = lfp_img_align
+        self._align_meta = None
         self.cfg = cfg if cfg is not None else PlenopticamConfig()
         self.sta = sta if sta is not None else misc.PlenopticamStatus()
 
@@ -56,16 +57,20 @@ class LfpExtractor(object):
         if self.cfg.calibs is None:
             self.cfg.load_cal_data()
         if self._lfp_img_align is None:
-            self.load_pickle_file()
+            self.load_align_store()
             self.load_lfp_metadata()
+        else:
+            self._align_meta = LfpAlignStore(cfg=self.cfg, sta=self.sta).read_meta()
 
         # micro image crop
-        lfp_obj = LfpCropper(lfp_img_align=self._lfp_img_align, cfg=self.cfg, sta=self.sta)
+        lfp_obj = LfpCropper(lfp_img_align=self._lfp_img_align, align_meta=self._align_meta, cfg=self.cfg,
+                             sta=self.sta)
         lfp_obj.main()
         self._lfp_img_align = lfp_obj.lfp_img_align
         del lfp_obj
 
-        # rearrange light-field to sub-aperture images
+        # rearrange light-field to sub-aperture images (as view of aligned light-field materialized by the float
+        # conversion of the next viewpoint stage)
         if self.cfg.params[self.cfg.opt_view]:
             lfp_obj = LfpRearranger(self._lfp_img_align, cfg=self.cfg, sta=self.sta)
             lfp_obj.main()
@@ -117,20 +122,12 @@ class LfpExtractor(object):
 
         return True
 
-    def load_pickle_file(self):
-        """ load previously computed light field alignment """
+    def load_align_store(self):
+        """ memory-map previously computed light field alignment """
 
-        # file path
-        fp = os.path.join(self.cfg.exp_path, 'lfp_img_align.pkl')
+        self._lfp_img_align, self._align_meta = LfpAlignStore(cfg=self.cfg, sta=self.sta).read(mmap_mode='r')
 
-        try:
-            self._lfp_img_align = pickle.load(open(fp, 'rb'))
-        except EOFError:
-            os.remove(fp)
-        except FileNotFoundError:
-            return False
-
-        return True
+        return self._lfp_img_align is not None
 
     def load_lfp_metadata(self):
         """ load LFP metadata settings (for Lytro files only) """
@@ -185,6 +185,9 @@ class LfpDecoder(object):
         serial = safe_get(json_dict, 'camera', 'serialNumber')
         cam_model = serial if serial else safe_get(json_dict, 'camera', 'model')
 
+        # camera serial identifies sensor-specific data (e.g. defect maps)
+        settings['ser'] = serial
+
         # set decode paramaters considering camera model
         if cam_model.startswith(('A', 'F')):    # 1st generation Lytro
 
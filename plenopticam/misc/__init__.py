@@ -1,5 +1,6 @@
 from plenopticam.misc.data_proc import *
 from plenopticam.misc.normalizer import Normalizer
+from plenopticam.misc.fast_stats import fast_percentile
 from plenopticam.misc.os_ops import mkdir_p, rmdir_p, rm_file, select_file, get_img_list
 from plenopticam.misc.file_rw import load_img_file, save_img_file, save_gif
 from plenopticam.misc.status import PlenopticamStatus
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+__author__ = "Christopher Hahne"
+__email__ = "info@christopherhahne.de"
+__license__ = """
+    Copyright (c) 2019 Christopher Hahne <info@christopherhahne.de>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+
+import numpy as np
+
+# number of histogram bins (absolute error of approximate percentiles is below (max-min)/HIST_BINS)
+HIST_BINS = 2**14
+
+# number of values binned in one chunk
+HIST_CHUNK = 2**20
+
+# arrays up to this size are evaluated exactly
+HIST_MIN_SIZE = 2**18
+
+
+def fast_percentile(arr, q, exact=False, bins=HIST_BINS):
+    """ percentile(s) q (in percent) of an array from a single fixed-bin histogram with an error below one bin width
+    or exactly computed by numpy if the exact option is set """
+
+    vec = np.asarray(arr).ravel()
+
+    if exact or vec.size <= max(HIST_MIN_SIZE, bins):
+        return np.percentile(vec, q)
+
+    lo, hi = vec.min(), vec.max()
+    if not np.isfinite(hi - lo):
+        return np.percentile(vec, q)
+    if lo == hi:
+        return np.full(np.shape(q), lo, dtype='float64')[()]
+
+    # histogram from integer bin indices in chunks
+    scale = bins / (float(hi) - float(lo))
+    hist = np.zeros(bins, dtype='int64')
+    for k in range(0, vec.size, HIST_CHUNK):
+        idx = ((vec[k:k+HIST_CHUNK] - lo) * scale).astype(np.intp)
+        np.minimum(idx, bins-1, out=idx)
+        hist += np.bincount(idx, minlength=bins)
+    cdf = np.cumsum(hist)
+
+    # bins containing the (linearly interpolated) ranks of all requested percentiles
+    ranks = np.asarray(q, dtype='float64') / 100 * (vec.size - 1)
+    b = np.minimum(np.searchsorted(cdf, ranks, side='right'), bins-1)
+
+    # position within bin assuming uniformly distributed values
+    frac = np.clip((ranks - (cdf[b] - hist[b]) + .5) / np.maximum(hist[b], 1), 0, 1)
+
+    return float(lo) + (b + frac) / scale
@@ -0,0 +1,742 @@
+#!/usr/bin/env python
+
+__author__ = "Christopher Hahne"
+__email__ = "inbox@christopherhahne.de"
+__license__ = """
+    Copyright (c) 2020 Christopher Hahne <inbox@christopherhahne.de>
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import unittest
+import tempfile
+import os
+import numpy as np
+from scipy.ndimage import gaussian_filter, map_coordinates
+from skimage import transform
+from color_matcher import ColorMatcher
+from color_space_converter import yuv_conv, hsv_conv
+
+from plenopticam.lfp_aligner import CfaOutliers, CfaProcessor, RawConditioner, LfpDevignetter, LfpRotator, \
+    LfpMicroLenses, LfpAlignStore, LfpAlignLut, LfpAligner
+from plenopticam.lfp_aligner.cfa_processor import DMSC_FUNS, demosaic_pool
+from plenopticam.lfp_aligner import lfp_global_resampler
+from plenopticam.lfp_aligner.lfp_global_resampler import LfpGlobalResampler
+from plenopticam.lfp_aligner.lfp_resampler import LfpResampler
+from plenopticam.lfp_aligner import lfp_local_resampler
+from plenopticam.lfp_aligner.lfp_local_resampler import LfpLocalResampler, shift_weights
+from plenopticam.lfp_calibrator import GridFitter
+from plenopticam.lfp_extractor.lfp_cropper import LfpCropper
+from plenopticam.lfp_extractor.lfp_rearranger import LfpRearranger
+from plenopticam.lfp_extractor.lfp_outliers import LfpOutliers
+from plenopticam.lfp_extractor.lfp_color_eq import LfpColorEqualizer
+from plenopticam.lfp_extractor.lfp_contrast import LfpContrast
+from plenopticam.cfg import PlenopticamConfig
+from plenopticam.misc import PlenopticamStatus, Normalizer, fast_percentile
+
+
+class LensCropper(LfpCropper):
+    """ micro image crop by iteration over lenses """
+
+    def main(self):
+
+        self.new_lfp_img = np.zeros((self._size_pitch*self._LENS_Y_MAX, self._size_pitch*self._LENS_X_MAX) +
+                                    self._lfp_img_align.shape[2:], dtype=self._lfp_img_align.dtype)
+        self.proc_lens_iter(self.crop_micro_image, prnt=False)
+
+    def crop_micro_image(self, ly, lx):
+
+        self.new_lfp_img[ly*self._size_pitch:(ly+1)*self._size_pitch, lx*self._size_pitch:(lx+1)*self._size_pitch] = \
+            self._lfp_img_align[self._k[0]+ly*self._limg_pitch[0]:(ly+1)*self._limg_pitch[0]-self._k[0],
+                                self._k[1]+lx*self._limg_pitch[1]:(lx+1)*self._limg_pitch[1]-self._k[1]]
+
+
+class PlenoptiCamTesterAlign(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(PlenoptiCamTesterAlign, self).__init__(*args, **kwargs)
+
+    def setUp(self):
+
+        # instantiate config and status objects
+        self.cfg = PlenopticamConfig()
+        self.cfg.default_values()
+        self.sta = PlenopticamStatus()
+
+        # omit status messages
+        self.cfg.params[self.cfg.opt_prnt] = False
+
+    def test_hot_pixels(self):
+
+        # synthetic Bayer image with isolated hot pixels
+        rng = np.random.default_rng(0)
+        bay_img = .5 + .05 * rng.standard_normal((400, 500))
+        hot_map = np.zeros(bay_img.shape, dtype='bool')
+        hot_map[rng.integers(2, 398, 50), rng.integers(2, 498, 50)] = True
+        bay_img[hot_map] = 1.
+
+        obj = CfaOutliers(bay_img=bay_img.copy(), cfg=self.cfg, sta=self.sta, serial=None)
+        obj.main(n=9, sig_lev=2.5)
+
+        # detected pixels are hot pixels only
+        self.assertTrue(np.any(obj.hot_map), 'Hot pixels not detected')
+        self.assertFalse(np.any(obj.hot_map & ~hot_map), 'False hot pixel detection')
+        self.assertTrue(np.all(obj.bay_img[obj.hot_map] < .75), 'Hot pixel correction failed')
+
+        # known defects are replaced by same-channel neighbors
+        bay_img = CfaOutliers.correct_defects(bay_img, hot_map)
+        self.assertTrue(np.all(np.abs(bay_img[hot_map] - .5) < .25), 'Defect map correction failed')
+
+        # defects at borders are replaced by mirrored same-channel neighbors only
+        bay_img = np.tile([[.2, .4], [.6, .8]], (5, 6))
+        dft_map = np.zeros(bay_img.shape, dtype='bool')
+        dft_map[[0, 1, 1, 8, 9], [0, 1, 3, 10, 11]] = True
+        ref_img = bay_img.copy()
+        bay_img[dft_map] = 10.
+        bay_img = CfaOutliers.correct_defects(bay_img, dft_map)
+        self.assertTrue(np.allclose(bay_img, ref_img), 'Border defect correction failed')
+
+        # defect statistics of a sensor region are read from the full-sensor map which is kept intact
+        with tempfile.TemporaryDirectory() as cfg_path:
+            self.cfg._dir_path = cfg_path
+            bay_img = .5 + .05 * rng.standard_normal((40, 50))
+            obj = CfaOutliers(bay_img=bay_img, cfg=self.cfg, sta=self.sta, serial='X')
+            obj.load_defect_map()
+            obj._dft_hits[12, 14], obj._dft_runs = 5, 5
+            obj.save_defect_map()
+            obj = CfaOutliers(bay_img=bay_img[10:30, 10:40].copy(), cfg=self.cfg, sta=self.sta, serial='X',
+                              offset=[10, 10])
+            obj.main(n=9, sig_lev=2.5)
+            self.assertTrue(obj.defect_map[2, 4] and obj.defect_map.shape == (20, 30), 'Region defect map mismatch')
+            with np.load(obj.dft_fp) as data:
+                self.assertEqual((data['hits'].shape, int(data['runs'])), ((40, 50), 5))
+
+    def test_tiled_demosaicing(self):
+
+        bay_img = np.random.default_rng(0).random((200, 260)).astype('float32')
+        obj = CfaProcessor(bay_img=bay_img, cfg=self.cfg, sta=self.sta)
+
+        for method in DMSC_FUNS.keys():
+            ref_img = DMSC_FUNS[method](bay_img, 'GRBG')
+            rgb_img = obj.demosaic_tiles(bay_img, 'GRBG', method=method, tile_size=64, workers=1)
+            self.assertTrue(np.allclose(ref_img, rgb_img, atol=1e-6), 'Tiled demosaicing mismatch for %s' % method)
+
+        # process pool is spawned once and reused by subsequent calls
+        rgb_img = obj.demosaic_tiles(bay_img, 'GRBG', method='bilinear', tile_size=64, workers=2)
+        pool = demosaic_pool(2)
+        self.assertTrue(np.allclose(DMSC_FUNS['bilinear'](bay_img, 'GRBG'), rgb_img, atol=1e-6))
+        obj.demosaic_tiles(bay_img, 'GRBG', method='bilinear', tile_size=64, workers=2)
+        self.assertIs(pool, demosaic_pool(2))
+        demosaic_pool(2, reset=True)
+
+    def test_lens_demosaicing(self):
+
+        bay_img = np.random.default_rng(0).random((400, 520)).astype('float32')
+        grid = GridFitter.grid_gen(dims=[8, 10], pat_type='hex', hex_odd=0)
+        mic_list = GridFitter.apply_transform(np.array([[50., 0, 200], [0, 50., 260], [0, 0, 1]]), grid)
+        obj = CfaProcessor(bay_img=bay_img, cfg=self.cfg, sta=self.sta)
+
+        for method in DMSC_FUNS.keys():
+            ref_img = DMSC_FUNS[method](bay_img, 'GRBG')
+            rgb_img = obj.demosaic_lenses(bay_img, 'GRBG', method=method, mic_list=mic_list, size=7)
+            mask = obj.lens_mask
+            self.assertTrue(mask is not None and mask.mean() < .5, 'Inter-lens gaps not skipped for %s' % method)
+            self.assertTrue(np.allclose(ref_img[mask], rgb_img[mask], atol=1e-6), 'Lens demosaicing mismatch')
+
+        # densely packed micro images at realistic pitch covering a sensor region are demosaiced as lens blocks
+        bay_img = np.random.default_rng(1).random((480, 560)).astype('float32')
+        grid = GridFitter.grid_gen(dims=[20, 24], pat_type='hex', hex_odd=0)
+        mic_list = GridFitter.apply_transform(np.array([[14., 0, 240], [0, 14., 280], [0, 0, 1]]), grid)
+        self.cfg.params[self.cfg.opt_lens] = True
+        self.cfg.calibs[self.cfg.mic_list] = mic_list
+        self.cfg.params[self.cfg.ptc_leng] = 13
+        obj = CfaProcessor(bay_img=bay_img, cfg=self.cfg, sta=self.sta, lens_opt=self.cfg.params[self.cfg.opt_lens])
+        ref_img = DMSC_FUNS['menon'](bay_img, 'GRBG')
+        rgb_img = obj.demosaic_lenses(bay_img, 'GRBG', method='menon', mic_list=mic_list, size=13)
+        mask = obj.lens_mask
+        self.assertTrue(mask is not None and mask.mean() < .8, 'Lens demosaicing fell back at realistic pitch')
+        self.assertTrue(np.all(mask[np.round(mic_list[:, 0]).astype('int'), np.round(mic_list[:, 1]).astype('int')]))
+        self.assertTrue(np.allclose(ref_img[mask], rgb_img[mask], atol=1e-6), 'Lens block demosaicing mismatch')
+
+        # micro images covering the full (rotated) sensor with gaps larger than the demosaicing halo
+        for pitch, method in [(30., 'bilinear'), (30., 'malvar'), (50., 'menon')]:
+            dims = [int(480/pitch/.866)+3, int(560/pitch)+3]
+            grid = GridFitter.grid_gen(dims=dims, pat_type='hex', hex_odd=0)
+            rot = np.array([[pitch, pitch/100, 240], [-pitch/100, pitch, 280], [0, 0, 1]])
+            mic_list = GridFitter.apply_transform(rot, grid)
+            ref_img = DMSC_FUNS[method](bay_img, 'GRBG')
+            rgb_img = obj.demosaic_lenses(bay_img, 'GRBG', method=method, mic_list=mic_list, size=7)
+            mask = obj.lens_mask
+            inside = (mic_list[:, 0] > 0) & (mic_list[:, 0] < 479) & (mic_list[:, 1] > 0) & (mic_list[:, 1] < 559)
+            ctrs = np.round(mic_list[inside, :2]).astype('int')
+            self.assertTrue(mask is not None and mask.mean() < .5, 'Full-sensor lens demosaicing fell back')
+            self.assertTrue(np.all(mask[ctrs[:, 0], ctrs[:, 1]]), 'Micro image centres not demosaiced')
+            self.assertTrue(np.allclose(ref_img[mask], rgb_img[mask], atol=1e-6), 'Full-sensor demosaicing mismatch')
+
+    def test_bayer_planes(self):
+
+        bay_img = np.random.default_rng(0).random((20, 26)).astype('float32')
+        ref_img = bay_img.copy()
+        obj = CfaProcessor(bay_img=bay_img, cfg=self.cfg, sta=self.sta)
+
+        # planes are views on the mosaic and gains are applied in place
+        planes = obj.bayer_planes(bay_img)
+        self.assertTrue(all(np.shares_memory(plane, bay_img) for plane in planes), 'Bayer planes are copies')
+        res_img = obj.apply_awb(bay_img, bay_pat='GRBG', gains=[1, 2, 3, 4])
+        self.assertTrue(res_img is bay_img, 'White balance not applied in place')
+        self.assertTrue(np.allclose(bay_img[1::2, 0::2], ref_img[1::2, 0::2]*3), 'Wrong gain assignment')
+
+    def test_raw_conditioning(self):
+
+        rng = np.random.default_rng(0)
+        bay_img = (rng.random((120, 160)) * .6 + .2).astype('float32')
+        bay_img[rng.integers(0, 120, 20), rng.integers(0, 160, 20)] = 1.
+        wht_img = rng.random((120, 160)) * .5 + .5
+        dft_map = np.zeros(bay_img.shape, dtype='bool')
+        dft_map[[0, 31, 32, 59, 119], [3, 40, 40, 158, 0]] = True
+        self.cfg.lfpimg = {'bay': 'GRBG', 'awb': [1.5, 1., 2., 1.1], 'exp': -.3}
+
+        # separate passes
+        ref_img = CfaOutliers.correct_defects(bay_img.copy(), dft_map)
+        ref_img /= wht_img / np.percentile(wht_img, q=99.9)
+        obj = CfaProcessor(bay_img=ref_img, wht_img=wht_img / np.percentile(wht_img, q=99.9), cfg=self.cfg)
+        obj.safe_bayer_awb()
+
+        # fused pass over row bands
+        fus_obj = RawConditioner(bay_img=bay_img.copy(), wht_img=wht_img, defect_map=dft_map, vign_opt=True,
+                                 band_rows=32, cfg=self.cfg, sta=self.sta)
+        fus_obj.main()
+
+        self.assertTrue(np.allclose(obj._bay_img, fus_obj.bay_img, atol=1e-5), 'Fused raw conditioning mismatch')
+
+        # cached constants are keyed by the full white image rather than a subsample
+        rcp_img, _ = RawConditioner.precompute(wht_img)
+        wht_img[1, 1] *= .5
+        self.assertTrue(RawConditioner.precompute(wht_img)[0][1, 1] != rcp_img[1, 1], 'Stale raw conditioning cache')
+
+    def test_flat_field_cache(self):
+
+        rng = np.random.default_rng(0)
+        lfp_img = rng.random((60, 80))
+        wht_img = rng.random((60, 80)) * .5 + .5
+        wht_img[0, 0] = 0
+        self.cfg.calibs = {self.cfg.mic_list: [[7., 7., 0, 0], [7., 21., 0, 1], [21., 7., 1, 0], [21., 21., 1, 1]],
+                           self.cfg.ptc_mean: [14., 14.]}
+
+        # reference division by normalized white image
+        wht_nrm = wht_img / np.percentile(wht_img, q=99.9)
+        ref_img = np.divide(lfp_img, wht_nrm, out=np.zeros_like(lfp_img), where=wht_nrm != 0)
+
+        rcp_imgs = []
+        wht_ref = wht_img.copy()
+        for _ in range(2):
+            obj = LfpDevignetter(lfp_img=lfp_img, wht_img=wht_img, cfg=self.cfg, sta=self.sta)
+            obj.main()
+            rcp_imgs.append(obj.rcp_img)
+            self.assertTrue(np.allclose(obj.lfp_img, ref_img, rtol=1e-5), 'De-vignetting mismatch')
+            self.assertTrue(np.allclose(obj.wht_img, wht_nrm), 'White image normalization mismatch')
+            self.assertTrue(np.array_equal(wht_img, wht_ref), 'White image of caller modified')
+
+        self.assertTrue(rcp_imgs[0] is rcp_imgs[1] and rcp_imgs[0].dtype == 'float32', 'Flat-field not cached')
+
+        # change of a single white image pixel invalidates cached flat-field
+        wht_img[1, 1] *= .5
+        obj = LfpDevignetter(lfp_img=lfp_img, wht_img=wht_img, cfg=self.cfg, sta=self.sta)
+        obj.flat_field()
+        self.assertTrue(obj.rcp_img is not rcp_imgs[0] and obj.rcp_img[1, 1] != rcp_imgs[0][1, 1], 'Stale flat-field')
+
+        # white image files are identified by path and modification time without hashing the image data
+        with tempfile.TemporaryDirectory() as tmp:
+            self.cfg.params[self.cfg.cal_path] = os.path.join(tmp, 'wht.npy')
+            np.save(self.cfg.params[self.cfg.cal_path], wht_img)
+            wht_key = LfpAlignStore.wht_digest(self.cfg, wht_img)
+            wht_img[2, 2] *= .5
+            self.assertEqual(wht_key, LfpAlignStore.wht_digest(self.cfg, wht_img))
+            os.utime(self.cfg.params[self.cfg.cal_path], (0, 0))
+            self.assertNotEqual(wht_key, LfpAlignStore.wht_digest(self.cfg, wht_img), 'Stale white image digest')
+
+            # flat-field and raw conditioning caches are shared across captures given the digest
+            obj = LfpDevignetter(lfp_img=lfp_img, wht_img=wht_img, cfg=self.cfg, sta=self.sta, wht_key=wht_key)
+            rcp_img = obj.flat_field()
+            obj = LfpDevignetter(lfp_img=lfp_img, wht_img=wht_img, cfg=self.cfg, sta=self.sta, wht_key=wht_key)
+            self.assertIs(rcp_img, obj.flat_field(), 'Flat-field not cached by digest')
+            consts = RawConditioner.precompute(wht_img, rcp_img=rcp_img, wht_key=obj.cache_key())
+            self.assertIs(consts[0], RawConditioner.precompute(wht_img, rcp_img=rcp_img, wht_key=obj.cache_key())[0])
+
+    def test_patch_flat_field(self):
+
+        wht_img = np.random.default_rng(0).random((28, 28)) * .5 + .5
+        self.cfg.calibs = {self.cfg.mic_list: [[7., 7., 0, 0], [7., 21., 0, 1], [21., 7., 1, 0], [21., 21., 1, 1]],
+                           self.cfg.ptc_mean: [14., 14.]}
+        self.cfg.params[self.cfg.ptc_leng] = 11
+
+        obj = LfpDevignetter(lfp_img=wht_img, wht_img=wht_img, noise_lev=1., cfg=self.cfg, sta=self.sta)
+        obj._rcp_img = np.zeros(wht_img.shape)
+        obj.patch_flat_field(margin=1)
+
+        # compare batched regression with fit of single micro image
+        _, weight_win = obj.fit_patch(wht_img[1:14, 1:14])
+        self.assertTrue(np.allclose(obj.rcp_img[1:14, 1:14], 1/weight_win, rtol=1e-4), 'Batched patch fit mismatch')
+
+        # patch fit enabled by config for noisy white images
+        self.cfg.params[self.cfg.opt_vfit] = True
+        obj = LfpDevignetter(lfp_img=wht_img, wht_img=wht_img, noise_lev=1., cfg=self.cfg, sta=self.sta)
+        rcp_img = obj.flat_field()
+        self.assertTrue(obj.patch_mode and rcp_img.dtype == 'float32', 'Patch mode not enabled by config')
+        self.assertTrue(np.allclose(rcp_img[1:14, 1:14], 1/weight_win, rtol=1e-4), 'Patch flat-field mismatch')
+
+    def test_rotation_matrix(self):
+
+        lfp_img = gaussian_filter(np.random.default_rng(0).random((200, 300)), 3)
+        mic_list = np.array([[50., 60., 0, 0], [120., 200., 1, 1]])
+
+        obj = LfpRotator(lfp_img, mic_list.copy(), rad=np.deg2rad(5), cfg=self.cfg, sta=self.sta)
+        obj.main()
+        rot_mat = obj.rot_mat
+
+        # centroids are rotated by the same matrix
+        mic_rot = np.dot(rot_mat, np.vstack([mic_list[:, :2].T, np.ones(2)]))[:2].T
+        self.assertTrue(np.allclose(np.asarray(obj.centroids)[:, :2], mic_rot), 'Centroid rotation mismatch')
+
+        # sampling raw image at inversely mapped positions reproduces the rotated image
+        ys, xs = np.mgrid[30:170, 30:270]
+        inv_mat = np.linalg.inv(rot_mat)
+        coords = [inv_mat[0, 0]*ys + inv_mat[0, 1]*xs + inv_mat[0, 2], inv_mat[1, 0]*ys + inv_mat[1, 1]*xs + inv_mat[1, 2]]
+        self.assertTrue(np.allclose(map_coordinates(lfp_img, coords, order=3), obj.lfp_img[30:170, 30:270], atol=1e-3))
+
+        # fused de-rotation in chunks of lens rows (prefiltered once) matches cubic interpolation of each micro image
+        img = gaussian_filter(np.random.default_rng(0).random((130, 150, 3)), (2, 2, 0))
+        mic_list = GridFitter.apply_transform(np.diag([14., 14., 1]), GridFitter.grid_gen(dims=[6, 8], pat_type='rec'))
+        mic_list[:, :2] += 25
+        self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'rec', self.cfg.ptc_mean: [14., 14.]}
+        self.cfg.params[self.cfg.ptc_leng] = 13
+        rot_mat = np.array([[np.cos(.01), -np.sin(.01), 1.], [np.sin(.01), np.cos(.01), -1.], [0, 0, 1]])
+        lfp_local_resampler.LENS_CHUNK, chunk = 16, lfp_local_resampler.LENS_CHUNK
+        obj = LfpLocalResampler(lfp_img=img, cfg=self.cfg, sta=self.sta, rot_mat=rot_mat)
+        obj.local_resampling()
+        lfp_local_resampler.LENS_CHUNK = chunk
+        offsets = np.arange(13) - 6
+        inv_mat = np.linalg.inv(rot_mat)
+        for ly, lx in [(0, 0), (3, 5), (5, 7)]:
+            ys, xs = np.meshgrid(obj._mic_lut[ly, lx, 0] + offsets, obj._mic_lut[ly, lx, 1] + offsets, indexing='ij')
+            coords = [inv_mat[0, 0]*ys + inv_mat[0, 1]*xs + inv_mat[0, 2],
+                      inv_mat[1, 0]*ys + inv_mat[1, 1]*xs + inv_mat[1, 2]]
+            ref = np.stack([map_coordinates(img[..., p], coords, order=3, mode='constant') for p in range(3)], -1)
+            res = obj.lfp_img_align[ly*13:(ly+1)*13, lx*13:(lx+1)*13]
+            self.assertTrue(np.allclose(ref, res, atol=1e-5), 'Fused de-rotation mismatch')
+
+    def test_hex_stretch(self):
+
+        grid = GridFitter.grid_gen(dims=[4, 7], pat_type='hex', hex_odd=0)
+        mic_list = GridFitter.apply_transform(np.diag([14., 14., 1]), grid)
+        mic_list[:, :2] += 20
+        self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'hex', self.cfg.ptc_mean: [14., 14.]}
+
+        obj = LfpGlobalResampler(lfp_img=np.zeros((60, 60)), cfg=self.cfg, sta=self.sta)
+        obj._limg_pitch = np.array([4, 4])
+        lf_row = np.random.default_rng(0).random((4, 7*4, 2))
+        interp_stack = obj.hex_stretch(lf_row)
+
+        # compare with 1-D interpolation along lens index for each micro image position
+        lens_new_x = int(round(7 * 2 / np.sqrt(3)))
+        for y, x, p in np.ndindex(4, 4, 2):
+            ref = np.interp(np.linspace(0, 7, lens_new_x), range(7), lf_row[y, x::4, p])
+            self.assertTrue(np.allclose(interp_stack[y, x::4, p], ref), 'Hexagonal stretch mismatch')
+
+        # hexagonal alignment in chunks of lens rows matches alignment of all rows at once
+        img = gaussian_filter(np.random.default_rng(0).random((110, 140, 3)), (2, 2, 0))
+        mic_list = GridFitter.apply_transform(np.diag([14., 14., 1]), GridFitter.grid_gen(dims=[6, 8], pat_type='hex'))
+        mic_list[:, :2] += 20
+        self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'hex', self.cfg.ptc_mean: [14., 14.]}
+        lfp_imgs = []
+        for lens_chunk in [lfp_global_resampler.LENS_CHUNK, 16]:
+            lfp_global_resampler.LENS_CHUNK, chunk = lens_chunk, lfp_global_resampler.LENS_CHUNK
+            obj = LfpGlobalResampler(lfp_img=img, cfg=self.cfg, sta=self.sta)
+            obj.global_resampling()
+            lfp_imgs.append(obj.lfp_img_align)
+            lfp_global_resampler.LENS_CHUNK = chunk
+        self.assertTrue(np.array_equal(*lfp_imgs), 'Chunked hexagonal alignment mismatch')
+
+        lfp_imgs = []
+        for lens_chunk in [lfp_local_resampler.LENS_CHUNK, 16]:
+            lfp_local_resampler.LENS_CHUNK, chunk = lens_chunk, lfp_local_resampler.LENS_CHUNK
+            obj = LfpLocalResampler(lfp_img=img, cfg=self.cfg, sta=self.sta)
+            obj.local_resampling()
+            lfp_imgs.append(obj.lfp_img_align)
+            lfp_local_resampler.LENS_CHUNK = chunk
+        self.assertTrue(np.array_equal(*lfp_imgs), 'Chunked local hexagonal alignment mismatch')
+
+    def test_shift_weights(self):
+
+        frac = np.random.default_rng(0).random(10) - .5
+        ramp = np.arange(9, dtype='float')
+
+        # linear and cubic kernels reproduce shifted ramps (except for replicated edges)
+        for method in ['linear', 'cubic']:
+            shifted = np.dot(shift_weights(frac, 9, method), ramp)
+            self.assertTrue(np.allclose(shifted[:, 2:-2], ramp[2:-2] + frac[:, None]), 'Shift mismatch for %s' % method)
+            self.assertTrue(np.allclose(shift_weights(frac, 9, method).sum(-1), 1), 'Weights do not sum up to one')
+
+        # nearest neighbor selects exactly one sample for offsets halfway between two pixels
+        weights = shift_weights(np.array([-.5, -.25, 0, .25, .5]), 9, 'nearest')
+        self.assertTrue(np.array_equal(weights.sum(-1), np.ones((5, 9))), 'Nearest weights do not sum up to one')
+        self.assertTrue(np.array_equal(np.dot(weights, ramp)[:, 4], [3, 4, 4, 4, 4]), 'Nearest shift mismatch')
+
+    def test_mic_lut(self):
+
+        grid = GridFitter.grid_gen(dims=[5, 6], pat_type='rec')
+        mic_list = GridFitter.apply_transform(np.diag([14., 14., 1]), grid)
+        mic_list[:, :2] += 20
+        mic_miss, mic_list = mic_list[7], np.delete(mic_list, 7, axis=0)
+        self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'rec'}
+
+        obj = LfpMicroLenses(lfp_img=np.zeros((100, 120)), cfg=self.cfg, sta=self.sta)
+
+        # single, row and array lookups
+        for y, x, ly, lx in mic_list:
+            self.assertEqual(obj.get_coords_by_idx(int(ly), int(lx)), (y, x))
+        row = mic_list[mic_list[:, 2] == 2]
+        self.assertTrue(np.array_equal(obj.get_coords_by_row(2)[row[:, 3].astype('int')], row[:, :2]))
+        ys, xs = obj.get_coords_by_idx(mic_list[:, 2].astype('int'), mic_list[:, 3].astype('int'))
+        self.assertTrue(np.array_equal(np.stack([ys, xs], axis=-1), mic_list[:, :2]))
+
+        # missing lens yields NaN
+        ly, lx = mic_miss[2:].astype('int')
+        self.assertTrue(np.all(np.isnan(obj.mic_lut[ly, lx])), 'Missing lens not marked')
+
+    def test_lens_iteration(self):
+
+        grid = GridFitter.grid_gen(dims=[12, 10], pat_type='rec')
+        mic_list = GridFitter.apply_transform(np.diag([15., 15., 1]), grid)
+        mic_list[:, :2] += 20 - mic_list[:, :2].min(0)
+        self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'rec'}
+        self.cfg.params[self.cfg.ptc_leng] = 9
+
+        lfp_img_align = np.random.rand(12*15, 10*15, 3)
+        obj = LfpCropper(lfp_img_align=lfp_img_align, cfg=self.cfg, sta=self.sta)
+        obj.main()
+        ref_img = obj.lfp_img_align
+        self.assertEqual(ref_img.shape, (12*9, 10*9, 3))
+
+        # per-lens iteration (serial and on threads) matches single-reshape crop
+        for workers in [1, 3]:
+            obj = LensCropper(lfp_img_align=lfp_img_align, cfg=self.cfg, sta=self.sta, workers=workers)
+            obj.main()
+            self.assertTrue(np.array_equal(obj.lfp_img_align, ref_img), 'Per-lens crop mismatch')
+
+        # threaded iteration visits each lens once and stops on interrupt
+        visits = []
+        self.assertTrue(obj.proc_lens_iter(lambda ly, lx, arr: arr.append((ly, lx)), arr=visits, prnt=False, workers=3))
+        self.assertEqual(sorted(visits), [(ly, lx) for ly in range(12) for lx in range(10)])
+
+        def interrupt(ly, lx):
+            self.sta.interrupt = ly == 0 or self.sta.interrupt
+        self.assertFalse(obj.proc_lens_iter(interrupt, prnt=False, workers=3), 'Interrupt not propagated')
+        self.sta.interrupt = False
+
+    def test_align_store(self):
+
+        grid = GridFitter.grid_gen(dims=[6, 5], pat_type='rec')
+        mic_list = GridFitter.apply_transform(np.diag([9., 9., 1]), grid)
+        self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'rec'}
+        lfp_img_align = (np.random.rand(6*9, 5*9, 3) * 2**16).astype('uint16')
+
+        with tempfile.TemporaryDirectory() as exp_path:
+            obj = LfpAlignStore(cfg=self.cfg, sta=self.sta, exp_path=exp_path, chunk_rows=7)
+            obj.write(lfp_img_align, pitch=[9, 9], hex_odd=0)
+            arr, meta = obj.read()
+
+            # memory-mapped round trip with geometry from sidecar
+            self.assertTrue(isinstance(arr, np.memmap), 'Aligned light-field not memory-mapped')
+            self.assertTrue(np.array_equal(arr, lfp_img_align))
+            self.assertEqual((meta['pitch'], meta['lens_y_max'], meta['lens_x_max']), ([9, 9], 6, 5))
+            mics = LfpAlignStore.micro_images(arr, meta)
+            self.assertTrue(np.array_equal(mics[2, :, 3], lfp_img_align[18:27, 27:36]))
+
+            # pitch is taken from sidecar
+            self.assertTrue(np.array_equal(LfpMicroLenses(lfp_img_align=arr, align_meta=meta, cfg=self.cfg,
+                                                          sta=self.sta).lfp_align_pitch(), [9, 9]))
+
+            # store of a different calibration is rejected
+            self.cfg.calibs[self.cfg.mic_list] = (mic_list + [1, 0, 0, 0]).tolist()
+            self.assertEqual(obj.read(), (None, None))
+            del arr, mics
+
+    def test_align_lut(self):
+
+        img = gaussian_filter(np.random.rand(300, 340, 3), (2, 2, 0))
+        self.cfg.params[self.cfg.ptc_leng] = 13
+
+        with tempfile.TemporaryDirectory() as exp_path:
+            self.cfg.params[self.cfg.lfp_path] = exp_path + '/lfp.png'
+            self.cfg.params[self.cfg.cal_meta] = ''
+            for pat_type in ['rec', 'hex']:
+                grid = GridFitter.grid_gen(dims=[16, 19], pat_type=pat_type, hex_odd=0)
+                mic_list = GridFitter.apply_transform(np.array([[15.2, .3, 0], [-.2, 15.1, 0], [0, 0, 1]]), grid)
+                mic_list[:, :2] += 25 - mic_list[:, :2].min(0)
+                self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: pat_type,
+                                   self.cfg.ptc_mean: [15.2, 15.1]}
+                for meth in ['global', 'local']:
+                    self.cfg.params[self.cfg.smp_meth] = meth
+                    obj = LfpResampler(lfp_img=img, cfg=self.cfg, sta=self.sta)
+                    obj.global_resampling() if meth == 'global' else obj.local_resampling()
+                    ref_img = obj.lfp_img_align
+
+                    # remap table reproduces (bilinear) alignment and is reused from disk
+                    for _ in range(2):
+                        obj = LfpResampler(lfp_img=img, cfg=self.cfg, sta=self.sta, lut_opt=True)
+                        obj.lut_resampling()
+                        self.assertTrue(np.allclose(obj.lfp_img_align, ref_img, atol=1e-6),
+                                        'Mismatch for %s %s LUT' % (pat_type, meth))
+                        LfpAlignLut._cache.clear()
+
+            # hexagonal global alignment is computed without table
+            self.assertEqual(len([fn for fn in os.listdir(self.cfg.exp_path) if fn.startswith('lfp_align_lut')]), 3)
+
+        # table usage enabled by config
+        self.cfg.params[self.cfg.opt_lut_] = True
+        self.assertTrue(LfpAligner(img, cfg=self.cfg, sta=self.sta)._lut_opt, 'Look-up table not enabled by config')
+
+    def test_angular_crop(self):
+
+        img = gaussian_filter(np.random.rand(300, 340, 3), (2, 2, 0))
+        grid = GridFitter.grid_gen(dims=[16, 19], pat_type='rec')
+        mic_list = GridFitter.apply_transform(np.array([[15.2, .3, 0], [-.2, 15.1, 0], [0, 0, 1]]), grid)
+        mic_list[:, :2] += 25 - mic_list[:, :2].min(0)
+        self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'rec'}
+        self.cfg.params[self.cfg.ptc_leng] = 11
+
+        # full projective warp cropped afterwards
+        obj = LfpResampler(lfp_img=img, cfg=self.cfg, sta=self.sta)
+        tra_mat, oshape = obj.projective_matrix()
+        ref_img = transform.warp(img, transform.ProjectiveTransform(matrix=tra_mat).inverse, output_shape=oshape)
+        obj = LfpCropper(lfp_img_align=ref_img, align_meta={'pitch': [15, 15]}, cfg=self.cfg, sta=self.sta)
+        obj.main()
+        ref_img = obj.lfp_img_align
+
+        # resampler only interpolates samples surviving the crop
+        obj = LfpResampler(lfp_img=img, cfg=self.cfg, sta=self.sta)
+        obj.global_resampling()
+        self.assertTrue(np.array_equal(obj._limg_pitch, [11, 11]))
+        self.assertTrue(np.allclose(obj.lfp_img_align, ref_img))
+
+        # cropper leaves aligned light-field of requested size untouched
+        lfp_img_align = obj.lfp_img_align
+        obj = LfpCropper(lfp_img_align=lfp_img_align, align_meta={'pitch': [11, 11]}, cfg=self.cfg, sta=self.sta)
+        obj.main()
+        self.assertTrue(np.array_equal(obj.lfp_img_align, lfp_img_align))
+
+    def test_roi_alignment(self):
+
+        img = gaussian_filter(np.random.rand(300, 340, 3), (2, 2, 0))
+        grid = GridFitter.grid_gen(dims=[16, 19], pat_type='rec')
+        mic_list = GridFitter.apply_transform(np.array([[15.2, .3, 0], [-.2, 15.1, 0], [0, 0, 1]]), grid)
+        mic_list[:, :2] += 25 - mic_list[:, :2].min(0)
+        self.cfg.params[self.cfg.ptc_leng] = 11
+        self.cfg.params[self.cfg.smp_meth] = 'local'
+        self.cfg.params[self.cfg.opt_rota] = False
+        self.cfg.params[self.cfg.cal_meta] = ''
+        self.cfg.lfpimg = {}
+
+        with tempfile.TemporaryDirectory() as exp_path:
+            self.cfg.params[self.cfg.lfp_path] = exp_path + '/lfp.png'
+            res = []
+            self.cfg.calibs = {self.cfg.mic_list: mic_list.tolist(), self.cfg.pat_type: 'rec'}
+            for kwargs in [{}, {'roi': (120, 150, 200, 240)}, {'lens_roi': (4, 5, 9, 11)}]:
+                obj = LfpAligner(img.copy(), cfg=self.cfg, sta=self.sta, **kwargs)
+                obj.main()
+                res.append((obj.lfp_img.astype('float'), obj.roi_offset))
+
+            # lens index offsets are recorded in metadata
+            self.assertEqual(LfpAlignStore(cfg=self.cfg, sta=self.sta).read_meta()['roi'], res[-1][1])
+            self.assertEqual(res[-1][1]['lens_offset'], [4, 5])
+
+            # calibration is left untouched for a subsequent full-frame alignment with the same config
+            self.assertEqual(self.cfg.calibs[self.cfg.mic_list], mic_list.tolist())
+            obj = LfpAligner(img.copy(), cfg=self.cfg, sta=self.sta)
+            obj.main()
+            self.assertTrue(np.array_equal(obj.lfp_img, res[0][0]), 'Full-frame alignment altered by ROI alignment')
+
+        # aligned region matches corresponding part of full alignment (up to normalization)
+        for roi_img, roi_offset in res[1:]:
+            ly, lx = roi_offset['lens_offset']
+            ref_img = res[0][0][ly*11:ly*11+roi_img.shape[0], lx*11:lx*11+roi_img.shape[1]]
+            self.assertGreater(np.corrcoef(ref_img.ravel(), roi_img.ravel())[0, 1], 1-1e-6)
+
+    def test_viewpoint_view(self):
+
+        self.cfg.params[self.cfg.ptc_leng] = 5
+        lfp_img_align = np.random.rand(5*12, 5*14, 3)
+
+        # viewpoints are a view of aligned light-field matching strided slices
+        obj = LfpRearranger(lfp_img_align, cfg=self.cfg, sta=self.sta)
+        obj.main()
+        self.assertTrue(np.shares_memory(obj.vp_img_arr, lfp_img_align))
+        for j in range(5):
+            for i in range(5):
+                self.assertTrue(np.array_equal(obj.vp_img_arr[j, i], lfp_img_align[j::5, i::5]))
+
+        # materialization as copy or into preallocated buffer
+        vp_img_arr = obj.materialize()
+        self.assertTrue(vp_img_arr.flags['C_CONTIGUOUS'] and not np.shares_memory(vp_img_arr, lfp_img_align))
+        out = np.empty((5, 5, 12, 14, 3), dtype='float32')
+        self.assertTrue(obj.materialize(out=out) is out and np.allclose(out, vp_img_arr))
+
+        # inverse rearrangement of (copied) viewpoints
+        obj = LfpRearranger(None, vp_img_arr=vp_img_arr, cfg=self.cfg, sta=self.sta)
+        obj.decompose_viewpoints()
+        self.assertTrue(np.array_equal(obj._lfp_img_align, lfp_img_align))
+
+    def test_viewpoint_outliers(self):
+
+        def correct_outliers(img, n=2, perc=.2):
+            for j in range(n, img.shape[0]-n):
+                for i in range(n, img.shape[1]-n):
+                    win = img[j-n:j+n+1, i-n:i+n+1]
+                    num_hi = len(win[win > img[j, i]*(1-perc)])
+                    num_lo = len(win[win < img[j, i]*perc])
+                    if num_hi < win.size/(2*n+1) or num_lo > win.size/(2*n+1):
+                        img[j, i] = (sum(sum(img[j-1:j+2, i-1:i+2]))-img[j, i])/8.
+            return img
+
+        # smooth viewpoints with isolated hot and dead pixels
+        vp_img_arr = gaussian_filter(np.random.rand(3, 3, 40, 50, 3), (0, 0, 3, 3, 0)) + .5
+        vp_img_arr[:, :, 5:40:9, 5:50:9] *= np.random.choice([.01, 20], size=(3, 3, 4, 5, 1))
+        ref_arr = vp_img_arr.copy()
+        for j in range(3):
+            for i in range(3):
+                ref_arr[j, i] = correct_outliers(ref_arr[j, i])
+
+        obj = LfpOutliers(vp_img_arr=vp_img_arr, cfg=self.cfg, sta=self.sta)
+        obj.main()
+        self.assertTrue(np.allclose(obj.vp_img_arr, ref_arr))
+        self.assertFalse(np.allclose(obj.vp_img_arr, vp_img_arr))
+
+    def test_color_equalization(self):
+
+        self.cfg.params[self.cfg.opt_colo] = True
+        self.cfg.params[self.cfg.ptc_leng] = 5
+        vp_img_arr = np.random.rand(5, 5, 20, 30, 3) * np.random.rand(5, 5, 1, 1, 3)
+        ref_img = vp_img_arr[2, 2].copy()
+        ref_arr = np.array([[ColorMatcher(vp, ref_img, method='hm-mkl-hm').main() for vp in row] for row in vp_img_arr])
+
+        # chunked equalization matches per-view color matcher for all executors (threads by default)
+        self.assertEqual(LfpColorEqualizer(vp_img_arr=vp_img_arr, cfg=self.cfg, sta=self.sta)._executor, 'thread')
+        for executor in (None, 'thread', 'process'):
+            obj = LfpColorEqualizer(vp_img_arr=vp_img_arr, cfg=self.cfg, sta=self.sta, executor=executor, workers=2)
+            obj.proc_central()
+            self.assertTrue(np.allclose(obj.vp_img_arr, ref_arr), 'Mismatch for %s executor' % executor)
+
+    def test_fused_ccm(self):
+
+        img = np.random.rand(3, 3, 20, 30, 3) * 4
+        ccm_mat = np.array([[2.48, -1.1, -.38], [-.37, 1.67, -.3], [-.19, -.73, 1.92]]).T
+        sat_lev = 2 ** .5
+
+        # separate passes of normalization, exposure scale, color correction, clamping and normalization
+        ref_img = img / img.max() * sat_lev
+        ref_img = CfaProcessor.correct_color(ref_img, ccm_mat=ccm_mat)
+        ref_img = np.clip(ref_img, 0, sat_lev)
+        ref_img /= ref_img.max()
+
+        res_img = CfaProcessor.correct_color_fused(img, ccm_mat=ccm_mat, sat_lev=sat_lev, chunk=100)
+        self.assertTrue(res_img is img and np.allclose(res_img, ref_img))
+
+    def test_fast_percentile(self):
+
+        arr = np.random.default_rng(0).random((5, 5, 60, 80, 3)) ** 3
+        qs = [.05, 50, 99.9, 99.995]
+
+        # histogram-based percentiles within one bin width and exact mode
+        bin_width = (arr.max() - arr.min()) / 2**12
+        res = fast_percentile(arr, qs, bins=2**12)
+        self.assertTrue(np.all(np.abs(res - np.percentile(arr, qs)) <= bin_width))
+        self.assertTrue(np.array_equal(fast_percentile(arr, qs, exact=True), np.percentile(arr, qs)))
+        self.assertTrue(np.isscalar(fast_percentile(arr, 99.9)) and fast_percentile(np.ones(2**20), 5) == 1)
+
+    def test_contrast_conversions(self):
+
+        self.cfg.params[self.cfg.ptc_leng] = 3
+        vp_img_arr = np.random.default_rng(0).random((3, 3, 20, 30, 3)) * .8 + .1
+        vp_img_arr[0, 0, 0, :3] = [.5, .5, .5]
+
+        # per-view conversions of contrast balance
+        lum = yuv_conv(vp_img_arr[1, 1])[..., 0]
+        ref_arr = np.array([[yuv_conv(img) for img in row] for row in vp_img_arr])
+        ref_arr[..., 0] = Normalizer(ref_arr[..., 0]).type_norm(max=lum.max(), min=lum.min())
+        ref_arr = np.array([[yuv_conv(img, inverse=True) for img in row] for row in ref_arr])
+
+        obj = LfpContrast(vp_img_arr=vp_img_arr, cfg=self.cfg, sta=self.sta)
+        obj.con_bal()
+        self.assertTrue(obj.vp_img_arr.dtype == 'float32' and np.allclose(obj.vp_img_arr, ref_arr, atol=1e-5))
+
+        # per-view conversions of saturation balance
+        ref_arr = np.array([[hsv_conv(img) for img in row] for row in vp_img_arr])
+        ref_arr[..., 1] *= 1.1
+        ref_arr = np.array([[hsv_conv(img, inverse=True) for img in row] for row in ref_arr])
+
+        obj = LfpContrast(vp_img_arr=vp_img_arr, cfg=self.cfg, sta=self.sta)
+        obj.sat_bal()
+        self.assertTrue(np.allclose(obj.vp_img_arr, ref_arr, atol=1e-5))
+
+    def test_stretch_cut_points(self):
+
+        ref_ch = np.random.default_rng(0).random((40, 60)) ** 2
+        obj = LfpContrast(p_lo=.01, p_hi=.99, cfg=self.cfg, sta=self.sta)
+
+        # cut points from cumulative histogram agree with percentiles in bin units
+        val_lim = 2**12
+        h = np.histogram(ref_ch, bins=val_lim)[0]
+        px = obj.find_cut_points(np.cumsum(h) / h.sum(), [0, .01, .99, 1])
+        ref_px = (np.percentile(ref_ch, [1, 99]) - ref_ch.min()) / np.ptp(ref_ch) * val_lim
+        self.assertTrue(px[0] == 0 and px[-1] == val_lim and np.allclose(px[1:3], ref_px, atol=2))
+
+        # contrast and brightness are cached per reference
+        contrast, brightness = obj.set_stretch(ref_ch, val_lim=val_lim)
+        self.assertAlmostEqual(contrast * px[1] + brightness, 0)
+        self.assertAlmostEqual(contrast * px[2] + brightness, val_lim)
+        num = len(LfpContrast._cache)
+        self.assertEqual(obj.set_stretch(ref_ch.copy(), val_lim=val_lim), (contrast, brightness))
+        self.assertEqual(len(LfpContrast._cache), num)
+
+    def test_all(self):
+
+        self.test_hot_pixels()
+        self.test_tiled_demosaicing()
+        self.test_lens_demosaicing()
+        self.test_bayer_planes()
+        self.test_raw_conditioning()
+        self.test_flat_field_cache()
+        self.test_patch_flat_field()
+        self.test_rotation_matrix()
+        self.test_hex_stretch()
+        self.test_shift_weights()
+        self.test_mic_lut()
+        self.test_lens_iteration()
+        self.test_align_store()
+        self.test_align_lut()
+        self.test_angular_crop()
+        self.test_roi_alignment()
+        self.test_viewpoint_view()
+        self.test_viewpoint_outliers()
+        self.test_color_equalization()
+        self.test_fused_ccm()
+        self.test_fast_percentile()
+        self.test_contrast_conversions()
+        self.test_stretch_cut_points()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,9 +25,11 @@ import unittest
 import numpy as np
 from os.path import join
 import zipfile
+import tempfile
 from scipy.spatial.distance import cdist
 
-from plenopticam.lfp_calibrator import CentroidSorter, GridFitter, CentroidFitSorter, find_centroid
+from plenopticam.lfp_calibrator import CentroidSorter, GridFitter, CentroidFitSorter, find_centroid, LfpCalibrator, \
+    CentroidRefiner
 from plenopticam.cfg import PlenopticamConfig, constants
 from plenopticam.misc import load_img_file
 
@@ -221,12 +223,58 @@ class PlenoptiCamTesterCalib(unittest.TestCase):
 
             self.assertEqual(ref_size, obj.M)
 
+    def test_warm_start(self):
+
+        # parameter init
+        drift = np.array([.6, -.4])
+        pitch = 14.
+        self.cfg.params[self.cfg.cal_meth] = constants.CALI_METH[2]
+        self.cfg.params[self.cfg.cal_meta] = join(tempfile.mkdtemp(), 'warm_start.json')
+
+        for pat_type in ['rec', 'hex']:
+
+            # previous calibration and drifted micro image centers
+            grid = GridFitter.grid_gen(dims=[30, 30], pat_type=pat_type, hex_odd=0)
+            pmat = np.array([[pitch, .01, 220], [-.01, pitch, 220], [0, 0, 1]])
+            prev_mics = GridFitter.apply_transform(pmat, grid.copy())
+            true_mics = prev_mics.copy()
+            true_mics[:, :2] += drift
+
+            # synthetic white image with Gaussian spots at drifted centers
+            wht_img = np.zeros([460, 460])
+            for cy, cx in true_mics[:, :2]:
+                yy, xx = np.mgrid[int(cy)-10:int(cy)+11, int(cx)-10:int(cx)+11]
+                wht_img[yy, xx] += np.exp(-((yy-cy)**2 + (xx-cx)**2) / (2*3.**2))
+
+            calibs = {self.cfg.mic_list: prev_mics.tolist(), self.cfg.pat_type: pat_type, self.cfg.ptc_mean: [pitch]*2}
+            obj = LfpCalibrator(wht_img, cfg=self.cfg, calibs=calibs)
+            obj.main()
+
+            mic_list = np.array(obj.calibs[self.cfg.mic_list])
+            self.assertTrue(np.allclose(mic_list[:, :2], true_mics[:, :2], atol=.25), 'Warm-start calibration failed')
+
+    def test_refiner_border(self):
+
+        # spots with centroids at and close to the image border
+        wht_img = np.zeros([60, 60])
+        yy, xx = np.mgrid[:60, :60]
+        for cy, cx in [(30, 30), (2, 30), (30, 58)]:
+            wht_img += np.exp(-((yy-cy)**2 + (xx-cx)**2) / (2*2.**2))
+
+        obj = CentroidRefiner(wht_img, [[30, 30], [2, 30], [30, 58]], cfg=self.cfg, M=14)
+        obj.main()
+
+        self.assertTrue(np.array_equal(obj.valid_idx, [True, False, False]))
+        self.assertTrue(np.allclose(obj.centroids_refined, [[30, 30]], atol=.1))
+
     def test_all(self):
 
         self.test_mla_geometry_estimate()
         self.test_grid_gen()
         self.test_mla_dims_estimate()
         self.test_sorted_fitting()
+        self.test_warm_start()
+        self.test_refiner_border()
 
 
 if __name__ == '__main__':
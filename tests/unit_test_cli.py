@@ -59,7 +59,7 @@ class PlenoptiCamTesterCli(unittest.TestCase):
 
         # get rid of potential arguments from previous usage
         sys.argv = sys.argv[:1]
-        exp_vals = ['dummy.ext', 'wht.ext', '', 'area', 'global', 9, [0, 2]] + [True, ]*6 + [False] + [True, ]*5
+        exp_vals = ['dummy.ext', 'wht.ext', '', 'area', 'global', 'malvar', 9, [0, 2]] + [True, ]*6 + [False] + [True, ]*5
         usr_cmds = ['--' + cmd for cmd in CLIF_OPTS[2:]]
 
         for cmd, kw, exp_val in zip(usr_cmds, PARAMS_KEYS, exp_vals):
@@ -78,6 +78,11 @@ class PlenoptiCamTesterCli(unittest.TestCase):
 
             self.assertEqual(exp_val, val)
 
+        # options appended after the ones covered above
+        self.cfg = parse_options(['--lens', '--vfit', '--lut'], self.cfg)
+        for kw in [self.cfg.opt_lens, self.cfg.opt_vfit, self.cfg.opt_lut_]:
+            self.assertEqual(True, self.cfg.params[kw])
+
     def test_all(self):
 
         self.test_cli_help()
@@ -22,13 +22,12 @@ __license__ = """
 
 import unittest
 
-import pickle
 from os.path import join, exists, basename
 from os import listdir
 
 from plenopticam.lfp_reader import LfpReader
 from plenopticam.lfp_calibrator import LfpCalibrator, CaliFinder, CentroidDrawer
-from plenopticam.lfp_aligner import LfpAligner
+from plenopticam.lfp_aligner import LfpAligner, LfpAlignStore
 from plenopticam.lfp_extractor import LfpExtractor
 from plenopticam.lfp_refocuser import LfpRefocuser
 from plenopticam.cfg import PlenopticamConfig, constants
@@ -148,8 +147,7 @@ class PlenoptiCamTesterIllum(unittest.TestCase):
                 self.assertEqual(True, ret)
 
             # load previously computed light field alignment
-            with open(join(self.cfg.exp_path, 'lfp_img_align.pkl'), 'rb') as f:
-                lfp_img_align = pickle.load(f)
+            lfp_img_align, _ = LfpAlignStore(cfg=self.cfg, sta=self.sta).read()
 
             # extract viewpoint data
             CaliFinder(self.cfg).main()